@@ -1,24 +1,50 @@
-from .ai_provider import AIProvider
-from .cloud_manager import CloudManager
-from .cloud_ui import render_cloud_sync_ui
-from .bank_importer import BankImporter
-from .trader_agent import TraderAgent
-from .recipe_researcher import RecipeResearcher
-from .opencode_agent import OpencodeAgent, OpencodeConfig, OpencodeResult
-from .opencode_debate import OpencodeDebate, DebateRound, DebateRecord, DebateHistory
-
-__all__ = [
-    "AIProvider",
-    "CloudManager",
-    "render_cloud_sync_ui",
-    "BankImporter",
-    "TraderAgent",
-    "RecipeResearcher",
-    "OpencodeAgent",
-    "OpencodeConfig",
-    "OpencodeResult",
-    "OpencodeDebate",
-    "DebateRound",
-    "DebateRecord",
-    "DebateHistory",
-]
+"""Agenti e provider AI.
+
+Le classi esportate vengono importate al primo accesso (PEP 562), così
+`import agents` non carica Streamlit, pandas, PyGithub o gli SDK dei
+provider finché non servono.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+_EXPORTS = {
+    "AIProvider": ".ai_provider",
+    "CloudManager": ".cloud_manager",
+    "render_cloud_sync_ui": ".cloud_ui",
+    "BankImporter": ".bank_importer",
+    "TraderAgent": ".trader_agent",
+    "RecipeResearcher": ".recipe_researcher",
+    "OpencodeAgent": ".opencode_agent",
+    "OpencodeConfig": ".opencode_agent",
+    "OpencodeResult": ".opencode_agent",
+    "OpencodeDebate": ".opencode_debate",
+    "DebateRound": ".opencode_debate",
+    "DebateRecord": ".opencode_debate",
+    "DebateHistory": ".opencode_debate",
+}
+
+__all__ = list(_EXPORTS)
+
+if TYPE_CHECKING:
+    from .ai_provider import AIProvider
+    from .cloud_manager import CloudManager
+    from .cloud_ui import render_cloud_sync_ui
+    from .bank_importer import BankImporter
+    from .trader_agent import TraderAgent
+    from .recipe_researcher import RecipeResearcher
+    from .opencode_agent import OpencodeAgent, OpencodeConfig, OpencodeResult
+    from .opencode_debate import OpencodeDebate, DebateRound, DebateRecord, DebateHistory
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,62 +1,85 @@
 """Modulo AI Provider per la selezione dinamica del modello Gemini e Ollama."""
 
-from typing import Optional, List, Any, Union, Iterator
+from dataclasses import dataclass, field
+from typing import Optional, List, Any, Union, Iterator, AsyncIterator, Sequence, Tuple, Callable
+import asyncio
+import copy
+import io
 import os
 import time
-import random
 import re
-import ollama
-import requests
 import subprocess
+import threading
 import glob
-from bs4 import BeautifulSoup
-
-from google import genai
-from google.genai import types
-from google.api_core.exceptions import (
-    ResourceExhausted,
-    ServiceUnavailable,
-    NotFound,
-    InvalidArgument,
-    InternalServerError,
-)
-
-# Tentativo di importazione sicura per Ollama e PyMuPDF (fitz)
-try:
-    OLLAMA_AVAILABLE = True
-except ImportError:
-    OLLAMA_AVAILABLE = False
-
-try:
-    import fitz  # PyMuPDF
-    import io
-
-    PYMUPDF_AVAILABLE = True
-except ImportError:
-    PYMUPDF_AVAILABLE = False
-    fitz = None
 
-try:
-    import groq
-
-    GROQ_AVAILABLE = True
-except ImportError:
-    GROQ_AVAILABLE = False
+from .batch import DEFAULT_CONCURRENCY, BatchResult, arun_batch, run_batch
+from .client_pool import get_async_client, get_client, get_http_session
+from .context_budget import cached_context, family_context, fit_prompt, invalidate_context, max_num_ctx
+from .lazy import LazyModule, is_available
+from .hedging import arun_hedged, hedge_delay, hedge_stats, is_valid_response, run_hedged
+from .image_prep import PreparedImage, image_cache_stats, prepare_image, supports_vision
+from .json_stream import JsonStreamParser
+from .llamacpp_pool import get_pool, parse_backends, pool_stats
+from .llamacpp_server import add_spawn_listener, get_server, managed_server
+from .metrics import get_metrics
+from .ollama_warmup import (
+    keep_alive,
+    model_status,
+    note_loaded,
+    resident_num_ctx,
+    start_heartbeat,
+    stop_heartbeat,
+    warmup,
+    warmup_async,
+)
+from .model_catalog import FIRST_FETCH_WAIT_SEC, LOCAL_TTL_SEC, get_catalog
+from .model_router import BASE_COOLDOWN_SEC, FATAL_COOLDOWN_SEC, get_router
+from .prefix_cache import get_pinner, prefix_cache_stats, reset_pinner
+from .pdf_extract import PYMUPDF_AVAILABLE, extract_pdf_pages, iter_pdf_pages
+from .rate_limiter import (
+    estimate_tokens,
+    get_limiter,
+    is_rate_limit_error,
+    note_rate_limited,
+    rate_limit_stats,
+)
+from .replay import RECORD, REPLAY, get_cassette, replay_delay, replay_key, replay_mode
+from .response_cache import ResponseCache, get_default_cache, make_cache_key
+from .retry_policy import (
+    AttemptClock,
+    acall_with_retry,
+    aretry_stream,
+    call_with_retry,
+    get_retry_budget,
+    next_delay,
+    retry_stats,
+    retry_stream,
+)
+from .single_flight import get_single_flight, single_flight_enabled
 
-try:
-    import openai as openai_lib
+# Gli SDK dei provider vengono importati al primo uso (vedi lazy.py)
+OLLAMA_AVAILABLE = is_available("ollama")
+GROQ_AVAILABLE = is_available("groq")
+OPENAI_AVAILABLE = is_available("openai")
 
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+ollama = LazyModule("ollama")
+groq = LazyModule("groq")
+openai_lib = LazyModule("openai")
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+api_exceptions = LazyModule("google.api_core.exceptions")
 
 
 def process_multimodal_input(
-    prompt: Any, model_name: str = "Modello AI"
-) -> tuple[str, list]:
+    prompt: Any, model_name: str = "Modello AI", provider: Optional[str] = None
+) -> tuple[str, List[PreparedImage]]:
     """
     Estrae testo e immagini dal prompt multimodale.
     Converte PDF in testo usando PyMuPDF per maggiore robustezza.
+    Una parte PDF può limitare l'estrazione con le chiavi opzionali
+    "pages" (indici 0-based, es. range(0, 5)) e "max_chars".
+    Con provider le immagini vengono ridimensionate e ricodificate per
+    quel backend (image_prep), altrimenti passano invariate.
     """
     final_text_parts = []
     images = []
@@ -78,18 +101,26 @@ def process_multimodal_input(
                     # PDF Text Extraction Handling with PyMuPDF
                     if PYMUPDF_AVAILABLE:
                         try:
-                            print("      -> Avvio estrazione PDF con PyMuPDF...")
-                            doc = fitz.open(stream=data, filetype="pdf")
-                            text_content = []
-                            for page_num, page in enumerate(doc):
-                                page_text = page.get_text()
-                                if page_text.strip():
-                                    text_content.append(page_text)
-                                print(
-                                    f"         Pagina {page_num+1}: {len(page_text)} caratteri estratti."
-                                )
-
-                            extracted = "\n".join(text_content)
+                            if "pages" in part or "max_chars" in part:
+                                # Estrazione parziale: si leggono solo le pagine richieste, fino a max_chars,
+                                # senza estrarre (né tenere in memoria) il resto del documento
+                                buffer = io.StringIO()
+                                page_count = 0
+                                for _, text in iter_pdf_pages(data, part.get("pages"), part.get("max_chars")):
+                                    if page_count:
+                                        buffer.write("\n")
+                                    buffer.write(text)
+                                    page_count += 1
+                                extracted = buffer.getvalue()
+                                source = "parziale"
+                            else:
+                                pages, cache_hit = extract_pdf_pages(data)
+                                page_count = len(pages)
+                                extracted = "\n".join(p for p in pages if p.strip())
+                                source = "cache" if cache_hit else "PyMuPDF"
+                            print(
+                                f"      -> PDF ({source}): {page_count} pagine, {len(extracted)} caratteri estratti."
+                            )
                             if extracted.strip():
                                 final_text_parts.append(
                                     f"\n--- INIZIO CONTENUTO PDF ---\n{extracted}\n--- FINE CONTENUTO PDF ---\n"
@@ -112,7 +143,10 @@ def process_multimodal_input(
                             "\n[AVVISO: Impossibile leggere il PDF fornito perché la libreria PyMuPDF (fitz) non è installata. Esegui 'pip install pymupdf'.]\n"
                         )
                 elif mime.startswith("image/"):
-                    images.append(data)
+                    if provider:
+                        images.append(prepare_image(data, provider, model_name))
+                    else:
+                        images.append(PreparedImage(data, mime))
                     print("      -> Immagine aggiunta al payload.")
                 else:
                     print(f"      ⚠️ MIME type {mime} non supportato, ignorato.")
@@ -124,64 +158,59 @@ def process_multimodal_input(
     return full_text, images
 
 
-class GroqWrapper:
-    """Wrapper per Groq (LPU Inference Engine)."""
-
-    def __init__(self, provider, model_name: str, json_mode: bool = False):
-        self.provider = provider
-        self.model_name = model_name or "llama-3.3-70b-versatile"
-        self.json_mode = json_mode
-        self.client = groq.Groq(api_key=self.provider.api_key)
-
-    def generate_content(self, prompt: Any):
-        """Genera contenuto usando Groq."""
-        try:
-            content, images = process_multimodal_input(prompt, self.model_name)
-
-            if images:
-                content += "\n[Image attached - Groq Vision not yet fully implemented in this wrapper]\n"
+def message_text(message: dict) -> str:
+    """Testo di un messaggio chat (content stringa o lista di parti text/image_url)."""
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if part.get("type") == "text")
 
-            messages = [{"role": "user", "content": content}]
-
-            response = self.client.chat.completions.create(
-                messages=messages,
-                model=self.model_name,
-                response_format={"type": "json_object"} if self.json_mode else None,
-            )
 
-            # Simulate response object with .text attribute
-            class Response:
-                def __init__(self, text):
-                    self.text = text
+@dataclass
+class TextResponse:
+    """Risposta uniforme tra i wrapper: .text più i metadati della chiamata.
 
-            return Response(response.choices[0].message.content)
+    I campi non forniti dal backend restano None. Gli stream producono lo
+    stesso oggetto come riepilogo finale (stream=True), passato alla callback
+    on_complete di generate_stream / agenerate_stream.
+    """
 
-        except Exception as e:
-            raise RuntimeError(f"Groq Error: {e}")
+    text: str
+    model: str = ""
+    provider: str = ""
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    latency_sec: Optional[float] = None
+    ttft_sec: Optional[float] = None
+    retries: int = 0
+    cache_hit: bool = False
+    stream: bool = False
+    error: Optional[str] = None
+    raw: Any = field(default=None, repr=False)
 
-    def generate_stream(self, prompt: Any):
-        """Genera in streaming usando Groq."""
-        try:
-            content, images = process_multimodal_input(prompt, self.model_name)
+    @property
+    def total_tokens(self) -> Optional[int]:
+        if self.input_tokens is None and self.output_tokens is None:
+            return None
+        return (self.input_tokens or 0) + (self.output_tokens or 0)
 
-            if images:
-                content += "\n[Image attached - Groq Vision not yet fully implemented in this wrapper]\n"
+    # Alias storici dei campi (LlamaCppWrapper)
+    @property
+    def completion_tokens(self) -> Optional[int]:
+        return self.output_tokens
 
-            messages = [{"role": "user", "content": content}]
+    @property
+    def duration_sec(self) -> Optional[float]:
+        return self.latency_sec
 
-            stream = self.client.chat.completions.create(
-                messages=messages,
-                model=self.model_name,
-                response_format={"type": "json_object"} if self.json_mode else None,
-                stream=True,
-            )
+    @property
+    def tokens_per_sec(self) -> float:
+        if not self.output_tokens or not self.latency_sec:
+            return 0.0
+        return self.output_tokens / self.latency_sec
 
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
 
-        except Exception as e:
-            yield f"❌ Errore Groq Stream: {e}"
+StreamCallback = Optional[Callable[[TextResponse], None]]
 
 
 class OllamaWrapper:
@@ -191,97 +220,275 @@ class OllamaWrapper:
         self.model_name = model_name
         self.json_mode = json_mode
 
+    def _observe(
+        self,
+        start_t: float,
+        text: str = "",
+        last_chunk=None,
+        error=None,
+        ttft=None,
+        stream=False,
+        retries: int = 0,
+    ) -> TextResponse:
+        """Registra la chiamata nelle metriche e ne restituisce il riepilogo.
+
+        L'ultimo chunk di Ollama porta i conteggi dei token.
+        """
+        last_chunk = last_chunk or {}
+        result = TextResponse(
+            text,
+            model=self.model_name,
+            provider="ollama",
+            input_tokens=last_chunk.get("prompt_eval_count"),
+            output_tokens=last_chunk.get("eval_count"),
+            latency_sec=time.time() - start_t,
+            ttft_sec=ttft,
+            retries=retries,
+            stream=stream,
+            error=str(error) if error else None,
+        )
+        get_metrics().observe_request(
+            "ollama",
+            self.model_name,
+            result.latency_sec,
+            error=error,
+            input_tokens=result.input_tokens,
+            output_tokens=result.output_tokens,
+            ttft_sec=ttft,
+            stream=stream,
+        )
+        return result
+
+    @staticmethod
+    def _async_client():
+        """ollama.AsyncClient condiviso per l'event loop corrente."""
+        return get_async_client("ollama", None, None, ollama.AsyncClient)
+
+    def _context_window(self) -> int:
+        """Finestra massima utilizzabile: quella del modello (ollama.show), entro AI_MAX_NUM_CTX."""
+
+        def lookup() -> Optional[int]:
+            try:
+                info = ollama.show(self.model_name)
+                modelinfo = getattr(info, "modelinfo", None) or {}
+                for key, value in modelinfo.items():
+                    if key.endswith(".context_length"):
+                        return int(value)
+            except Exception:  # pylint: disable=broad-exception-caught
+                return None
+            return family_context(self.model_name)
+
+        window = cached_context("ollama", self.model_name, lookup, family_context(self.model_name))
+        return min(window, max_num_ctx())
+
+    def _fit(self, prompt_text: str):
+        """num_ctx dimensionato sul prompt (accorciato o rifiutato se non entra)."""
+        budget = fit_prompt(
+            prompt_text, self.model_name, self._context_window(), label=f"ollama/{self.model_name}"
+        )
+        # Un num_ctx diverso da quello residente costringe Ollama a ricaricare il modello
+        resident = resident_num_ctx(self.model_name)
+        if resident and budget.num_ctx <= resident <= budget.max_ctx:
+            budget.num_ctx = resident
+        note_loaded(self.model_name, budget.num_ctx)
+        return budget
+
+    def _build_kwargs(self, prompt: Any) -> dict:
+        """Parametri per ollama.chat (richiesta completa, non streaming verso il chiamante)."""
+        prompt_text, images = process_multimodal_input(prompt, self.model_name, "ollama")
+        budget = self._fit(prompt_text)
+        prompt_text = budget.text
+
+        # Opzioni per forzare l'uso della GPU e Context Size dimensionato sul prompt
+        options = {
+            "num_gpu": 999,
+            "num_ctx": budget.num_ctx,
+            "temperature": 0.0,  # Bassa temperatura per estrazione dati
+        }
+        format_param = "json" if self.json_mode else None
+
+        # Parametri chiamata
+        kwargs = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt_text}],
+            "format": format_param,
+            "options": options,
+            "stream": True,  # Usiamo stream interna per debug
+            "keep_alive": keep_alive(),
+        }
+
+        if images:
+            # Aggiungi immagini al messaggio utente
+            kwargs["messages"][0]["images"] = [image.data for image in images]
+        return kwargs
+
+    def _build_stream_kwargs(self, prompt: Any) -> dict:
+        """Parametri per ollama.chat in modalità streaming."""
+        prompt_text, images = process_multimodal_input(prompt, self.model_name, "ollama")
+        budget = self._fit(prompt_text)
+        prompt_text = budget.text
+        options = {"num_gpu": 999, "num_ctx": budget.num_ctx}
+        if self.json_mode:
+            # stream_json: stesso output deterministico e in JSON della chiamata completa
+            options["temperature"] = 0.0
+
+        kwargs = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt_text}],
+            "stream": True,
+            "options": options,
+            "keep_alive": keep_alive(),
+        }
+        if self.json_mode:
+            kwargs["format"] = "json"
+
+        if images:
+            kwargs["messages"][0]["images"] = [image.data for image in images]
+        return kwargs
+
     def generate_content(self, prompt: Any):
         """Esegue la chiamata a Ollama."""
+        clock = AttemptClock()
         try:
-            prompt_text, images = process_multimodal_input(prompt, self.model_name)
-
-            # Opzioni per forzare l'uso della GPU e Context Size adeguato
-            options = {
-                "num_gpu": 999,
-                "num_ctx": 4096,  # Ridotto per stabilità su GPU integrate
-                "temperature": 0.0,  # Bassa temperatura per estrazione dati
-            }
-            format_param = "json" if self.json_mode else None
-
-            # Parametri chiamata
-            kwargs = {
-                "model": self.model_name,
-                "messages": [{"role": "user", "content": prompt_text}],
-                "format": format_param,
-                "options": options,
-                "stream": True,  # Usiamo stream interna per debug
-            }
-
-            if images:
-                # Aggiungi immagini al messaggio utente
-                kwargs["messages"][0]["images"] = images
+            kwargs = self._build_kwargs(prompt)
 
             print(
-                f"⏳ Ollama: Invio richiesta a {self.model_name} (Ctx: 4096, Temp: 0)..."
+                f"⏳ Ollama: Invio richiesta a {self.model_name} "
+                f"(Ctx: {kwargs['options']['num_ctx']}, Temp: 0)..."
+            )
+            clock.restart()
+
+            def receive():
+                full_response = ""
+                chunk = None
+                stream = ollama.chat(**kwargs)
+
+                print("   Receiving: ", end="", flush=True)
+                for chunk in stream:
+                    part = chunk.get("message", {}).get("content", "")
+                    full_response += part
+                    print(".", end="", flush=True)  # Feedback visivo
+                print(" Done.")
+                return full_response, chunk
+
+            # La risposta non è ancora arrivata al chiamante: l'intera chiamata si può ritentare
+            (full_response, chunk), retries = call_with_retry(
+                "ollama", self.model_name, receive, clock=clock
             )
-            start_t = time.time()
-
-            full_response = ""
-            stream = ollama.chat(**kwargs)
-
-            print("   Receiving: ", end="", flush=True)
-            for chunk in stream:
-                part = chunk.get("message", {}).get("content", "")
-                full_response += part
-                print(".", end="", flush=True)  # Feedback visivo
-            print(" Done.")
 
-            duration = time.time() - start_t
+            duration = time.time() - clock.started
             print(
                 f"✅ Ollama: Risposta ricevuta in {duration:.2f}s. Lunghezza: {len(full_response)} chars."
             )
-
-            class Response:
-                """Response wrapper per uniformità."""
-
-                text = full_response
-
-            return Response()
+            get_router().record_success("ollama", self.model_name, duration)
+            return self._observe(clock.started, full_response, chunk, retries=retries)
 
         except Exception as e:  # pylint: disable=broad-exception-caught
             print(f"❌ Errore Ollama ({self.model_name}): {e}")
+            get_router().record_failure("ollama", self.model_name, e)
+            self._observe(clock.started, error=e)
             raise e
 
-    def generate_stream(self, prompt: Any):
+    def generate_stream(self, prompt: Any, on_complete: StreamCallback = None):
         """Esegue la chiamata a Ollama in streaming."""
+        clock = AttemptClock()
+        ttft = None
+        parts = []
         try:
-            prompt_text, images = process_multimodal_input(prompt, self.model_name)
-            options = {"num_gpu": 999}
+            kwargs = self._build_stream_kwargs(prompt)
 
-            kwargs = {
-                "model": self.model_name,
-                "messages": [{"role": "user", "content": prompt_text}],
-                "stream": True,
-                "options": options,
-            }
+            chunk = None
+            stream = retry_stream("ollama", self.model_name, lambda: ollama.chat(**kwargs), clock=clock)
 
-            if images:
-                kwargs["messages"][0]["images"] = images
+            for chunk in stream:
+                content = chunk.get("message", {}).get("content", "")
+                if content:
+                    if ttft is None:
+                        ttft = time.time() - clock.started
+                    parts.append(content)
+                    yield content
+            summary = self._observe(clock.started, "".join(parts), chunk, ttft=ttft, stream=True)
 
-            stream = ollama.chat(**kwargs)
+        except Exception as e:
+            summary = self._observe(clock.started, "".join(parts), error=e, ttft=ttft, stream=True)
+            yield f"❌ Errore Ollama Stream: {e}"
+        if on_complete:
+            on_complete(summary)
 
-            for chunk in stream:
+    async def agenerate_content(self, prompt: Any):
+        """Versione asincrona di generate_content (ollama.AsyncClient)."""
+        clock = AttemptClock()
+        try:
+            kwargs = await asyncio.to_thread(self._build_kwargs, prompt)
+
+            print(f"⏳ Ollama (async): Invio richiesta a {self.model_name}...")
+            clock.restart()
+
+            async def receive():
+                parts = []
+                chunk = None
+                stream = await self._async_client().chat(**kwargs)
+                async for chunk in stream:
+                    parts.append(chunk.get("message", {}).get("content", ""))
+                return "".join(parts), chunk
+
+            (full_response, chunk), retries = await acall_with_retry(
+                "ollama", self.model_name, receive, clock=clock
+            )
+
+            duration = time.time() - clock.started
+            print(
+                f"✅ Ollama (async): Risposta ricevuta in {duration:.2f}s. Lunghezza: {len(full_response)} chars."
+            )
+            get_router().record_success("ollama", self.model_name, duration)
+            return self._observe(clock.started, full_response, chunk, retries=retries)
+
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"❌ Errore Ollama ({self.model_name}): {e}")
+            get_router().record_failure("ollama", self.model_name, e)
+            self._observe(clock.started, error=e)
+            raise e
+
+    async def agenerate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Versione asincrona di generate_stream (ollama.AsyncClient)."""
+        clock = AttemptClock()
+        ttft = None
+        parts = []
+        try:
+            kwargs = await asyncio.to_thread(self._build_stream_kwargs, prompt)
+
+            chunk = None
+            stream = aretry_stream(
+                "ollama", self.model_name, lambda: self._async_client().chat(**kwargs), clock=clock
+            )
+
+            async for chunk in stream:
                 content = chunk.get("message", {}).get("content", "")
                 if content:
+                    if ttft is None:
+                        ttft = time.time() - clock.started
+                    parts.append(content)
                     yield content
+            summary = self._observe(clock.started, "".join(parts), chunk, ttft=ttft, stream=True)
 
         except Exception as e:
+            summary = self._observe(clock.started, "".join(parts), error=e, ttft=ttft, stream=True)
             yield f"❌ Errore Ollama Stream: {e}"
+        if on_complete:
+            on_complete(summary)
 
 
 class GeminiWrapper:
     """Wrapper per Google Gemini con gestione retry e backoff (Google GenAI SDK v1)."""
 
+    # Tentativi totali, compresi i passaggi a un altro modello della catena
+    MAX_RETRIES = 5
+
     def __init__(self, provider, json_mode: bool):
         self.provider = provider
         self.json_mode = json_mode
-        self.client = genai.Client(api_key=self.provider.api_key)
+        api_key = self.provider.api_key
+        self.client = get_client("gemini", api_key, None, lambda: genai.Client(api_key=api_key))
 
     def _prepare_contents(self, prompt: Any) -> list:
         """Prepara il contenuto per la nuova API."""
@@ -294,311 +501,1325 @@ class GeminiWrapper:
                     contents.append(part)
                 elif isinstance(part, dict) and "mime_type" in part and "data" in part:
                     # Handle raw bytes input (custom standard used in this project)
-                    contents.append(
-                        types.Part.from_bytes(
-                            data=part["data"], mime_type=part["mime_type"]
-                        )
-                    )
+                    data, mime_type = part["data"], part["mime_type"]
+                    if mime_type.startswith("image/"):
+                        image = prepare_image(data, "gemini", self.provider.current_model_name)
+                        data, mime_type = image.data, image.mime_type
+                    contents.append(types.Part.from_bytes(data=data, mime_type=mime_type))
                 else:
                     # Fallback string
                     contents.append(str(part))
         return contents
 
-    def generate_content(self, prompt):
-        """Genera contenuto con Exponential Backoff."""
-        max_retries = 5
-        base_delay = 2
-        last_error = None
-
-        # Config
-        config = types.GenerateContentConfig(
+    def _config(self):
+        return types.GenerateContentConfig(
             response_mime_type="application/json" if self.json_mode else "text/plain"
         )
 
+    def _log_usage(self, response, start_time: float, model_used: str):
+        """Logging Token Usage e Modello."""
+        try:
+            usage = response.usage_metadata
+            input_tokens = usage.prompt_token_count
+            output_tokens = usage.candidates_token_count
+            total_tokens = usage.total_token_count
+
+            self.provider.log_debug(
+                f"🤖 GENAI CALL | Model: {model_used} | Tokens: {input_tokens} in + {output_tokens} out = {total_tokens} tot | Time: {time.time()-start_time:.2f}s"
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.provider.log_debug(
+                f"🤖 GENAI CALL | Model: {model_used} | (Token info non avail)"
+            )
+
+    @staticmethod
+    def _estimate_tokens(contents: list) -> int:
+        return estimate_tokens("".join(c for c in contents if isinstance(c, str)))
+
+    @staticmethod
+    def _observe(
+        model: str,
+        start_time: float,
+        response=None,
+        error=None,
+        ttft=None,
+        stream=False,
+        text: Optional[str] = None,
+        retries: int = 0,
+    ) -> TextResponse:
+        """Registra il tentativo nelle metriche e ne restituisce il riepilogo.
+
+        I token arrivano da usage_metadata (negli stream: quello dell'ultimo chunk).
+        """
+        usage = getattr(response, "usage_metadata", None)
+        if text is None:
+            text = (getattr(response, "text", None) or "") if error is None else ""
+        result = TextResponse(
+            text,
+            model=model,
+            provider="gemini",
+            input_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            latency_sec=time.time() - start_time,
+            ttft_sec=ttft,
+            retries=retries,
+            stream=stream,
+            error=str(error) if error else None,
+            raw=None if stream else response,
+        )
+        get_metrics().observe_request(
+            "gemini",
+            model,
+            result.latency_sec,
+            error=error,
+            input_tokens=result.input_tokens,
+            output_tokens=result.output_tokens,
+            ttft_sec=ttft,
+            stream=stream,
+        )
+        return result
+
+    def _record_usage(self, model: str, estimated: int, response) -> None:
+        limiter = get_limiter("gemini", model)
+        usage = getattr(response, "usage_metadata", None)
+        if limiter and usage is not None:
+            limiter.record_usage(estimated, getattr(usage, "total_token_count", None))
+
+    def _retry_delay(self, attempt: int, error: Exception, model: str) -> Optional[float]:
+        """Decide come reagire a un errore: secondi di attesa prima del retry, None per arrendersi.
+
+        L'esito viene registrato nel router condiviso: se il modello finisce in
+        cooldown e c'è un'alternativa sana si passa subito a quella, altrimenti
+        l'attesa viene dalla politica di retry condivisa (retry_policy).
+        """
+        router = get_router()
+        code = getattr(error, "code", None)
+        if isinstance(error, api_exceptions.ResourceExhausted) or is_rate_limit_error(error):
+            # Blocca il modello per tutti i thread e rispetta il ritardo suggerito dal server
+            note_rate_limited("gemini", model, error)
+            router.record_failure("gemini", model, error)
+            if self.provider.downgrade_model(model):
+                return 0
+            wait = next_delay("gemini", model, attempt, error)
+            if wait is not None:
+                self.provider.log_debug(f"⚠️ Quota 429. Attendo {wait:.1f}s...")
+            return wait
+        server_errors = (api_exceptions.ServiceUnavailable, api_exceptions.InternalServerError)
+        if isinstance(error, server_errors) or (isinstance(code, int) and code >= 500):
+            router.record_failure("gemini", model, error)
+            if not router.is_available("gemini", model) and self.provider.downgrade_model(model):
+                return 0
+            return next_delay("gemini", model, attempt, error)
+        if isinstance(error, (api_exceptions.NotFound, api_exceptions.InvalidArgument)) or code in (400, 404):
+            self.provider.log_debug(f"❌ Errore Modello {error}. Switching...")
+            not_found = isinstance(error, api_exceptions.NotFound) or code == 404
+            router.record_failure(
+                "gemini",
+                model,
+                error,
+                cooldown=FATAL_COOLDOWN_SEC if not_found else BASE_COOLDOWN_SEC,
+            )
+            if self.provider.downgrade_model(model):
+                return 0
+            return None
+        router.record_failure("gemini", model, error)
+        self.provider.log_debug(f"❌ Errore: {error}")
+        # Timeout e connessioni interrotte restano ritentabili
+        return next_delay("gemini", model, attempt, error)
+
+    @staticmethod
+    def _note_rate_limited(model: str, error: Exception) -> None:
+        if is_rate_limit_error(error):
+            note_rate_limited("gemini", model, error)
+
+    def generate_content(self, prompt):
+        """Genera contenuto con Exponential Backoff."""
+        last_error = None
+        config = self._config()
         contents = self._prepare_contents(prompt)
 
-        for attempt in range(max_retries):
+        tokens = self._estimate_tokens(contents)
+        get_retry_budget("gemini").record_request()
+
+        for attempt in range(self.MAX_RETRIES):
+            # Definiti prima del try: l'except li usa anche se select_model o il limiter falliscono
+            model = None
+            start_time = time.time()
             try:
+                model = self.provider.select_model()
+                limiter = get_limiter("gemini", model)
+                if limiter:
+                    limiter.acquire(tokens)
                 start_time = time.time()
 
                 response = self.client.models.generate_content(
-                    model=self.provider.current_model_name,
+                    model=model,
                     contents=contents,
                     config=config,
                 )
 
-                # Logging Token Usage e Modello
-                try:
-                    usage = response.usage_metadata
-                    input_tokens = usage.prompt_token_count
-                    output_tokens = usage.candidates_token_count
-                    total_tokens = usage.total_token_count
-                    model_used = self.provider.current_model_name
-
-                    self.provider.log_debug(
-                        f"🤖 GENAI CALL | Model: {model_used} | Tokens: {input_tokens} in + {output_tokens} out = {total_tokens} tot | Time: {time.time()-start_time:.2f}s"
-                    )
-                except Exception:  # pylint: disable=broad-exception-caught
-                    self.provider.log_debug(
-                        f"🤖 GENAI CALL | Model: {self.provider.current_model_name} | (Token info non avail)"
-                    )
-
-                return response
-            except ResourceExhausted as e:
-                last_error = e
-                wait = (base_delay * (2**attempt)) + random.uniform(0, 1)
-                self.provider.log_debug(f"⚠️ Quota 429. Attendo {wait:.1f}s...")
-                time.sleep(wait)
-                if attempt >= 2 and self.provider.downgrade_model():
-                    pass  # Retry with new model
-            except (ServiceUnavailable, InternalServerError) as e:
-                last_error = e
-                time.sleep(5)
-            except (NotFound, InvalidArgument) as e:
-                last_error = e
-                self.provider.log_debug(f"❌ Errore Modello {e}. Switching...")
-                if self.provider.downgrade_model():
-                    pass
-                else:
-                    break
+                self._log_usage(response, start_time, model)
+                self._record_usage(model, tokens, response)
+                get_router().record_success("gemini", model, time.time() - start_time)
+                return self._observe(model, start_time, response, retries=attempt)
             except Exception as e:  # pylint: disable=broad-exception-caught
                 last_error = e
-                self.provider.log_debug(f"❌ Errore: {e}")
-                break
+                if model is None:
+                    # Nessun modello scelto: non c'è una chiamata da registrare né da ritentare
+                    break
+                self._observe(model, start_time, error=e)
+                wait = self._retry_delay(attempt, e, model)
+                if wait is None:
+                    break
+                get_metrics().record_retry("gemini", model)
+                time.sleep(wait)
 
         raise RuntimeError(
             f"Impossibile generare contenuto Gemini. Last Error: {last_error}"
         )
 
-    def generate_stream(self, prompt):
+    def generate_stream(self, prompt, on_complete: StreamCallback = None):
         """Genera contenuto in streaming."""
+        model = self.provider.select_model()
+        clock = AttemptClock()
+        ttft = None
+        parts = []
         try:
             contents = self._prepare_contents(prompt)
-            response = self.client.models.generate_content_stream(
-                model=self.provider.current_model_name, contents=contents
+            config = self._config()
+            limiter = get_limiter("gemini", model)
+            if limiter:
+                limiter.acquire(self._estimate_tokens(contents))
+            clock.restart()
+            chunk = None
+            response = retry_stream(
+                "gemini",
+                model,
+                lambda: self.client.models.generate_content_stream(
+                    model=model, contents=contents, config=config
+                ),
+                on_retry=lambda e: self._note_rate_limited(model, e),
+                clock=clock,
             )
             for chunk in response:
+                if ttft is None:
+                    ttft = time.time() - clock.started
+                parts.append(chunk.text or "")
                 yield chunk.text
+            get_router().record_success("gemini", model, time.time() - clock.started)
+            summary = self._observe(
+                model, clock.started, chunk, ttft=ttft, stream=True, text="".join(parts)
+            )
         except Exception as e:
+            self._note_rate_limited(model, e)
+            get_router().record_failure("gemini", model, e)
+            summary = self._observe(
+                model, clock.started, error=e, ttft=ttft, stream=True, text="".join(parts)
+            )
             yield f"❌ Errore Gemini Stream: {e}"
+        if on_complete:
+            on_complete(summary)
+
+    async def agenerate_content(self, prompt):
+        """Versione asincrona di generate_content (client.aio), stesso backoff."""
+        last_error = None
+        config = self._config()
+        contents = self._prepare_contents(prompt)
 
+        tokens = self._estimate_tokens(contents)
+        get_retry_budget("gemini").record_request()
 
-class PuterWrapper:
-    """Wrapper per Claude via Puter.com OpenAI-compatible API (gratuito, senza Anthropic key)."""
+        for attempt in range(self.MAX_RETRIES):
+            # Definiti prima del try: l'except li usa anche se select_model o il limiter falliscono
+            model = None
+            start_time = time.time()
+            try:
+                model = self.provider.select_model()
+                limiter = get_limiter("gemini", model)
+                if limiter:
+                    await limiter.aacquire(tokens)
+                start_time = time.time()
 
-    PUTER_BASE_URL = "https://api.puter.com/puterai/openai/v1/"
+                response = await self.client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                )
 
-    def __init__(self, provider, model_name: str, json_mode: bool = False):
-        self.provider = provider
-        self.model_name = model_name or "claude-sonnet-4-6"
+                self._log_usage(response, start_time, model)
+                self._record_usage(model, tokens, response)
+                get_router().record_success("gemini", model, time.time() - start_time)
+                return self._observe(model, start_time, response, retries=attempt)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                last_error = e
+                if model is None:
+                    # Nessun modello scelto: non c'è una chiamata da registrare né da ritentare
+                    break
+                self._observe(model, start_time, error=e)
+                wait = self._retry_delay(attempt, e, model)
+                if wait is None:
+                    break
+                get_metrics().record_retry("gemini", model)
+                await asyncio.sleep(wait)
+
+        raise RuntimeError(
+            f"Impossibile generare contenuto Gemini. Last Error: {last_error}"
+        )
+
+    async def agenerate_stream(self, prompt, on_complete: StreamCallback = None):
+        """Versione asincrona di generate_stream (client.aio)."""
+        model = self.provider.select_model()
+        clock = AttemptClock()
+        ttft = None
+        parts = []
+        try:
+            contents = self._prepare_contents(prompt)
+            config = self._config()
+            limiter = get_limiter("gemini", model)
+            if limiter:
+                await limiter.aacquire(self._estimate_tokens(contents))
+            clock.restart()
+            chunk = None
+            response = aretry_stream(
+                "gemini",
+                model,
+                lambda: self.client.aio.models.generate_content_stream(
+                    model=model, contents=contents, config=config
+                ),
+                on_retry=lambda e: self._note_rate_limited(model, e),
+                clock=clock,
+            )
+            async for chunk in response:
+                if ttft is None:
+                    ttft = time.time() - clock.started
+                parts.append(chunk.text or "")
+                yield chunk.text
+            get_router().record_success("gemini", model, time.time() - clock.started)
+            summary = self._observe(
+                model, clock.started, chunk, ttft=ttft, stream=True, text="".join(parts)
+            )
+        except Exception as e:
+            self._note_rate_limited(model, e)
+            get_router().record_failure("gemini", model, e)
+            summary = self._observe(
+                model, clock.started, error=e, ttft=ttft, stream=True, text="".join(parts)
+            )
+            yield f"❌ Errore Gemini Stream: {e}"
+        if on_complete:
+            on_complete(summary)
+
+
+class OpenAICompatibleWrapper:
+    """Base comune per i backend che espongono la Chat Completions API di OpenAI."""
+
+    PROVIDER = "openai"
+    ERROR_LABEL = "OpenAI"
+    IMAGE_NOTE = "\n[Note: Image attachments are not supported by this wrapper]\n"
+
+    def __init__(self, model_name: str, json_mode: bool = False):
+        self.model_name = model_name
         self.json_mode = json_mode
+        client_kwargs = self._client_kwargs()
+        self.client = get_client(
+            self.PROVIDER,
+            client_kwargs.get("api_key"),
+            client_kwargs.get("base_url"),
+            lambda: self._new_client(client_kwargs),
+        )
+
+    def _client_kwargs(self) -> dict:
+        """Argomenti per costruire il client (base_url, api_key, headers)."""
+        raise NotImplementedError
+
+    def _new_client(self, client_kwargs: dict):
         if not OPENAI_AVAILABLE:
             raise ImportError("Libreria 'openai' non installata. Esegui: pip install openai")
-        self.client = openai_lib.OpenAI(
-            base_url=self.PUTER_BASE_URL,
-            api_key=self.provider.api_key or "dummy",  # Puter accepts any non-empty token
+        # I retry li gestisce retry_policy: niente secondo backoff dentro l'SDK
+        return openai_lib.OpenAI(**{"max_retries": 0, **client_kwargs})
+
+    def _new_async_client(self, client_kwargs: dict):
+        return openai_lib.AsyncOpenAI(**{"max_retries": 0, **client_kwargs})
+
+    @property
+    def async_client(self):
+        """Client asincrono condiviso per l'event loop corrente."""
+        client_kwargs = self._client_kwargs()
+        return get_async_client(
+            self.PROVIDER,
+            client_kwargs.get("api_key"),
+            client_kwargs.get("base_url"),
+            lambda: self._new_async_client(client_kwargs),
+        )
+
+    def _throttle(self, messages: list) -> int:
+        """Attende lo slot del rate limiter; restituisce i token stimati del prompt."""
+        tokens = estimate_tokens(message_text(messages[-1]))
+        limiter = get_limiter(self.PROVIDER, self.model_name)
+        if limiter:
+            limiter.acquire(tokens)
+        return tokens
+
+    async def _athrottle(self, messages: list) -> int:
+        tokens = estimate_tokens(message_text(messages[-1]))
+        limiter = get_limiter(self.PROVIDER, self.model_name)
+        if limiter:
+            await limiter.aacquire(tokens)
+        return tokens
+
+    def _record_usage(self, estimated: int, response) -> None:
+        limiter = get_limiter(self.PROVIDER, self.model_name)
+        usage = getattr(response, "usage", None)
+        if limiter and usage is not None:
+            limiter.record_usage(estimated, getattr(usage, "total_tokens", None))
+
+    def _on_retry(self, error: Exception) -> None:
+        # Un 429 ritentato mette comunque in pausa il modello per gli altri thread
+        if is_rate_limit_error(error):
+            note_rate_limited(self.PROVIDER, self.model_name, error)
+
+    def _on_error(self, error: Exception) -> None:
+        self._on_retry(error)
+        get_router().record_failure(self.PROVIDER, self.model_name, error)
+
+    def _observe(self, start_t: float, response=None, error=None, ttft=None, stream=False) -> None:
+        """Registra la chiamata nelle metriche (token da response.usage se presente)."""
+        usage = getattr(response, "usage", None)
+        get_metrics().observe_request(
+            self.PROVIDER,
+            self.model_name,
+            time.time() - start_t,
+            error=error,
+            input_tokens=getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "completion_tokens", None),
+            ttft_sec=ttft,
+            stream=stream,
         )
 
+    def _supports_images(self) -> bool:
+        """True se il modello accetta parti image_url (data URL base64)."""
+        return supports_vision(self.model_name)
+
+    def _fit_text(self, text: str) -> str:
+        """Adatta il testo del prompt al backend (default: invariato)."""
+        return text
+
     def _build_messages(self, prompt: Any) -> list:
-        """Converte il prompt (stringa o multimodale) in messaggi OpenAI."""
-        content, images = process_multimodal_input(prompt, self.model_name)
-        if images:
-            content += "\n[Note: Image attachments are not supported via Puter API wrapper]\n"
-        return [{"role": "user", "content": content}]
+        """Converte il prompt (stringa o multimodale) in messaggi OpenAI.
 
-    def generate_content(self, prompt: Any):
-        """Genera contenuto usando Puter/Claude (sincrono)."""
-        try:
-            messages = self._build_messages(prompt)
-            kwargs = {
-                "model": self.model_name,
-                "messages": messages,
-            }
-            if self.json_mode:
-                kwargs["response_format"] = {"type": "json_object"}
+        Le immagini vengono ridimensionate per il provider e inviate come
+        image_url solo se il modello le supporta; altrimenti resta IMAGE_NOTE.
+        """
+        vision = self._supports_images()
+        content, images = process_multimodal_input(
+            prompt, self.model_name, self.PROVIDER if vision else None
+        )
+        content = self._fit_text(content)
+        if images and not vision:
+            content += self.IMAGE_NOTE
+        if not images or not vision:
+            return [{"role": "user", "content": content}]
+        parts = [{"type": "text", "text": content}]
+        parts += [{"type": "image_url", "image_url": {"url": image.data_url()}} for image in images]
+        return [{"role": "user", "content": parts}]
+
+    def _request_kwargs(self, messages: list, stream: bool = False) -> dict:
+        kwargs = {
+            "model": self.model_name,
+            "messages": messages,
+        }
+        if stream:
+            kwargs["stream"] = True
+        # JSON mode anche in streaming (stream_json): senza, il modello può rispondere in prosa
+        if self.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _create(self, messages: list, stream: bool = False):
+        """Chiamata Chat Completions (risposta o stream)."""
+        return self.client.chat.completions.create(**self._request_kwargs(messages, stream=stream))
+
+    async def _acreate(self, messages: list, stream: bool = False):
+        return await self.async_client.chat.completions.create(
+            **self._request_kwargs(messages, stream=stream)
+        )
 
-            response = self.client.chat.completions.create(**kwargs)
+    def _stream_summary(self, start_t: float, text: str, last_chunk, ttft, error) -> TextResponse:
+        usage = getattr(last_chunk, "usage", None)
+        return TextResponse(
+            text,
+            model=self.model_name,
+            provider=self.PROVIDER,
+            input_tokens=getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "completion_tokens", None),
+            latency_sec=time.time() - start_t,
+            ttft_sec=ttft,
+            stream=True,
+            error=str(error) if error else None,
+        )
 
-            class Response:
-                def __init__(self, text):
-                    self.text = text
+    def _wrap_response(self, response, duration: float):
+        usage = getattr(response, "usage", None)
+        return TextResponse(
+            response.choices[0].message.content,
+            model=self.model_name,
+            provider=self.PROVIDER,
+            input_tokens=getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "completion_tokens", None),
+            latency_sec=duration,
+            raw=response,
+        )
 
-            return Response(response.choices[0].message.content)
+    def generate_content(self, prompt: Any):
+        """Genera contenuto (sincrono)."""
+        clock = AttemptClock()
+        try:
+            messages = self._build_messages(prompt)
+            tokens = self._throttle(messages)
+            clock.restart()
+            response, retries = call_with_retry(
+                self.PROVIDER,
+                self.model_name,
+                lambda: self._create(messages),
+                on_retry=self._on_retry,
+                clock=clock,
+            )
+            duration = time.time() - clock.started
+            self._record_usage(tokens, response)
+            get_router().record_success(self.PROVIDER, self.model_name, duration)
+            self._observe(clock.started, response)
+            result = self._wrap_response(response, duration)
+            result.retries = retries
+            return result
         except Exception as e:
-            raise RuntimeError(f"Puter/Claude Error: {e}") from e
-
-    def generate_stream(self, prompt: Any):
-        """Genera in streaming usando Puter/Claude."""
+            self._on_error(e)
+            self._observe(clock.started, error=e)
+            raise RuntimeError(f"{self.ERROR_LABEL} Error: {e}") from e
+
+    def generate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Genera in streaming; on_complete riceve il riepilogo finale (TextResponse)."""
+        clock = AttemptClock()
+        ttft = None
+        chunk = None
+        parts = []
         try:
             messages = self._build_messages(prompt)
-            stream = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                stream=True,
+            self._throttle(messages)
+            clock.restart()
+            stream = retry_stream(
+                self.PROVIDER,
+                self.model_name,
+                lambda: self._create(messages, stream=True),
+                on_retry=self._on_retry,
+                clock=clock,
             )
             for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta is not None:
+                    if ttft is None:
+                        ttft = time.time() - clock.started
+                    parts.append(delta)
+                    yield delta
+            self._observe(clock.started, chunk, ttft=ttft, stream=True)
+            error = None
+        except Exception as e:
+            self._on_error(e)
+            self._observe(clock.started, error=e, ttft=ttft, stream=True)
+            error = e
+            yield f"❌ Errore {self.ERROR_LABEL} Stream: {e}"
+        if on_complete:
+            on_complete(self._stream_summary(clock.started, "".join(parts), chunk, ttft, error))
+
+    async def agenerate_content(self, prompt: Any):
+        """Versione asincrona di generate_content (AsyncOpenAI)."""
+        clock = AttemptClock()
+        try:
+            messages = await asyncio.to_thread(self._build_messages, prompt)
+            tokens = await self._athrottle(messages)
+            clock.restart()
+            response, retries = await acall_with_retry(
+                self.PROVIDER,
+                self.model_name,
+                lambda: self._acreate(messages),
+                on_retry=self._on_retry,
+                clock=clock,
+            )
+            duration = time.time() - clock.started
+            self._record_usage(tokens, response)
+            get_router().record_success(self.PROVIDER, self.model_name, duration)
+            self._observe(clock.started, response)
+            result = self._wrap_response(response, duration)
+            result.retries = retries
+            return result
+        except Exception as e:
+            self._on_error(e)
+            self._observe(clock.started, error=e)
+            raise RuntimeError(f"{self.ERROR_LABEL} Error: {e}") from e
+
+    async def agenerate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Versione asincrona di generate_stream (AsyncOpenAI)."""
+        clock = AttemptClock()
+        ttft = None
+        chunk = None
+        parts = []
+        try:
+            messages = await asyncio.to_thread(self._build_messages, prompt)
+            await self._athrottle(messages)
+            clock.restart()
+            stream = aretry_stream(
+                self.PROVIDER,
+                self.model_name,
+                lambda: self._acreate(messages, stream=True),
+                on_retry=self._on_retry,
+                clock=clock,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
                 delta = chunk.choices[0].delta.content
                 if delta is not None:
+                    if ttft is None:
+                        ttft = time.time() - clock.started
+                    parts.append(delta)
                     yield delta
+            self._observe(clock.started, chunk, ttft=ttft, stream=True)
+            error = None
         except Exception as e:
-            yield f"❌ Errore Puter/Claude Stream: {e}"
+            self._on_error(e)
+            self._observe(clock.started, error=e, ttft=ttft, stream=True)
+            error = e
+            yield f"❌ Errore {self.ERROR_LABEL} Stream: {e}"
+        if on_complete:
+            on_complete(self._stream_summary(clock.started, "".join(parts), chunk, ttft, error))
 
 
-class OpenRouterWrapper:
+class GroqWrapper(OpenAICompatibleWrapper):
+    """Wrapper per Groq (LPU Inference Engine)."""
+
+    PROVIDER = "groq"
+    ERROR_LABEL = "Groq"
+    IMAGE_NOTE = "\n[Note: Image attachments require a Groq vision model]\n"
+
+    def __init__(self, provider, model_name: str, json_mode: bool = False):
+        self.provider = provider
+        super().__init__(model_name or "llama-3.3-70b-versatile", json_mode)
+
+    def _client_kwargs(self) -> dict:
+        return {"api_key": self.provider.api_key}
+
+    def _new_client(self, client_kwargs: dict):
+        return groq.Groq(**{"max_retries": 0, **client_kwargs})
+
+    def _new_async_client(self, client_kwargs: dict):
+        return groq.AsyncGroq(**{"max_retries": 0, **client_kwargs})
+
+    def _request_kwargs(self, messages: list, stream: bool = False) -> dict:
+        kwargs = super()._request_kwargs(messages, stream)
+        # Groq supporta il JSON mode anche in streaming
+        kwargs["response_format"] = {"type": "json_object"} if self.json_mode else None
+        return kwargs
+
+
+class PuterWrapper(OpenAICompatibleWrapper):
+    """Wrapper per Claude via Puter.com OpenAI-compatible API (gratuito, senza Anthropic key)."""
+
+    PUTER_BASE_URL = "https://api.puter.com/puterai/openai/v1/"
+    PROVIDER = "puter"
+    ERROR_LABEL = "Puter/Claude"
+    IMAGE_NOTE = "\n[Note: Image attachments are not supported by this model via Puter]\n"
+
+    def __init__(self, provider, model_name: str, json_mode: bool = False):
+        self.provider = provider
+        super().__init__(model_name or "claude-sonnet-4-6", json_mode)
+
+    def _client_kwargs(self) -> dict:
+        return {
+            "base_url": self.PUTER_BASE_URL,
+            "api_key": self.provider.api_key or "dummy",  # Puter accepts any non-empty token
+        }
+
+
+class OpenRouterWrapper(OpenAICompatibleWrapper):
     """Wrapper per OpenRouter OpenAI-compatible API."""
 
     OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+    PROVIDER = "openrouter"
+    ERROR_LABEL = "OpenRouter"
+    IMAGE_NOTE = "\n[Note: The selected OpenRouter model does not accept images]\n"
 
     def __init__(self, provider, model_name: str, json_mode: bool = False):
         self.provider = provider
         # Fallback to a common model if none provided
-        self.model_name = model_name or "anthropic/claude-3.5-sonnet"
-        self.json_mode = json_mode
-        if not OPENAI_AVAILABLE:
-            raise ImportError("Libreria 'openai' non installata. Esegui: pip install openai")
-        
-        self.client = openai_lib.OpenAI(
-            base_url=self.OPENROUTER_BASE_URL,
-            api_key=self.provider.api_key,
-            default_headers={
+        super().__init__(model_name or "anthropic/claude-3.5-sonnet", json_mode)
+
+    def _client_kwargs(self) -> dict:
+        return {
+            "base_url": self.OPENROUTER_BASE_URL,
+            "api_key": self.provider.api_key,
+            "default_headers": {
                 "HTTP-Referer": "https://github.com/giuseppe/antigravity",
-                "X-OpenRouter-Title": "Antigravity Local Engine"
-            }
-        )
+                "X-OpenRouter-Title": "Antigravity Local Engine",
+            },
+        }
 
-    def _build_messages(self, prompt: Any) -> list:
-        content, images = process_multimodal_input(prompt, self.model_name)
-        if images:
-            content += "\n[Note: Image attachments currently simplified in OpenRouter wrapper]\n"
-        return [{"role": "user", "content": content}]
 
-    def generate_content(self, prompt: Any):
-        try:
-            messages = self._build_messages(prompt)
-            kwargs = {
-                "model": self.model_name,
-                "messages": messages,
-            }
-            if self.json_mode:
-                kwargs["response_format"] = {"type": "json_object"}
+class LlamaCppWrapper(OpenAICompatibleWrapper):
+    """Wrapper per llama.cpp server (OpenAI-compatible API).
 
-            response = self.client.chat.completions.create(**kwargs)
+    Con più backend (argomento backends o AI_LLAMACPP_BACKENDS) ogni richiesta
+    va al llama-server con meno richieste in corso, con failover sugli altri.
+    """
 
-            class Response:
-                def __init__(self, text):
-                    self.text = text
+    PROVIDER = "llamacpp"
+    ERROR_LABEL = "LlamaCpp"
+    IMAGE_NOTE = "\n[Note: Image attachments need llama-server started with a multimodal projector (--mmproj)]\n"
 
-            return Response(response.choices[0].message.content)
-        except Exception as e:
-            raise RuntimeError(f"OpenRouter Error: {e}") from e
+    # GET /props per "host:port", condiviso tra le istanze
+    _props: dict = {}
+
+    def __init__(
+        self,
+        model_name: str,
+        host: str = "localhost",
+        port: int = 8080,
+        json_mode: bool = False,
+        backends: Optional[List[str]] = None,
+    ):
+        self.host = host
+        self.port = port
+        backends = backends or parse_backends(os.getenv("AI_LLAMACPP_BACKENDS")) or [f"{host}:{port}"]
+        # Il primo backend fornisce n_ctx e stato di caricamento per tutto il pool
+        self.server = backends[0]
+        self.base_url = f"http://{self.server}/v1"
+        self.pool = get_pool(backends) if len(backends) > 1 else None
+        super().__init__(model_name, json_mode)
+
+    def _client_kwargs(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "api_key": "no-key",  # llama-server non richiede API key
+        }
 
-    def generate_stream(self, prompt: Any):
+    def _request_kwargs(self, messages: list, stream: bool = False, slot: Optional[int] = None) -> dict:
+        kwargs = super()._request_kwargs(messages, stream)
+        # llama-server accetta response_format anche in streaming
+        if self.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        if os.getenv("AI_LLAMACPP_PREFIX_CACHE", "true").lower() == "true":
+            # Riuso del KV del prefisso comune, sullo slot associato al prefisso
+            extra = {"cache_prompt": True}
+            if slot is not None:
+                extra["id_slot"] = slot
+            kwargs["extra_body"] = extra
+        return kwargs
+
+    def _pin_slot(self, messages: list, server: str):
+        """(pinner, slot) libero per il prefisso del prompt; (None, None) se lo sceglie il server."""
+        if os.getenv("AI_LLAMACPP_PREFIX_CACHE", "true").lower() != "true":
+            return None, None
+        props = self._server_props(server)
+        if not props or not props.get("total_slots"):
+            return None, None
+        pinner = get_pinner(server, int(props["total_slots"]))
+        return pinner, pinner.pin(message_text(messages[-1]))
+
+    @staticmethod
+    def _unpin_after(pinner, slot: Optional[int], stream):
+        """Itera lo stream e libera lo slot alla fine."""
+        try:
+            yield from stream
+        finally:
+            pinner.release(slot)
+
+    @staticmethod
+    async def _aunpin_after(pinner, slot: Optional[int], stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            pinner.release(slot)
+
+    def _pinned_create(self, client, server: str, messages: list, stream: bool):
+        """Chiamata sullo slot del prefisso, occupato finché la risposta (o lo stream) non finisce."""
+        pinner, slot = self._pin_slot(messages, server)
+        try:
+            response = client.chat.completions.create(**self._request_kwargs(messages, stream, slot))
+        except Exception:
+            if pinner is not None:
+                pinner.release(slot)
+            raise
+        if pinner is None:
+            return response
+        if stream:
+            return self._unpin_after(pinner, slot, response)
+        pinner.release(slot)
+        return response
+
+    async def _apinned_create(self, client, server: str, messages: list, stream: bool):
+        pinner, slot = self._pin_slot(messages, server)
+        try:
+            response = await client.chat.completions.create(**self._request_kwargs(messages, stream, slot))
+        except Exception:
+            if pinner is not None:
+                pinner.release(slot)
+            raise
+        if pinner is None:
+            return response
+        if stream:
+            return self._aunpin_after(pinner, slot, response)
+        pinner.release(slot)
+        return response
+
+    def _server_props(self, server: Optional[str] = None) -> Optional[dict]:
+        """GET /props di llama-server (n_ctx, total_slots), letto una volta per server."""
+        server = server or self.server
+        props = LlamaCppWrapper._props.get(server)
+        if props is None:
+            try:
+                r = get_http_session().get(f"http://{server}/props", timeout=2)
+                r.raise_for_status()
+                props = r.json()
+            except Exception:  # pylint: disable=broad-exception-caught
+                return None
+            LlamaCppWrapper._props[server] = props
+        return props
+
+    @staticmethod
+    def forget_server(server: str) -> None:
+        """Scarta /props, n_ctx e slot memorizzati di un server avviato, riavviato o fermato."""
+        LlamaCppWrapper._props.pop(server, None)
+        invalidate_context("llamacpp", server)
+        reset_pinner(server)
+
+    def _context_window(self) -> int:
+        """n_ctx con cui è stato avviato llama-server."""
+
+        def lookup() -> Optional[int]:
+            props = self._server_props()
+            if not props:
+                return None
+            n_ctx = (props.get("default_generation_settings") or {}).get("n_ctx") or props.get("n_ctx")
+            return int(n_ctx) if n_ctx else None
+
+        return cached_context("llamacpp", self.server, lookup, family_context(self.model_name))
+
+    def _record_timings(self, response, server: Optional[str] = None) -> None:
+        """Tempi di prefill (prompt_ms, cache_n) riportati da llama-server."""
+        server = server or self.server
+        timings = (getattr(response, "model_extra", None) or {}).get("timings")
+        props = LlamaCppWrapper._props.get(server) or {}
+        if timings and props.get("total_slots"):
+            get_pinner(server, int(props["total_slots"])).record_timings(timings)
+
+    def _backend_client(self, backend, asynchronous: bool = False):
+        # Niente retry interni dell'SDK: un backend irraggiungibile passa subito al successivo
+        client_kwargs = {"base_url": backend.base_url, "api_key": "no-key", "max_retries": 0}
+        key = f"{self.PROVIDER}-pool"
+        if asynchronous:
+            return get_async_client(key, "no-key", backend.base_url, lambda: self._new_async_client(client_kwargs))
+        return get_client(key, "no-key", backend.base_url, lambda: self._new_client(client_kwargs))
+
+    @staticmethod
+    def _should_failover(error: Exception) -> bool:
+        """Backend irraggiungibile o non pronto: la richiesta può andare su un altro."""
+        return isinstance(error, openai_lib.APIConnectionError) or getattr(
+            error, "status_code", None
+        ) in (502, 503, 504)
+
+    def _release(self, backend, start: float, response=None, error=None, tokens=None) -> None:
+        usage = getattr(response, "usage", None)
+        if tokens is None:
+            tokens = getattr(usage, "completion_tokens", None)
+        self._record_timings(response, backend.server)
+        failover = error is not None and self._should_failover(error)
+        self.pool.release(backend, time.time() - start, tokens, error, failover=failover)
+
+    def _track_stream(self, backend, start: float, stream):
+        """Itera lo stream e libera il backend alla fine (chunk con testo ~ token)."""
+        chunk, error, tokens = None, None, 0
         try:
-            messages = self._build_messages(prompt)
-            stream = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                stream=True,
-            )
             for chunk in stream:
-                delta = chunk.choices[0].delta.content
-                if delta is not None:
-                    yield delta
+                if chunk.choices and chunk.choices[0].delta.content:
+                    tokens += 1
+                yield chunk
         except Exception as e:
-            yield f"❌ Errore OpenRouter Stream: {e}"
+            error = e
+            raise
+        finally:
+            usage = getattr(chunk, "usage", None)
+            self._release(backend, start, chunk, error, getattr(usage, "completion_tokens", None) or tokens)
+
+    async def _atrack_stream(self, backend, start: float, stream):
+        chunk, error, tokens = None, None, 0
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    tokens += 1
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            usage = getattr(chunk, "usage", None)
+            self._release(backend, start, chunk, error, getattr(usage, "completion_tokens", None) or tokens)
+
+    def _failover(self, backend, start: float, error: Exception, tried: list) -> None:
+        """Libera il backend fallito; rilancia l'errore se non c'è failover possibile."""
+        self._release(backend, start, error=error)
+        if not self._should_failover(error):
+            raise error
+        tried.append(backend.server)
+        print(f"⚠️ LlamaCpp: {backend.server} non disponibile ({error}), provo un altro backend...")
+
+    def _create(self, messages: list, stream: bool = False):
+        if self.pool is None:
+            return self._pinned_create(self.client, self.server, messages, stream)
+        tried = []
+        while True:
+            backend = self.pool.acquire(exclude=tried)
+            start = time.time()
+            try:
+                response = self._pinned_create(self._backend_client(backend), backend.server, messages, stream)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._failover(backend, start, e, tried)
+                continue
+            if stream:
+                return self._track_stream(backend, start, response)
+            self._release(backend, start, response)
+            return response
+
+    async def _acreate(self, messages: list, stream: bool = False):
+        if self.pool is None:
+            return await self._apinned_create(self.async_client, self.server, messages, stream)
+        tried = []
+        while True:
+            backend = self.pool.acquire(exclude=tried)
+            start = time.time()
+            try:
+                response = await self._apinned_create(
+                    self._backend_client(backend, asynchronous=True), backend.server, messages, stream
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._failover(backend, start, e, tried)
+                continue
+            if stream:
+                return self._atrack_stream(backend, start, response)
+            self._release(backend, start, response)
+            return response
+
+    def _await_server(self) -> None:
+        """Se il server è stato avviato da qui ed è in caricamento, la richiesta aspetta."""
+        server = managed_server(self.server)
+        if server is None or not server.is_starting():
+            return
+        print(f"⏳ LlamaCpp: attendo che {self.server} abbia caricato il modello...")
+        if not server.wait_ready():
+            raise RuntimeError(f"llama-server {self.server} non pronto ({server.status()['state']})")
+
+    def _supports_images(self) -> bool:
+        """Visione solo se llama-server è stato avviato con --mmproj (/props modalities)."""
+        props = self._server_props() or {}
+        return bool((props.get("modalities") or {}).get("vision"))
+
+    def _fit_text(self, text: str) -> str:
+        # Il server ha num_ctx fisso: il prompt va solo fatto rientrare (o rifiutato)
+        budget = fit_prompt(
+            text,
+            self.model_name,
+            self._context_window(),
+            label=f"llamacpp/{self.model_name}",
+        )
+        return budget.text
 
+    def _build_messages(self, prompt: Any) -> list:
+        self._await_server()
+        messages = super()._build_messages(prompt)
+        target = f"pool di {len(self.pool.backends)} backend" if self.pool else self.base_url
+        print(f"⏳ LlamaCpp: Invio richiesta a {self.model_name} ({target})...")
+        return messages
+
+    def _stream_summary(self, start_t: float, text: str, last_chunk, ttft, error) -> TextResponse:
+        if self.pool is None:
+            self._record_timings(last_chunk)
+        return super()._stream_summary(start_t, text, last_chunk, ttft, error)
+
+    def _wrap_response(self, response, duration: float):
+        if self.pool is None:
+            self._record_timings(response)
+        result = super()._wrap_response(response, duration)
+        print(
+            f"✅ LlamaCpp: {len(result.text or '')} chars | "
+            f"{result.output_tokens or 0} tokens out / {result.total_tokens or 0} tot | "
+            f"{result.tokens_per_sec:.1f} t/s | {duration:.2f}s"
+        )
+        return result
 
-class LlamaCppWrapper:
-    """Wrapper per llama.cpp server (OpenAI-compatible API)."""
 
-    def __init__(self, model_name: str, host: str = "localhost", port: int = 8080, json_mode: bool = False):
-        self.model_name = model_name
-        self.host = host
-        self.port = port
+# Un riavvio può caricare un altro GGUF: n_ctx, slot e visione vanno riletti
+add_spawn_listener(LlamaCppWrapper.forget_server)
+
+
+class ReplayWrapper:
+    """Wrapper del provider "replay": riproduce le risposte della cassette
+    con i tempi registrati, oppure le registra dal provider reale (replay.py).
+    """
+
+    PROVIDER = "replay"
+
+    def __init__(self, provider, json_mode: bool):
+        self.provider = provider
         self.json_mode = json_mode
-        self.base_url = f"http://{host}:{port}/v1"
-        if not OPENAI_AVAILABLE:
-            raise ImportError("Libreria 'openai' non installata. Esegui: pip install openai")
-        self.client = openai_lib.OpenAI(
-            base_url=self.base_url,
-            api_key="no-key",  # llama-server non richiede API key
+        self.model_name = provider.current_model_name
+        self.cassette = provider.cassette
+        recorder = provider.replay_recorder
+        self.inner = recorder._create_wrapper(json_mode) if recorder else None
+
+    def _lookup(self, prompt: Any) -> Tuple[str, Optional[dict]]:
+        """(chiave, registrazione da riprodurre o None se va registrata)."""
+        key = replay_key(self.json_mode, prompt)
+        entry = None if self.provider.replay_mode == RECORD else self.cassette.next(key)
+        if entry is None and self.provider.replay_mode == REPLAY:
+            raise RuntimeError(
+                f"Replay: nessuna risposta registrata per questo prompt "
+                f"(chiave {key[:12]}, cassette {self.cassette.path})"
+            )
+        return key, entry
+
+    @staticmethod
+    def _chunks(entry: dict) -> list:
+        """[[secondi dall'inizio, testo], ...]; una risposta non in streaming è un unico chunk."""
+        return entry.get("chunks") or [[entry.get("latency_sec") or 0.0, entry["text"]]]
+
+    def _replayed(self, entry: dict, start: float, stream: bool = False) -> TextResponse:
+        latency = time.time() - start
+        ttft = replay_delay(entry.get("ttft_sec")) if stream else None
+        get_metrics().observe_request(
+            self.PROVIDER,
+            entry.get("model") or self.model_name,
+            latency,
+            input_tokens=entry.get("input_tokens"),
+            output_tokens=entry.get("output_tokens"),
+            ttft_sec=ttft,
+            stream=stream,
+        )
+        return TextResponse(
+            entry["text"],
+            model=entry.get("model") or self.model_name,
+            provider=self.PROVIDER,
+            input_tokens=entry.get("input_tokens"),
+            output_tokens=entry.get("output_tokens"),
+            latency_sec=latency,
+            ttft_sec=ttft,
+            stream=stream,
         )
 
+    def _entry(self, key: str, response, latency: float, text: str, chunks=None) -> dict:
+        recorder = self.provider.replay_recorder
+        return {
+            "key": key,
+            "json_mode": self.json_mode,
+            "provider": recorder.provider_type,
+            "model": getattr(response, "model", None) or recorder.current_model_name,
+            "text": text,
+            "latency_sec": round(latency, 4),
+            "ttft_sec": chunks[0][0] if chunks else None,
+            "input_tokens": getattr(response, "input_tokens", None),
+            "output_tokens": getattr(response, "output_tokens", None),
+            "chunks": chunks,
+        }
+
     def generate_content(self, prompt: Any):
-        """Genera contenuto usando llama-server."""
-        try:
-            content, images = process_multimodal_input(prompt, self.model_name)
+        """Risposta registrata (dopo la latenza registrata / AI_REPLAY_SPEED) o registrazione."""
+        key, entry = self._lookup(prompt)
+        start = time.time()
+        if entry is None:
+            response = self.inner.generate_content(prompt)
+            self.cassette.record(self._entry(key, response, time.time() - start, response.text))
+            return response
+        time.sleep(replay_delay(entry.get("latency_sec")))
+        return self._replayed(entry, start)
+
+    async def agenerate_content(self, prompt: Any):
+        key, entry = self._lookup(prompt)
+        start = time.time()
+        if entry is None:
+            response = await self.inner.agenerate_content(prompt)
+            self.cassette.record(self._entry(key, response, time.time() - start, response.text))
+            return response
+        await asyncio.sleep(replay_delay(entry.get("latency_sec")))
+        return self._replayed(entry, start)
+
+    def _record_chunks(self, key: str, start: float, chunks: list, summaries: list) -> None:
+        summary = summaries[-1] if summaries else None
+        text = "".join(chunk for _, chunk in chunks)
+        # Gli errori di stream arrivano come testo "❌ ...": non vanno registrati
+        if (summary is not None and summary.error) or not text or text.startswith("❌"):
+            return
+        self.cassette.record(self._entry(key, summary, time.time() - start, text, chunks))
+
+    def generate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Chunk registrati con i loro tempi relativi, oppure stream reale registrato."""
+        key, entry = self._lookup(prompt)
+        start = time.time()
+        if entry is None:
+            chunks, summaries = [], []
+            for chunk in self.inner.generate_stream(prompt, on_complete=summaries.append):
+                if chunk:
+                    chunks.append([round(time.time() - start, 4), chunk])
+                yield chunk
+            self._record_chunks(key, start, chunks, summaries)
+            if on_complete and summaries:
+                on_complete(summaries[-1])
+            return
+        for offset, chunk in self._chunks(entry):
+            wait = start + replay_delay(offset) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            yield chunk
+        if on_complete:
+            on_complete(self._replayed(entry, start, stream=True))
+
+    async def agenerate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        key, entry = self._lookup(prompt)
+        start = time.time()
+        if entry is None:
+            chunks, summaries = [], []
+            async for chunk in self.inner.agenerate_stream(prompt, on_complete=summaries.append):
+                if chunk:
+                    chunks.append([round(time.time() - start, 4), chunk])
+                yield chunk
+            self._record_chunks(key, start, chunks, summaries)
+            if on_complete and summaries:
+                on_complete(summaries[-1])
+            return
+        for offset, chunk in self._chunks(entry):
+            wait = start + replay_delay(offset) - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield chunk
+        if on_complete:
+            on_complete(self._replayed(entry, start, stream=True))
+
+
+@dataclass
+class CachedResponse(TextResponse):
+    """Risposta servita dalla response cache."""
+
+    cache_hit: bool = True
+
+
+class CachedModelWrapper:
+    """Aggiunge la response cache persistente a qualsiasi wrapper di modello.
+
+    La chiave usa il modello che il router sceglie per la chiamata e la
+    risposta viene salvata sotto il modello che ha risposto davvero, così
+    un downgrade Gemini non restituisce risposte di un altro modello.
+    """
 
-            if images:
-                content += "\n[Note: Image attachments are not supported via llama.cpp server]\n"
+    def __init__(self, inner, provider, json_mode: bool, cache: ResponseCache):
+        self.inner = inner
+        self.provider = provider
+        self.json_mode = json_mode
+        self.cache = cache
 
-            messages = [{"role": "user", "content": content}]
-            kwargs = {
-                "model": self.model_name,
-                "messages": messages,
-            }
-            if self.json_mode:
-                kwargs["response_format"] = {"type": "json_object"}
+    def __getattr__(self, name):
+        # Espone gli attributi del wrapper originale (model_name, client, ...)
+        return getattr(self.inner, name)
 
-            print(f"⏳ LlamaCpp: Invio richiesta a {self.model_name} ({self.base_url})...")
-            start_t = time.time()
+    def _key(self, prompt: Any, model: str) -> str:
+        return make_cache_key(
+            self.provider.provider_type, model, self.json_mode, prompt, self.provider.api_key
+        )
 
-            response = self.client.chat.completions.create(**kwargs)
+    def _hit(self, text: str, start: float, model: str, stream: bool = False) -> CachedResponse:
+        return CachedResponse(
+            text,
+            model=model,
+            provider=self.provider.provider_type,
+            latency_sec=time.time() - start,
+            stream=stream,
+        )
 
-            duration = time.time() - start_t
-            result_text = response.choices[0].message.content
+    def _store(self, prompt: Any, model: str, text: str, response=None) -> None:
+        """Salva la risposta sotto il modello che l'ha generata (Gemini può aver fatto downgrade)."""
+        answered = getattr(response, "model", None)
+        if self.provider.provider_type == "gemini" and answered:
+            model = answered
+        self.cache.set(
+            self._key(prompt, model),
+            text,
+            provider=self.provider.provider_type,
+            model=model,
+        )
 
-            # Extract token usage from llama-server response
-            usage = getattr(response, "usage", None)
-            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
-            total_tokens = getattr(usage, "total_tokens", 0) or 0
-            tokens_per_sec = completion_tokens / duration if duration > 0 else 0
+    def generate_content(self, prompt: Any):
+        """Restituisce la risposta in cache o chiama il modello e la salva."""
+        start = time.time()
+        model = self.provider.select_model(claim=False)
+        cached = self.cache.get(self._key(prompt, model))
+        if cached is not None:
+            self.provider.log_debug(f"💾 Cache HIT | {self.provider.provider_type}/{model}")
+            return self._hit(cached, start, model)
+
+        response = self.inner.generate_content(prompt)
+        text = getattr(response, "text", None)
+        if text:
+            self._store(prompt, model, text, response)
+        return response
+
+    def generate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Stream con cache: in caso di hit l'intero testo arriva in un unico chunk."""
+        start = time.time()
+        model = self.provider.select_model(claim=False)
+        cached = self.cache.get(self._key(prompt, model))
+        if cached is not None:
+            yield cached
+            if on_complete:
+                on_complete(self._hit(cached, start, model, stream=True))
+            return
+
+        chunks = []
+        summaries = []
+
+        def done(summary):
+            summaries.append(summary)
+            if on_complete:
+                on_complete(summary)
+
+        for chunk in self.inner.generate_stream(prompt, on_complete=done):
+            if chunk:
+                chunks.append(chunk)
+            yield chunk
+
+        text = "".join(chunks)
+        # I wrapper segnalano gli errori di stream come testo: non vanno salvati
+        if text and not text.startswith("❌"):
+            self._store(prompt, model, text, summaries[-1] if summaries else None)
+
+    async def agenerate_content(self, prompt: Any):
+        """Versione asincrona di generate_content con la stessa cache."""
+        start = time.time()
+        model = self.provider.select_model(claim=False)
+        cached = self.cache.get(self._key(prompt, model))
+        if cached is not None:
+            return self._hit(cached, start, model)
+
+        response = await self.inner.agenerate_content(prompt)
+        text = getattr(response, "text", None)
+        if text:
+            self._store(prompt, model, text, response)
+        return response
+
+    async def agenerate_stream(self, prompt: Any, on_complete: StreamCallback = None):
+        """Versione asincrona di generate_stream con la stessa cache."""
+        start = time.time()
+        model = self.provider.select_model(claim=False)
+        cached = self.cache.get(self._key(prompt, model))
+        if cached is not None:
+            yield cached
+            if on_complete:
+                on_complete(self._hit(cached, start, model, stream=True))
+            return
+
+        chunks = []
+        summaries = []
+
+        def done(summary):
+            summaries.append(summary)
+            if on_complete:
+                on_complete(summary)
+
+        async for chunk in self.inner.agenerate_stream(prompt, on_complete=done):
+            if chunk:
+                chunks.append(chunk)
+            yield chunk
+
+        text = "".join(chunks)
+        if text and not text.startswith("❌"):
+            self._store(prompt, model, text, summaries[-1] if summaries else None)
+
+
+class CoalescingModelWrapper:
+    """Single-flight: le richieste identiche in volo condividono una sola chiamata.
+
+    La chiave è quella della response cache (provider, modello scelto dal
+    router, json_mode, prompt). Lo streaming passa invariato al wrapper interno.
+    """
 
-            print(
-                f"✅ LlamaCpp: {len(result_text)} chars | "
-                f"{completion_tokens} tokens out / {total_tokens} tot | "
-                f"{tokens_per_sec:.1f} t/s | {duration:.2f}s"
-            )
+    def __init__(self, inner, provider, json_mode: bool):
+        self.inner = inner
+        self.provider = provider
+        self.json_mode = json_mode
 
-            class Response:
-                def __init__(self, text, _completion_tokens, _total_tokens, _tps, _duration):
-                    self.text = text
-                    self.completion_tokens = _completion_tokens
-                    self.total_tokens = _total_tokens
-                    self.tokens_per_sec = _tps
-                    self.duration_sec = _duration
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
 
-            return Response(result_text, completion_tokens, total_tokens, tokens_per_sec, duration)
+    def _flight(self, prompt: Any) -> Tuple[str, str]:
+        """(chiave, etichetta provider/modello) della richiesta."""
+        provider_type = self.provider.provider_type
+        model = self.provider.select_model(claim=False)
+        key = make_cache_key(provider_type, model, self.json_mode, prompt, self.provider.api_key)
+        return key, f"{provider_type}/{model}"
 
-        except Exception as e:
-            raise RuntimeError(f"LlamaCpp Error: {e}") from e
+    def generate_content(self, prompt: Any):
+        key, label = self._flight(prompt)
+        return get_single_flight().do(key, lambda: self.inner.generate_content(prompt), label)
 
-    def generate_stream(self, prompt: Any):
-        """Genera in streaming usando llama-server."""
-        try:
-            content, images = process_multimodal_input(prompt, self.model_name)
+    async def agenerate_content(self, prompt: Any):
+        key, label = self._flight(prompt)
+        return await get_single_flight().ado(key, lambda: self.inner.agenerate_content(prompt), label)
 
-            if images:
-                content += "\n[Note: Image attachments are not supported via llama.cpp server]\n"
 
-            messages = [{"role": "user", "content": content}]
-            kwargs = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": True,
-            }
-            if self.json_mode:
-                kwargs["response_format"] = {"type": "json_object"}
+class HedgedModelWrapper:
+    """Hedging per le chiamate sensibili alla latenza.
 
-            stream = self.client.chat.completions.create(**kwargs)
+    Se il modello primario non risponde entro il suo p90 storico, lo stesso
+    prompt parte anche sul secondario del provider; vince la prima risposta
+    valida. Lo streaming passa invariato al wrapper primario.
+    """
 
-            for chunk in stream:
-                delta = chunk.choices[0].delta.content
-                if delta is not None:
-                    yield delta
+    def __init__(self, inner, provider, json_mode: bool):
+        self.inner = inner
+        self.provider = provider
+        self.json_mode = json_mode
 
-        except Exception as e:
-            yield f"❌ Errore LlamaCpp Stream: {e}"
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def _plan(self):
+        """Modello primario, ritardo di hedge e wrapper secondario (o None)."""
+        provider_type = self.provider.provider_type
+        model = self.provider.select_model(claim=False)
+        secondary = self.provider.hedge_target(model)
+        backup = secondary._create_wrapper(self.json_mode) if secondary else None
+        return model, hedge_delay(provider_type, model), backup
+
+    def _is_valid(self, response: Any) -> bool:
+        return is_valid_response(response, self.json_mode)
+
+    def generate_content(self, prompt: Any):
+        """Genera con hedging (thread): il secondario parte dopo il p90 del primario."""
+        model, delay, backup = self._plan()
+        return run_hedged(
+            lambda: self.inner.generate_content(prompt),
+            (lambda: backup.generate_content(prompt)) if backup else None,
+            delay,
+            self._is_valid,
+            f"{self.provider.provider_type}/{model}",
+        )
+
+    async def agenerate_content(self, prompt: Any):
+        """Versione asincrona: la richiesta perdente viene cancellata."""
+        model, delay, backup = await asyncio.to_thread(self._plan)
+        return await arun_hedged(
+            lambda: self.inner.agenerate_content(prompt),
+            (lambda: backup.agenerate_content(prompt)) if backup else None,
+            delay,
+            self._is_valid,
+            f"{self.provider.provider_type}/{model}",
+            primary_estimate=get_router().latency_percentile(self.provider.provider_type, model, 0.99),
+        )
 
 
 class AIProvider:
@@ -648,6 +1869,8 @@ class AIProvider:
 
     PUTER_BASE_URL = "https://api.puter.com/puterai/openai/v1/"
 
+    OPENROUTER_MODELS = ["anthropic/claude-3.5-sonnet", "openai/gpt-4o", "google/gemini-pro-1.5"]
+
     LLAMACPP_HOST = "localhost"
     LLAMACPP_PORT = 8080
     LLAMACPP_SERVER_SCRIPT = os.path.expanduser(
@@ -657,17 +1880,40 @@ class AIProvider:
         "~/Progetti/llama_turboquant/models"
     )
 
+    _pgrep_result: Tuple[float, bool] = (0.0, False)
+
     @staticmethod
     def is_llamacpp_running() -> bool:
-        """Verifica se il processo llama-server è in esecuzione."""
+        """Verifica se il processo llama-server è in esecuzione.
+
+        Per il server avviato da questo processo usa lo stato del manager;
+        altrimenti pgrep, con il risultato riusato per 5 secondi.
+        """
+        server = managed_server(f"{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}")
+        if server is not None and server.is_running():
+            return True
+        checked_at, running = AIProvider._pgrep_result
+        if time.time() - checked_at < 5:
+            return running
         try:
             result = subprocess.run(
                 ["pgrep", "-f", "llama-server"],
                 capture_output=True, timeout=3,
             )
-            return result.returncode == 0
+            running = result.returncode == 0
         except Exception:
-            return False
+            running = False
+        AIProvider._pgrep_result = (time.time(), running)
+        return running
+
+    @staticmethod
+    def llamacpp_status() -> dict:
+        """Stato del server llama.cpp: starting/loading/ready/crashed/stopped, avanzamento, riavvii."""
+        server = managed_server(f"{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}")
+        if server is not None:
+            return server.status()
+        state = "external" if AIProvider.detect_llamacpp() else "stopped"
+        return {"server": f"{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}", "state": state}
 
     @staticmethod
     def get_local_llamacpp_models() -> List[str]:
@@ -682,6 +1928,9 @@ class AIProvider:
         """
         Avvia il server LlamaCpp in background.
         Restituisce il PID del processo.
+
+        Il processo è seguito dal manager (llamacpp_server): caricamento via
+        /health, riavvio in caso di crash, richieste in attesa finché non è pronto.
         """
         env = os.environ.copy()
         env["GGML_CUDA_ENABLE_UNIFIED_MEMORY"] = "1"
@@ -691,35 +1940,57 @@ class AIProvider:
         if thinking_mode:
             env["LLAMA_THINKING_MODE"] = thinking_mode
             
-        proc = subprocess.Popen(
-            ["fish", AIProvider.LLAMACPP_SERVER_SCRIPT],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            start_new_session=True,
-            env=env,
+        pid = get_server(AIProvider.LLAMACPP_HOST, AIProvider.LLAMACPP_PORT).start(
+            ["fish", AIProvider.LLAMACPP_SERVER_SCRIPT], env, model=model_filename
+        )
+        # Il nuovo server può caricare un altro modello
+        get_catalog().invalidate(
+            f"llamacpp:{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}"
         )
-        return proc.pid
+        return pid
 
     @staticmethod
-    def stop_llamacpp_server() -> None:
-        """Termina il server LlamaCpp."""
-        subprocess.run(["pkill", "-f", "llama-server"], timeout=5)
+    def stop_llamacpp_server() -> bool:
+        """Termina il server LlamaCpp avviato da questo processo (solo il suo gruppo di processi).
 
-    _cached_chain: Optional[List[str]] = None
-    _last_scrape_time: float = 0
+        Restituisce False se il server non è gestito da qui: gli altri
+        llama-server dell'host (es. i backend del pool) non vengono toccati.
+        """
+        server = managed_server(f"{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}")
+        if server is None:
+            print(
+                f"⚠️ LlamaCpp: il server su {AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT} "
+                "non è stato avviato da qui, va fermato dove è stato lanciato."
+            )
+            return False
+        server.stop()
+        AIProvider._pgrep_result = (0.0, False)
+        LlamaCppWrapper.forget_server(f"{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}")
+        get_catalog().invalidate(
+            f"llamacpp:{AIProvider.LLAMACPP_HOST}:{AIProvider.LLAMACPP_PORT}"
+        )
+        return True
 
     def __init__(
         self,
         api_key: Optional[str] = None,
         provider_type: str = "gemini",
         model_name: Optional[str] = None,
+        use_cache: Optional[bool] = None,
     ):
         """
         Inizializza il provider.
         IMPORTANTE: Configura immediatamente la catena o il modello in base al provider_type.
+
+        use_cache: abilita la response cache su disco (default: env AI_CACHE, false).
+            Va attivata solo per prompt deterministici: una risposta in cache
+            viene riservita fino alla scadenza del TTL.
         """
         self.provider_type = provider_type.lower()
         self.target_model = model_name
+        if use_cache is None:
+            use_cache = os.getenv("AI_CACHE", "false").lower() == "true"
+        self.use_cache = use_cache
 
         # Gestione API Key: Priorità a quella passata, poi Env (specifico per provider)
         if self.provider_type == "groq":
@@ -737,6 +2008,14 @@ class AIProvider:
         self.current_model_index = 0
         self.current_model_name = ""
         self.available_models_chain: List[str] = []
+        # Catena fissata (es. secondario dell'hedging): select_model non la sostituisce col catalogo
+        self.pinned_chain = False
+        # Modello e catena cambiano da più thread (generate_many, hedging): scritture sotto lock
+        self._model_lock = threading.RLock()
+
+        # Hedging (opt-in, vedi enable_hedging)
+        self.hedging = False
+        self.hedge_secondary: Optional["AIProvider"] = None
 
         # --- LOGICA DI INIZIALIZZAZIONE DEL PROVIDER ---
         if self.provider_type == "gemini":
@@ -758,6 +2037,13 @@ class AIProvider:
             self.log_debug(
                 f"🤖 AI Provider impostato su Ollama: {self.current_model_name}"
             )
+            # Caricamento del modello fuori dal percorso critico della prima richiesta
+            if os.getenv("AI_OLLAMA_PRELOAD", "true").lower() == "true":
+                # Una sola volta per modello e con il num_ctx che userà il budget
+                window = OllamaWrapper(self.current_model_name)._context_window  # pylint: disable=protected-access
+                warmup_async(self.current_model_name, max_ctx=window)
+            if os.getenv("AI_OLLAMA_HEARTBEAT", "false").lower() == "true":
+                start_heartbeat(self.current_model_name)
 
         elif self.provider_type == "groq":
             if not GROQ_AVAILABLE:
@@ -800,13 +2086,34 @@ class AIProvider:
                 f"🤖 AI Provider impostato su OpenRouter: {self.current_model_name}"
             )
 
+        elif self.provider_type == "replay":
+            # Risposte registrate (replay.py): deterministiche e senza rete in modalità replay
+            self.use_cache = False
+            self.replay_mode = replay_mode()
+            self.cassette = get_cassette()
+            self.replay_recorder: Optional["AIProvider"] = None
+            if self.replay_mode != REPLAY:
+                self.replay_recorder = AIProvider(
+                    api_key=api_key,
+                    provider_type=os.getenv("AI_REPLAY_PROVIDER", "gemini"),
+                    model_name=model_name,
+                    use_cache=False,
+                )
+                self.current_model_name = self.replay_recorder.current_model_name
+            else:
+                self.current_model_name = self.target_model or "replay"
+            self.log_debug(
+                f"📼 AI Provider impostato su Replay ({self.replay_mode}): "
+                f"{len(self.cassette)} risposte in {self.cassette.path}"
+            )
+
         elif self.provider_type == "llamacpp":
             if not OPENAI_AVAILABLE:
                 raise ImportError(
                     "Libreria 'openai' non installata. Esegui: pip install openai"
                 )
             # Recupera il primo modello disponibile dal server
-            models = self.get_llamacpp_models()
+            models = [] if self.target_model else self.get_llamacpp_models(wait=FIRST_FETCH_WAIT_SEC)
             self.current_model_name = self.target_model or (models[0] if models else "default")
             self.log_debug(
                 f"🤖 AI Provider impostato su LlamaCpp: {self.current_model_name}"
@@ -826,7 +2133,7 @@ class AIProvider:
 
     @staticmethod
     def get_groq_models(api_key: Optional[str] = None) -> List[str]:
-        """Recupera la lista dei modelli da Groq via API.
+        """Recupera la lista dei modelli da Groq (catalogo su disco, refresh in background).
 
         Se moonshotai/kimi-k2-instruct è disponibile viene posto in prima posizione
         (miglior modello per PDF reading). Altrimenti la lista è restituita invariata.
@@ -834,64 +2141,66 @@ class AIProvider:
         api_key = api_key or os.getenv("GROQ_API_KEY")
         if not api_key:
             return AIProvider.GROQ_MODELS or []
+        return get_catalog().get(
+            "groq", lambda: AIProvider._fetch_groq_models(api_key), default=AIProvider.GROQ_MODELS
+        )
 
+    @staticmethod
+    def _fetch_groq_models(api_key: str) -> List[str]:
+        """Lista dei modelli via API Groq (solleva eccezione in caso di errore)."""
         url = "https://api.groq.com/openai/v1/models"
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
-
-        try:
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                # Extract model IDs
-                models = [m["id"] for m in data.get("data", [])]
-                sorted_models = sorted(models)
-                # Prioritize preferred PDF model if available
-                preferred = AIProvider.PREFERRED_GROQ_MODEL
-                if preferred in sorted_models:
-                    sorted_models.remove(preferred)
-                    sorted_models.insert(0, preferred)
-                return sorted_models
-            else:
-                print(f"⚠️ Groq API Error {response.status_code}: {response.text}")
-                return AIProvider.GROQ_MODELS
-        except Exception as e:
-            print(f"⚠️ Error fetching Groq models: {e}")
-            return AIProvider.GROQ_MODELS
+        response = get_http_session().get(url, headers=headers, timeout=5)
+        if response.status_code != 200:
+            raise RuntimeError(f"Groq API Error {response.status_code}: {response.text}")
+        data = response.json()
+        # Extract model IDs
+        models = [m["id"] for m in data.get("data", [])]
+        sorted_models = sorted(models)
+        # Prioritize preferred PDF model if available
+        preferred = AIProvider.PREFERRED_GROQ_MODEL
+        if preferred in sorted_models:
+            sorted_models.remove(preferred)
+            sorted_models.insert(0, preferred)
+        return sorted_models
 
     @staticmethod
-    def get_gemini_models(api_key: Optional[str] = None) -> List[str]:
-        """Recupera la lista dei modelli Gemini disponibili (da cache o fallback)."""
-        if AIProvider._cached_chain and (
-            time.time() - AIProvider._last_scrape_time < 3600
-        ):
-            return AIProvider._cached_chain
+    def get_gemini_models(api_key: Optional[str] = None) -> List[str]:  # pylint: disable=unused-argument
+        """Recupera la lista dei modelli Gemini disponibili (catalogo su disco o fallback).
 
-        try:
-            temp_provider = AIProvider(api_key=api_key, provider_type="gemini")
-            if temp_provider.available_models_chain:
-                return temp_provider.available_models_chain
-        except Exception:
-            pass
+        Non attende mai lo scraping: senza catalogo restituisce FALLBACK_ORDER
+        e la lista completa è disponibile appena il refresh in background finisce.
+        """
+        return get_catalog().get(
+            "gemini", AIProvider._fetch_gemini_models, default=AIProvider.FALLBACK_ORDER
+        )
 
-        return AIProvider.FALLBACK_ORDER
+    @staticmethod
+    def _fetch_gemini_models() -> List[str]:
+        """Fallback (che includono i preview) uniti ai modelli trovati dallo scraping."""
+        scraped_models = AIProvider._build_gemini_chain()
+        if not scraped_models:
+            return []
+        # Rimuove i duplicati preservando l'ordine
+        return list(dict.fromkeys(AIProvider.FALLBACK_ORDER + scraped_models))
 
     @staticmethod
     def get_ollama_models() -> List[str]:
         """Recupera la lista dei modelli locali installati su Ollama."""
         if not OLLAMA_AVAILABLE:
             return []
-        try:
-            # ollama.list() ritorna un dict con 'models'
-            models_info = ollama.list()  # pyright: ignore[reportUnboundVariable]
-            return [
-                m.get("model") or m.get("name") for m in models_info.get("models", [])
-            ]
-        except Exception as e:  # pylint: disable=broad-exception-caught
-            print(f"⚠️ Errore listing Ollama: {e}")
-            return []
+        return get_catalog().get("ollama", AIProvider._fetch_ollama_models, ttl=LOCAL_TTL_SEC)
+
+    @staticmethod
+    def _fetch_ollama_models() -> List[str]:
+        # ollama.list() ritorna un dict con 'models'
+        models_info = ollama.list()
+        return [
+            m.get("model") or m.get("name") for m in models_info.get("models", [])
+        ]
 
     @staticmethod
     def get_puter_models() -> List[str]:
@@ -900,30 +2209,32 @@ class AIProvider:
 
     @staticmethod
     def get_openrouter_models(api_key: Optional[str] = None) -> List[str]:
-        """Recupera la lista dei modelli OpenRouter via API."""
+        """Recupera la lista dei modelli OpenRouter (catalogo su disco, refresh in background)."""
         api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         if not api_key:
-            return ["anthropic/claude-3.5-sonnet", "openai/gpt-4o", "google/gemini-pro-1.5"]
-        
+            return list(AIProvider.OPENROUTER_MODELS)
+        return get_catalog().get(
+            "openrouter",
+            lambda: AIProvider._fetch_openrouter_models(api_key),
+            default=AIProvider.OPENROUTER_MODELS,
+        )
+
+    @staticmethod
+    def _fetch_openrouter_models(api_key: str) -> List[str]:
         url = "https://openrouter.ai/api/v1/models"
         headers = {
             "Authorization": f"Bearer {api_key}",
         }
-        
-        try:
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                models = [m["id"] for m in data.get("data", [])]
-                # Default list on top
-                defaults = ["anthropic/claude-3.7-sonnet", "openai/gpt-4o", "google/gemini-2.5-flash"]
-                available_defaults = [m for m in defaults if m in models]
-                others = sorted([m for m in models if m not in defaults])
-                return available_defaults + others
-            else:
-                return ["anthropic/claude-3.5-sonnet", "openai/gpt-4o", "google/gemini-pro-1.5"]
-        except Exception:
-            return ["anthropic/claude-3.5-sonnet", "openai/gpt-4o", "google/gemini-pro-1.5"]
+        response = get_http_session().get(url, headers=headers, timeout=5)
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenRouter API Error {response.status_code}")
+        data = response.json()
+        models = [m["id"] for m in data.get("data", [])]
+        # Default list on top
+        defaults = ["anthropic/claude-3.7-sonnet", "openai/gpt-4o", "google/gemini-2.5-flash"]
+        available_defaults = [m for m in defaults if m in models]
+        others = sorted([m for m in models if m not in defaults])
+        return available_defaults + others
 
     @staticmethod
     def detect_llamacpp(host: str = None, port: int = None) -> bool:
@@ -931,32 +2242,182 @@ class AIProvider:
         host = host or AIProvider.LLAMACPP_HOST
         port = port or AIProvider.LLAMACPP_PORT
         try:
-            r = requests.get(f"http://{host}:{port}/health", timeout=2)
+            r = get_http_session().get(f"http://{host}:{port}/health", timeout=2)
             return r.status_code == 200
         except Exception:
             return False
 
     @staticmethod
-    def get_llamacpp_models(host: str = None, port: int = None) -> List[str]:
-        """Recupera i modelli caricati da llama-server /v1/models."""
+    def get_llamacpp_models(host: str = None, port: int = None, wait: float = 0.0) -> List[str]:
+        """Recupera i modelli caricati da llama-server /v1/models.
+
+        Senza catalogo restituisce [] subito (o attende il primo fetch al massimo `wait` secondi).
+        """
         host = host or AIProvider.LLAMACPP_HOST
         port = port or AIProvider.LLAMACPP_PORT
-        try:
-            r = requests.get(f"http://{host}:{port}/v1/models", timeout=3)
-            if r.status_code == 200:
-                data = r.json()
-                return [m["id"] for m in data.get("data", [])]
-        except Exception as e:
-            print(f"⚠️ Error fetching LlamaCpp models: {e}")
-        return []
+
+        def fetch() -> List[str]:
+            r = get_http_session().get(f"http://{host}:{port}/v1/models", timeout=3)
+            r.raise_for_status()
+            return [m["id"] for m in r.json().get("data", [])]
+
+        return get_catalog().get(f"llamacpp:{host}:{port}", fetch, ttl=LOCAL_TTL_SEC, wait=wait)
+
+    @staticmethod
+    def model_catalog_stats() -> dict:
+        """Voci del catalogo modelli su disco (età, numero di modelli) e hit/refresh."""
+        return get_catalog().snapshot()
 
     def log_debug(self, message: str):
         """Log di debug se abilitato."""
         if self.debug_mode:
             print(message)
 
-    def get_model(self, json_mode: bool = False) -> Any:
-        """Restituisce l'istanza del modello AI richiesto."""
+    def get_model(self, json_mode: bool = False, hedged: Optional[bool] = None) -> Any:
+        """Restituisce l'istanza del modello AI richiesto.
+
+        hedged: forza (True/False) l'hedging per questo modello; None usa
+        l'impostazione di enable_hedging.
+        """
+        model = self._create_wrapper(json_mode)
+        if self.hedging if hedged is None else hedged:
+            model = HedgedModelWrapper(model, self, json_mode)
+        if self.use_cache:
+            try:
+                model = CachedModelWrapper(model, self, json_mode, get_default_cache())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.log_debug(f"⚠️ Response cache disabilitata: {e}")
+                self.use_cache = False
+        if single_flight_enabled():
+            model = CoalescingModelWrapper(model, self, json_mode)
+        return model
+
+    async def aget_model(self, json_mode: bool = False, hedged: Optional[bool] = None) -> Any:
+        """Come get_model, per codice asyncio.
+
+        La costruzione dei client avviene in un thread per non bloccare l'event loop;
+        il modello restituito espone agenerate_content / agenerate_stream.
+        """
+        return await asyncio.to_thread(self.get_model, json_mode, hedged)
+
+    def enable_hedging(
+        self, secondary: Optional["AIProvider"] = None, default: bool = True
+    ) -> None:
+        """Abilita le richieste hedged verso un provider/modello secondario.
+
+        Senza `secondary`, per Gemini si usa il miglior altro modello sano
+        della catena. default=False lascia l'hedging spento salvo
+        get_model(hedged=True), per coprire solo le chiamate critiche.
+        """
+        self.hedge_secondary = secondary
+        self.hedging = default
+
+    def hedge_target(self, primary: Optional[str] = None) -> Optional["AIProvider"]:
+        """Provider su cui inviare la richiesta di riserva (None se non disponibile).
+
+        primary: modello della richiesta principale, escluso dalla scelta.
+        """
+        if self.hedge_secondary is not None:
+            return self.hedge_secondary
+        if self.provider_type != "gemini":
+            return None
+        model = get_router().choose(
+            "gemini",
+            self.available_models_chain,
+            exclude={primary or self.current_model_name},
+            claim=False,
+        )
+        if model is None:
+            return None
+        # Copia leggera con la catena ridotta al solo modello di riserva
+        secondary = copy.copy(self)
+        secondary._model_lock = threading.RLock()
+        secondary.available_models_chain = [model]
+        secondary.current_model_index = 0
+        secondary.current_model_name = model
+        secondary.pinned_chain = True
+        secondary.hedging = False
+        return secondary
+
+    def generate_many(
+        self,
+        prompts: List[Any],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        json_mode: bool = False,
+        on_result=None,
+    ) -> List[BatchResult]:
+        """Genera risposte per più prompt indipendenti in parallelo (thread pool limitato).
+
+        Restituisce un BatchResult per prompt, nello stesso ordine di input, con
+        testo o errore e latenza del singolo elemento. on_result(result) viene
+        chiamato al completamento di ogni elemento.
+        """
+        model = self.get_model(json_mode=json_mode)
+        results = run_batch(model.generate_content, prompts, concurrency, on_result)
+        failed = sum(1 for r in results if not r.ok)
+        self.log_debug(
+            f"📦 generate_many: {len(results)} prompt, {failed} errori, concorrenza {concurrency}"
+        )
+        return results
+
+    async def agenerate_many(
+        self,
+        prompts: List[Any],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        json_mode: bool = False,
+        on_result=None,
+    ) -> List[BatchResult]:
+        """Variante asyncio di generate_many basata su agenerate_content."""
+        model = await self.aget_model(json_mode=json_mode)
+        return await arun_batch(model.agenerate_content, prompts, concurrency, on_result)
+
+    def stream_json(self, prompt: Any, path: Sequence = (), on_complete=None) -> Iterator[Any]:
+        """Genera in json_mode e restituisce gli elementi dell'array a `path` appena si chiudono.
+
+        Es. path=("mappings",) per {"mappings": [...]}. on_complete(documento)
+        riceve il JSON completo a fine stream. Solleva RuntimeError se lo
+        stream fallisce e ValueError se il JSON resta incompleto.
+        """
+        model = self.get_model(json_mode=True)
+        parser = JsonStreamParser(path)
+        summaries = []
+        # Ogni chunk arriva al parser solo dopo il successivo: l'ultimo può essere il
+        # messaggio "❌ Errore..." del wrapper, che non è JSON e va scartato
+        pending = None
+        for chunk in model.generate_stream(prompt, on_complete=summaries.append):
+            if pending is not None:
+                yield from parser.feed(pending)
+            pending = chunk or ""
+        if summaries and summaries[-1].error:
+            raise RuntimeError(f"Stream JSON fallito: {summaries[-1].error}")
+        if pending is not None:
+            yield from parser.feed(pending)
+        document = parser.result()
+        if on_complete:
+            on_complete(document)
+
+    async def astream_json(self, prompt: Any, path: Sequence = (), on_complete=None) -> AsyncIterator[Any]:
+        """Versione asincrona di stream_json basata su agenerate_stream."""
+        model = await self.aget_model(json_mode=True)
+        parser = JsonStreamParser(path)
+        summaries = []
+        pending = None
+        async for chunk in model.agenerate_stream(prompt, on_complete=summaries.append):
+            if pending is not None:
+                for item in parser.feed(pending):
+                    yield item
+            pending = chunk or ""
+        if summaries and summaries[-1].error:
+            raise RuntimeError(f"Stream JSON fallito: {summaries[-1].error}")
+        if pending is not None:
+            for item in parser.feed(pending):
+                yield item
+        document = parser.result()
+        if on_complete:
+            on_complete(document)
+
+    def _create_wrapper(self, json_mode: bool) -> Any:
+        """Istanzia il wrapper specifico del provider (senza cache)."""
         if self.provider_type == "ollama":
             return OllamaWrapper(self.current_model_name, json_mode)
         elif self.provider_type == "groq":
@@ -972,33 +2433,116 @@ class AIProvider:
                 port=self.LLAMACPP_PORT,
                 json_mode=json_mode,
             )
+        elif self.provider_type == "replay":
+            return ReplayWrapper(self, json_mode)
         return GeminiWrapper(self, json_mode)
 
+    def warmup(self) -> float:
+        """Precarica il modello locale (Ollama) e restituisce i secondi impiegati.
+
+        Per i provider cloud non c'è nulla da caricare: restituisce 0.
+        """
+        if self.provider_type != "ollama":
+            return 0.0
+        elapsed = warmup(self.current_model_name)
+        self.log_debug(f"🔥 Ollama: {self.current_model_name} pronto in {elapsed:.1f}s.")
+        return elapsed
+
+    def keep_warm(self, enabled: bool = True, interval: Optional[float] = None) -> None:
+        """Avvia (o ferma) l'heartbeat che tiene residente il modello Ollama."""
+        if self.provider_type != "ollama":
+            return
+        if enabled:
+            start_heartbeat(self.current_model_name, interval)
+        else:
+            stop_heartbeat(self.current_model_name)
+
+    def model_status(self) -> dict:
+        """Stato del modello per la UI (per Ollama: residente in memoria, scadenza, VRAM)."""
+        if self.provider_type != "ollama":
+            return {"model": self.current_model_name, "resident": None}
+        return model_status(self.current_model_name)
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Statistiche hit/miss e occupazione della response cache condivisa."""
+        return get_default_cache().stats()
+
+    @staticmethod
+    def rate_limit_stats() -> dict:
+        """Attese e 429 registrati dal rate limiter condiviso, per provider/modello."""
+        return rate_limit_stats()
+
+    @staticmethod
+    def metrics_snapshot() -> dict:
+        """Metriche per provider/modello: richieste, errori per tipo, latenze, TTFT, token, retry."""
+        return get_metrics().snapshot()
+
+    @staticmethod
+    def metrics_prometheus() -> str:
+        """Le stesse metriche nel formato testo di Prometheus."""
+        return get_metrics().to_prometheus()
+
+    def replay_stats(self) -> dict:
+        """Provider "replay": risposte riprodotte, registrate e mancanti nella cassette."""
+        if self.provider_type != "replay":
+            return {}
+        return self.cassette.snapshot()
+
+    @staticmethod
+    def retry_stats() -> dict:
+        """Retry per provider/modello: tentativi ripetuti, rinunce, budget esaurito, attesa totale."""
+        return retry_stats()
+
+    @staticmethod
+    def single_flight_stats() -> dict:
+        """Chiamate eseguite e richieste identiche accodate a una già in volo (coalesced)."""
+        return get_single_flight().stats()
+
+    @staticmethod
+    def image_cache_stats() -> dict:
+        """Immagini ricodificate: hit/miss della cache e byte prima/dopo."""
+        return image_cache_stats()
+
+    @staticmethod
+    def llamacpp_pool_stats() -> dict:
+        """Per backend llama-server: stato, richieste in corso, errori, failover e token/s."""
+        return pool_stats()
+
+    @staticmethod
+    def prefix_cache_stats() -> dict:
+        """Riuso della KV cache di llama-server: slot pinnati, prefissi riusati, token in cache."""
+        return prefix_cache_stats()
+
+    @staticmethod
+    def hedge_stats() -> dict:
+        """Hedge rate, vittorie del secondario e latenza risparmiata per modello primario."""
+        return hedge_stats()
+
+    @staticmethod
+    def clear_cache() -> None:
+        """Svuota la response cache su disco."""
+        get_default_cache().clear()
+
     def _init_gemini_chain(self):
         """Inizializza la catena Gemini con priorità al modello richiesto."""
         # Se l'utente ha chiesto un modello specifico, lo mettiamo in cima
         if self.target_model:
             self.available_models_chain = [self.target_model] + self.FALLBACK_ORDER
-        # Altrimenti usiamo la cache se valida
-        elif AIProvider._cached_chain and (
-            time.time() - AIProvider._last_scrape_time < 3600
-        ):
-            self.available_models_chain = AIProvider._cached_chain
-        # Altrimenti scraping
+        # Altrimenti il catalogo su disco o FALLBACK_ORDER: lo scraping gira in
+        # background e la catena viene aggiornata da select_model quando finisce
         else:
-            scraped_models = self._build_gemini_chain()
-            # Uniamo i fallback (che includono i preview) con quelli trovati dallo scraping, rimuovendo duplicati e preservando l'ordine
-            self.available_models_chain = list(
-                dict.fromkeys(self.FALLBACK_ORDER + scraped_models)
-            )
-
-            if self.available_models_chain:
-                AIProvider._cached_chain = self.available_models_chain
-                AIProvider._last_scrape_time = time.time()
+            self.available_models_chain = self.get_gemini_models()
 
         # Fallback finale se tutto fallisce
         if not self.available_models_chain:
-            self.available_models_chain = self.FALLBACK_ORDER
+            self.available_models_chain = list(self.FALLBACK_ORDER)
+
+        self.current_model_index = 0
+        self.current_model_name = self.available_models_chain[0]
+        self.log_debug(
+            f"🤖 AI Provider Gemini pronto. Modello: {self.current_model_name}"
+        )
 
     @staticmethod
     def render_streamlit_sidebar() -> Tuple[str, Optional[str]]:
@@ -1038,6 +2582,8 @@ class AIProvider:
             ollama_models = AIProvider.get_ollama_models()
             if ollama_models:
                 ai_model_name = st.sidebar.selectbox("Model", ollama_models)
+            elif get_catalog().is_refreshing("ollama"):
+                st.sidebar.info("⏳ Loading Ollama models...")
             else:
                 st.sidebar.warning("No Ollama models found. Is Ollama running?")
                 
@@ -1058,8 +2604,19 @@ class AIProvider:
             _lcpp_script = AIProvider.LLAMACPP_SERVER_SCRIPT
             _lcpp_script_exists = os.path.isfile(_lcpp_script)
             _lcpp_running = AIProvider.is_llamacpp_running()
-
-            if _lcpp_running:
+            _lcpp_status = AIProvider.llamacpp_status()
+
+            if _lcpp_status["state"] in ("starting", "loading"):
+                st.sidebar.markdown("**LlamaCpp Server:** 🟡 Loading model")
+                st.sidebar.progress(
+                    _lcpp_status.get("progress") or 0.0,
+                    text=f"{_lcpp_status['state']} · {_lcpp_status.get('elapsed_sec', 0):.0f}s "
+                    "(le richieste attendono che sia pronto)",
+                )
+            elif _lcpp_status["state"] == "crashed":
+                st.sidebar.markdown("**LlamaCpp Server:** 🔴 Crashed")
+                st.sidebar.caption(_lcpp_status.get("last_error", ""))
+            elif _lcpp_running:
                 st.sidebar.markdown("**LlamaCpp Server:** 🟢 Running")
             else:
                 st.sidebar.markdown("**LlamaCpp Server:** ⚫ Not running")
@@ -1082,17 +2639,17 @@ class AIProvider:
                         pid = AIProvider.start_llamacpp_server(model, thinking)
                         st.session_state["_lcpp_pid"] = pid
                         st.toast(f"LlamaCpp server launched (PID {pid}). Loading model...", icon="🦙")
-                        import time as _time
-                        _time.sleep(2)
                         st.rerun()
                     except Exception as e:
                         st.error(f"Failed to launch llama-server: {e}")
             with _lcpp_col2:
                 if st.button("⏹️ Stop Server", key="lcpp_stop", disabled=not _lcpp_running):
                     try:
-                        AIProvider.stop_llamacpp_server()
-                        st.session_state.pop("_lcpp_pid", None)
-                        st.toast("LlamaCpp server stopped.", icon="⏹️")
+                        if AIProvider.stop_llamacpp_server():
+                            st.session_state.pop("_lcpp_pid", None)
+                            st.toast("LlamaCpp server stopped.", icon="⏹️")
+                        else:
+                            st.toast("llama-server was not started from this app: stop it where it was launched.", icon="⚠️")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Failed to stop llama-server: {e}")
@@ -1100,7 +2657,7 @@ class AIProvider:
             if not _lcpp_script_exists:
                 st.sidebar.caption(f"⚠️ Server script not found: `{_lcpp_script}`")
 
-            if _lcpp_running and AIProvider.detect_llamacpp():
+            if _lcpp_status["state"] in ("ready", "external"):
                 lcpp_models = AIProvider.get_llamacpp_models()
                 if lcpp_models:
                     ai_model_name = st.sidebar.selectbox("Model", lcpp_models)
@@ -1165,28 +2722,70 @@ class AIProvider:
 
         return ai_provider, ai_model_name
 
-        self.current_model_index = 0
-        self.current_model_name = self.available_models_chain[0]
-        self.log_debug(
-            f"🤖 AI Provider Gemini pronto. Modello: {self.current_model_name}"
-        )
+    def select_model(self, claim: bool = True) -> str:
+        """Sceglie il modello Gemini per la prossima richiesta tramite il router condiviso.
 
-    def downgrade_model(self) -> bool:
-        """Passa al modello successivo nella catena di fallback."""
-        if self.current_model_index + 1 < len(self.available_models_chain):
-            self.current_model_index += 1
-            self.current_model_name = self.available_models_chain[
-                self.current_model_index
-            ]
+        Il router salta i modelli in cooldown e ripromuove quelli tornati sani,
+        quindi ogni richiesta parte dal miglior modello disponibile. Il
+        chiamante usa il valore restituito (non current_model_name, che altri
+        thread possono cambiare); claim=False non prenota la prova di un
+        modello half_open (es. per calcolare la chiave della cache).
+        """
+        if self.provider_type != "gemini" or not self.available_models_chain:
+            return self.current_model_name
+        if not self.target_model and not self.pinned_chain:
+            self._upgrade_chain()
+        with self._model_lock:
+            model = get_router().choose("gemini", self.available_models_chain, claim=claim)
+            if model and model != self.current_model_name:
+                self.log_debug(f"🔀 Router: {self.current_model_name or '-'} -> {model}")
+                self._set_current_model(model)
+            return self.current_model_name
+
+    def _upgrade_chain(self) -> None:
+        """Adotta la catena scoperta in background, mantenendo il modello corrente."""
+        chain = self.get_gemini_models()
+        with self._model_lock:
+            if not chain or chain == self.available_models_chain:
+                return
+            self.available_models_chain = chain
+            if self.current_model_name in chain:
+                self.current_model_index = chain.index(self.current_model_name)
+            else:
+                self._set_current_model(chain[0])
+        self.log_debug(f"🔄 Catena Gemini aggiornata: {len(chain)} modelli.")
+
+    def _set_current_model(self, model: str) -> None:
+        """Da chiamare con _model_lock."""
+        self.current_model_index = self.available_models_chain.index(model)
+        self.current_model_name = model
+
+    def downgrade_model(self, failed: Optional[str] = None) -> bool:
+        """Passa al miglior modello sano della catena diverso da `failed` (default: quello corrente)."""
+        with self._model_lock:
+            model = get_router().choose(
+                "gemini",
+                self.available_models_chain,
+                exclude={failed or self.current_model_name},
+                claim=False,
+            )
+            if model is None:
+                return False
+            self._set_current_model(model)
             return True
-        return False
 
-    def _build_gemini_chain(self) -> List[str]:
+    @staticmethod
+    def router_stats() -> dict:
+        """Latenze (p50/p90/p99), tasso d'errore, 429 e stato del circuito per modello."""
+        return get_router().snapshot()
+
+    @staticmethod
+    def _build_gemini_chain() -> List[str]:
         """Costruisce lista modelli via scraping."""
         try:
-            response = requests.get(self.DOCS_URL, timeout=4)
+            response = get_http_session().get(AIProvider.DOCS_URL, timeout=4)
             if response.status_code != 200:
-                response = requests.get(self.DOCS_URL.replace(".md.txt", ""), timeout=4)
+                response = get_http_session().get(AIProvider.DOCS_URL.replace(".md.txt", ""), timeout=4)
                 if response.status_code != 200:
                     return []
 
@@ -1196,6 +2795,8 @@ class AIProvider:
 
             # Fallback for plain text or HTML if no models found
             if not candidates:
+                from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
                 soup = BeautifulSoup(text, "html.parser")
                 text = soup.get_text()
                 candidates = set(re.findall(r"(gemini-[a-zA-Z0-9\-\.]+)", text))
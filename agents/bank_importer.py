@@ -118,7 +118,7 @@ class BankImporter:
             
         return df
 
-    def process_file(self, file_buffer, target_categories, income_cols, progress_callback=None):
+    def process_file(self, file_buffer, target_categories, income_cols, progress_callback=None, concurrency=4):
         """
         Processes the uploaded bank file (CSV or PDF).
         
@@ -127,6 +127,7 @@ class BankImporter:
             target_categories (list): List of valid expense/income categories.
             income_cols (list): List of categories considered as Income.
             progress_callback (func): Optional callback (percent: float, message: str).
+            concurrency (int): Max number of AI batches in flight at the same time.
 
         Returns:
             dict: {
@@ -160,7 +161,6 @@ class BankImporter:
         df = self._standardize_columns(df)
 
         # 2. Prepare for AI Categorization
-        model = self.ai_provider.get_model(json_mode=True)
         mappings = {}
         
         # Keep original category for comparison (if present, else empty)
@@ -179,21 +179,11 @@ class BankImporter:
                 "old_category": old_cat
             })
 
-        # 3. Process in Batches
+        # 3. Process in Batches (independent prompts, run concurrently)
         
         BATCH_SIZE = 20
-        total_batches = (len(items_to_process) + BATCH_SIZE - 1) // BATCH_SIZE
-        
+        prompts = []
         for i in range(0, len(items_to_process), BATCH_SIZE):
-            current_batch_num = i // BATCH_SIZE + 1
-            if progress_callback:
-                # Adjust progress to account for PDF step
-                base_c = 0.2 if file_name.endswith('.pdf') else 0.0
-                percent = base_c + (i / len(items_to_process)) * (0.9 - base_c)
-                progress_callback(percent, f"Analisi AI in corso: Batch {current_batch_num}/{total_batches}...")
-            
-            # ... batch processing logic calls model ... 
-            
             batch = items_to_process[i:i+BATCH_SIZE]
             
             prompt_text = f"""
@@ -223,23 +213,45 @@ class BankImporter:
             Return JSON:
             {{ "mappings": [ {{ "id": <id>, "new_category": "<ValidCategory>" }} ] }}
             """
-            
+            prompts.append(prompt_text)
+
+        total_batches = len(prompts)
+        base_c = 0.2 if file_name.endswith('.pdf') else 0.0
+        completed = [0]
+
+        def on_batch_done(result):
+            completed[0] += 1
+            if progress_callback:
+                # Adjust progress to account for PDF step
+                percent = base_c + (completed[0] / total_batches) * (0.9 - base_c)
+                progress_callback(percent, f"Analisi AI in corso: Batch {completed[0]}/{total_batches}...")
+
+        if progress_callback and total_batches:
+            progress_callback(base_c, f"Analisi AI in corso: {total_batches} batch...")
+
+        results = self.ai_provider.generate_many(
+            prompts, concurrency=concurrency, json_mode=True, on_result=on_batch_done
+        )
+
+        for result in results:
+            i = result.index * BATCH_SIZE
+            if not result.ok:
+                print(f"Error in batch {i}: {result.error}")
+                # Skip batch or partially fail? We'll leave original categories.
+                continue
             try:
-                response = model.generate_content(prompt_text)
-                # Helper for Gemini/Ollama response wrapper differences
-                text_response = response.text if hasattr(response, 'text') else str(response)
+                text_response = result.text
                 
                 # Simple cleanup for potential markdown code blocks
                 if "```json" in text_response:
                     text_response = text_response.replace("```json", "").replace("```", "")
                 
-                result = json.loads(text_response)
+                parsed = json.loads(text_response)
                 
-                for m in result.get("mappings", []):
+                for m in parsed.get("mappings", []):
                     mappings[m['id']] = m['new_category']
             except Exception as e:
                 print(f"Error in batch {i}: {e}")
-                # Skip batch or partially fail? We'll leave original categories.
         
         if progress_callback:
             progress_callback(0.9, "Applicazione modifiche e calcoli finali...")
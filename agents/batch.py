@@ -0,0 +1,105 @@
+"""Esecuzione di prompt indipendenti con concorrenza limitata.
+
+I risultati mantengono l'ordine di input; un errore su un elemento viene
+riportato nel relativo BatchResult senza interrompere gli altri.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+DEFAULT_CONCURRENCY = 4
+
+
+@dataclass
+class BatchResult:
+    """Esito di un singolo prompt in un batch."""
+
+    index: int
+    text: Optional[str] = None
+    response: Any = None
+    error: Optional[Exception] = None
+    latency_sec: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True se la richiesta è andata a buon fine."""
+        return self.error is None
+
+
+def _response_text(response: Any) -> str:
+    return response.text if hasattr(response, "text") else str(response)
+
+
+def run_batch(
+    call: Callable[[Any], Any],
+    prompts: Iterable[Any],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+) -> List[BatchResult]:
+    """Esegue call(prompt) su un pool di thread limitato a `concurrency`.
+
+    on_result viene invocato (dal thread chiamante) man mano che gli
+    elementi terminano, utile per le progress bar.
+    """
+    prompts = list(prompts)
+    if not prompts:
+        return []
+
+    def _one(index: int, prompt: Any) -> BatchResult:
+        start = time.perf_counter()
+        try:
+            response = call(prompt)
+            return BatchResult(
+                index=index,
+                text=_response_text(response),
+                response=response,
+                latency_sec=time.perf_counter() - start,
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return BatchResult(index=index, error=e, latency_sec=time.perf_counter() - start)
+
+    results: List[Optional[BatchResult]] = [None] * len(prompts)
+    workers = max(1, min(concurrency, len(prompts)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-batch") as executor:
+        futures = [executor.submit(_one, i, p) for i, p in enumerate(prompts)]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.index] = result
+            if on_result:
+                on_result(result)
+    return results
+
+
+async def arun_batch(
+    acall: Callable[[Any], Awaitable[Any]],
+    prompts: Iterable[Any],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    on_result: Optional[Callable[[BatchResult], None]] = None,
+) -> List[BatchResult]:
+    """Variante asyncio di run_batch: al massimo `concurrency` richieste in volo."""
+    prompts = list(prompts)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(index: int, prompt: Any) -> BatchResult:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await acall(prompt)
+                result = BatchResult(
+                    index=index,
+                    text=_response_text(response),
+                    response=response,
+                    latency_sec=time.perf_counter() - start,
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                result = BatchResult(
+                    index=index, error=e, latency_sec=time.perf_counter() - start
+                )
+        if on_result:
+            on_result(result)
+        return result
+
+    return list(await asyncio.gather(*(_one(i, p) for i, p in enumerate(prompts))))
@@ -0,0 +1,96 @@
+"""Pool di client SDK condivisi dal processo.
+
+Costruire un genai.Client / openai.OpenAI / groq.Groq ad ogni chiamata costa
+handshake TLS e setup delle connessioni. I client qui sono indicizzati per
+(provider, api_key, base_url) e riutilizzati da tutti i wrapper: il pool
+httpx interno ai client mantiene le connessioni in keep-alive.
+
+I client asincroni sono legati all'event loop che li usa, quindi vengono
+tenuti in un pool separato per loop (rilasciato quando il loop termina).
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+ClientKey = Tuple[str, Optional[str], Optional[str]]
+
+_lock = threading.Lock()
+_sync_clients: Dict[ClientKey, Any] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[ClientKey, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+_http_session = None
+
+
+def get_client(
+    provider: str,
+    api_key: Optional[str],
+    base_url: Optional[str],
+    factory: Callable[[], Any],
+) -> Any:
+    """Restituisce il client sincrono condiviso, creandolo con factory se assente."""
+    key = (provider, api_key, base_url)
+    client = _sync_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            client = factory()
+            _sync_clients[key] = client
+        return client
+
+
+def get_async_client(
+    provider: str,
+    api_key: Optional[str],
+    base_url: Optional[str],
+    factory: Callable[[], Any],
+) -> Any:
+    """Restituisce il client asincrono condiviso per l'event loop corrente."""
+    key = (provider, api_key, base_url)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Fuori da un loop non possiamo sapere dove verrà usato: niente pooling
+        return factory()
+    with _lock:
+        clients = _async_clients.get(loop)
+        if clients is None:
+            clients = {}
+            _async_clients[loop] = clients
+        client = clients.get(key)
+        if client is None:
+            client = factory()
+            clients[key] = client
+        return client
+
+
+def get_http_session():
+    """requests.Session condivisa (keep-alive) per le chiamate REST di servizio."""
+    global _http_session  # pylint: disable=global-statement
+    if _http_session is None:
+        import requests  # pylint: disable=import-outside-toplevel
+
+        with _lock:
+            if _http_session is None:
+                _http_session = requests.Session()
+    return _http_session
+
+
+def clear_pool() -> None:
+    """Dimentica tutti i client (es. dopo una rotazione delle API key)."""
+    with _lock:
+        _sync_clients.clear()
+        _async_clients.clear()
+
+
+def pool_stats() -> Dict[str, int]:
+    """Numero di client attualmente condivisi."""
+    with _lock:
+        return {
+            "sync_clients": len(_sync_clients),
+            "async_clients": sum(len(c) for c in _async_clients.values()),
+        }
@@ -1,5 +1,4 @@
 import os
-import streamlit as st
 from github import Github, GithubException
 
 
@@ -0,0 +1,188 @@
+"""Budget del contesto per i modelli locali (Ollama, llama.cpp).
+
+Prima dell'invio si stima quanti token occupa il prompt (stimatore per
+famiglia di modello), si dimensiona num_ctx sul prompt invece di usare un
+valore fisso e, se il prompt non entra nella finestra del modello, lo si
+accorcia (tagliando la parte centrale, dove stanno i blocchi di knowledge)
+o lo si rifiuta, registrando i token scartati.
+
+AI_CONTEXT_OVERFLOW=trim|refuse sceglie la politica (default trim);
+AI_MAX_NUM_CTX limita num_ctx per contenere la memoria (default 32768).
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+# Caratteri per token (media su testo misto IT/EN/DE) per famiglia di tokenizer
+CHARS_PER_TOKEN = {
+    "llama3": 3.8,
+    "llama": 3.3,
+    "qwen": 3.4,
+    "mistral": 3.3,
+    "mixtral": 3.3,
+    "gemma": 3.9,
+    "phi": 3.3,
+    "deepseek": 3.5,
+}
+DEFAULT_CHARS_PER_TOKEN = 3.3
+
+# Finestra nativa per famiglia, se il backend non la comunica
+FAMILY_CONTEXT = {
+    "llama3.1": 131072,
+    "llama3.2": 131072,
+    "llama3.3": 131072,
+    "llama3": 8192,
+    "qwen2.5": 32768,
+    "qwen3": 40960,
+    "qwen": 32768,
+    "mistral": 32768,
+    "mixtral": 32768,
+    "gemma3": 131072,
+    "gemma2": 8192,
+    "gemma": 8192,
+    "phi4": 16384,
+    "phi3": 131072,
+    "deepseek": 131072,
+}
+DEFAULT_CONTEXT = 8192
+
+# Token lasciati liberi per la risposta e margine sull'errore della stima
+DEFAULT_OUTPUT_RESERVE = 1024
+SAFETY_MARGIN = 1.1
+MIN_NUM_CTX = 2048
+NUM_CTX_STEP = 1024
+# Token di overhead del chat template per messaggio
+MESSAGE_OVERHEAD = 8
+
+TRIM_MARKER = "\n\n[... {tokens} token omessi per rientrare nel contesto del modello ...]\n\n"
+
+
+class ContextOverflowError(ValueError):
+    """Il prompt non entra nella finestra di contesto del modello."""
+
+
+@dataclass
+class ContextBudget:
+    """Esito del budgeting di un prompt."""
+
+    text: str
+    prompt_tokens: int
+    num_ctx: int
+    max_ctx: int
+    dropped_tokens: int = 0
+
+
+def _family_key(model: str, table: Dict[str, object]) -> Optional[str]:
+    name = (model or "").lower()
+    # Le chiavi più specifiche (es. llama3.1) prima di quelle generiche (llama)
+    for key in sorted(table, key=len, reverse=True):
+        if key in name:
+            return key
+    return None
+
+
+def chars_per_token(model: str) -> float:
+    key = _family_key(model, CHARS_PER_TOKEN)
+    return CHARS_PER_TOKEN[key] if key else DEFAULT_CHARS_PER_TOKEN
+
+
+def estimate_prompt_tokens(text: str, model: str = "") -> int:
+    """Stima (per eccesso) dei token di un prompt per la famiglia del modello."""
+    return math.ceil(len(text) / chars_per_token(model) * SAFETY_MARGIN) + MESSAGE_OVERHEAD
+
+
+def family_context(model: str) -> int:
+    """Finestra di contesto nota per la famiglia del modello."""
+    key = _family_key(model, FAMILY_CONTEXT)
+    return FAMILY_CONTEXT[key] if key else DEFAULT_CONTEXT
+
+
+def max_num_ctx() -> int:
+    return int(os.getenv("AI_MAX_NUM_CTX", "32768"))
+
+
+def _overflow_policy() -> str:
+    return os.getenv("AI_CONTEXT_OVERFLOW", "trim").lower()
+
+
+def _trim_middle(text: str, keep_chars: int, dropped_tokens: int) -> str:
+    """Tiene inizio (istruzioni) e fine (dati e formato richiesto) del prompt."""
+    marker = TRIM_MARKER.format(tokens=dropped_tokens)
+    keep_chars = max(0, keep_chars - len(marker))
+    head = keep_chars // 3
+    tail = keep_chars - head
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+
+def fit_prompt(
+    text: str,
+    model: str,
+    max_ctx: int,
+    output_reserve: int = DEFAULT_OUTPUT_RESERVE,
+    label: str = "",
+) -> ContextBudget:
+    """Dimensiona num_ctx sul prompt e, se serve, lo accorcia o lo rifiuta.
+
+    max_ctx è la finestra massima utilizzabile (modello o server). Con la
+    politica "refuse" un prompt troppo lungo solleva ContextOverflowError.
+    """
+    prompt_tokens = estimate_prompt_tokens(text, model)
+    output_reserve = min(output_reserve, max_ctx // 4)
+    needed = prompt_tokens + output_reserve
+
+    if needed <= max_ctx:
+        num_ctx = min(max_ctx, max(MIN_NUM_CTX, math.ceil(needed / NUM_CTX_STEP) * NUM_CTX_STEP))
+        return ContextBudget(text, prompt_tokens, num_ctx, max_ctx)
+
+    available = max_ctx - output_reserve - MESSAGE_OVERHEAD
+    dropped = prompt_tokens - MESSAGE_OVERHEAD - available
+    where = f" {label}" if label else ""
+    if _overflow_policy() == "refuse" or available <= 0:
+        raise ContextOverflowError(
+            f"Prompt di ~{prompt_tokens} token oltre la finestra di {max_ctx} del modello{where} "
+            f"({output_reserve} riservati alla risposta)."
+        )
+
+    keep_chars = int(available * chars_per_token(model) / SAFETY_MARGIN)
+    trimmed = _trim_middle(text, keep_chars, dropped)
+    print(
+        f"✂️ Contesto{where}: prompt di ~{prompt_tokens} token > {max_ctx - output_reserve} disponibili, "
+        f"tagliati ~{dropped} token dal centro."
+    )
+    return ContextBudget(
+        trimmed, estimate_prompt_tokens(trimmed, model), max_ctx, max_ctx, dropped_tokens=dropped
+    )
+
+
+_ctx_cache: Dict[Tuple[str, str], int] = {}
+_lock = threading.Lock()
+
+
+def cached_context(
+    backend: str, key: str, lookup: Callable[[], Optional[int]], fallback: int
+) -> int:
+    """Finestra di contesto per (backend, chiave), chiesta al backend con lookup() al primo uso.
+
+    Se lookup() non riesce (None) si usa fallback senza memorizzarlo, così
+    il valore reale viene letto appena il backend risponde.
+    """
+    cache_key = (backend, key)
+    with _lock:
+        value = _ctx_cache.get(cache_key)
+    if value is not None:
+        return value
+    value = lookup()
+    if value is None:
+        return fallback
+    with _lock:
+        _ctx_cache[cache_key] = value
+    return value
+
+
+def invalidate_context(backend: str, key: str) -> None:
+    """Dimentica la finestra memorizzata (es. server riavviato con un altro modello)."""
+    with _lock:
+        _ctx_cache.pop((backend, key), None)
@@ -0,0 +1,212 @@
+"""Richieste "hedged" per le chiamate sensibili alla latenza di coda.
+
+La richiesta parte sul modello primario; se entro il suo p90 storico non è
+arrivata una risposta (o il primario fallisce prima), lo stesso prompt viene
+inviato anche a un modello/provider secondario. Vince la prima risposta
+valida, l'altra viene cancellata (task asyncio) o ignorata (thread già in
+esecuzione, non interrompibile).
+
+Le latenze storiche arrivano dal router condiviso (model_router); finché
+non ci sono abbastanza campioni si usa DEFAULT_HEDGE_DELAY_SEC.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .model_router import get_router
+
+HEDGE_PERCENTILE = 0.9
+MIN_SAMPLES = 5
+DEFAULT_HEDGE_DELAY_SEC = 3.0
+HEDGE_WORKERS = 32
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="ai-hedge")
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def hedge_delay(provider: str, model: str) -> float:
+    """Secondi di attesa prima di inviare la richiesta di riserva (p90 del primario)."""
+    p90 = get_router().latency_percentile(provider, model, HEDGE_PERCENTILE, MIN_SAMPLES)
+    return p90 if p90 is not None else DEFAULT_HEDGE_DELAY_SEC
+
+
+def is_valid_response(response: Any, json_mode: bool) -> bool:
+    """Una risposta vince solo se ha testo (e, in json_mode, JSON parsabile)."""
+    text = getattr(response, "text", None)
+    if not text or not text.strip() or text.startswith("❌"):
+        return False
+    if not json_mode:
+        return True
+    text = text.strip()
+    # Come i chiamanti, tolleriamo i code fence markdown attorno al JSON
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.startswith("json"):
+            text = text[4:]
+    if text.rstrip().endswith("```"):
+        text = text.rstrip()[:-3]
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _entry(key: str) -> Dict[str, float]:
+    entry = _stats.get(key)
+    if entry is None:
+        entry = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failures": 0,
+            "latency_saved_sec": 0.0,
+            "saved_samples": 0,
+        }
+        _stats[key] = entry
+    return entry
+
+
+def _record(key: str, hedged: bool, hedge_won: bool, failed: bool = False) -> None:
+    with _lock:
+        entry = _entry(key)
+        entry["requests"] += 1
+        entry["hedged"] += int(hedged)
+        entry["hedge_wins"] += int(hedge_won)
+        entry["failures"] += int(failed)
+
+
+def _record_saved(key: str, saved_sec: float) -> None:
+    with _lock:
+        entry = _entry(key)
+        entry["latency_saved_sec"] += max(0.0, saved_sec)
+        entry["saved_samples"] += 1
+
+
+def run_hedged(
+    primary: Callable[[], Any],
+    secondary: Optional[Callable[[], Any]],
+    delay: float,
+    is_valid: Callable[[Any], bool],
+    key: str,
+) -> Any:
+    """Esegue primary() e, dopo `delay` secondi senza risposta valida, anche secondary().
+
+    Restituisce la prima risposta valida; se entrambe falliscono rilancia il
+    primo errore. Se il secondario vince, la latenza risparmiata viene
+    misurata quando il primario (non interrompibile) termina.
+    """
+    start = time.perf_counter()
+    first = _executor.submit(primary)
+    roles = {first: "primary"}
+    pending = {first}
+    hedged = False
+    first_error: Optional[BaseException] = None
+
+    while pending:
+        can_hedge = secondary is not None and not hedged
+        timeout = max(0.0, delay - (time.perf_counter() - start)) if can_hedge else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            response = None if error else future.result()
+            if error is None and is_valid(response):
+                elapsed = time.perf_counter() - start
+                hedge_won = roles[future] == "secondary"
+                for other in pending:
+                    other.cancel()
+                _record(key, hedged, hedge_won)
+                if hedge_won and not first.done():
+                    first.add_done_callback(
+                        lambda _f: _record_saved(key, time.perf_counter() - start - elapsed)
+                    )
+                return response
+            if first_error is None:
+                first_error = error or ValueError(f"Risposta non valida da {roles[future]}")
+        if can_hedge:
+            # Timeout del p90 oppure primario fallito/non valido: parte la riserva
+            hedged = True
+            reason = "nessuna risposta" if not done else "primario fallito"
+            print(f"🏁 Hedge {key}: {reason} dopo {time.perf_counter() - start:.1f}s, invio al secondario.")
+            backup = _executor.submit(secondary)
+            roles[backup] = "secondary"
+            pending.add(backup)
+
+    _record(key, hedged, False, failed=True)
+    raise first_error
+
+
+async def arun_hedged(
+    primary: Callable[[], Awaitable[Any]],
+    secondary: Optional[Callable[[], Awaitable[Any]]],
+    delay: float,
+    is_valid: Callable[[Any], bool],
+    key: str,
+    primary_estimate: Optional[float] = None,
+) -> Any:
+    """Variante asyncio di run_hedged: la richiesta perdente viene cancellata.
+
+    Il primario cancellato non riporta la propria latenza: quella risparmiata
+    è stimata come primary_estimate (es. p99 storico) meno il tempo del vincitore.
+    """
+    start = time.perf_counter()
+    first = asyncio.ensure_future(primary())
+    roles = {first: "primary"}
+    pending = {first}
+    hedged = False
+    first_error: Optional[BaseException] = None
+
+    try:
+        while pending:
+            can_hedge = secondary is not None and not hedged
+            timeout = max(0.0, delay - (time.perf_counter() - start)) if can_hedge else None
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                error = task.exception()
+                response = None if error else task.result()
+                if error is None and is_valid(response):
+                    elapsed = time.perf_counter() - start
+                    hedge_won = roles[task] == "secondary"
+                    _record(key, hedged, hedge_won)
+                    if hedge_won and pending and primary_estimate is not None:
+                        _record_saved(key, primary_estimate - elapsed)
+                    return response
+                if first_error is None:
+                    first_error = error or ValueError(f"Risposta non valida da {roles[task]}")
+            if can_hedge:
+                hedged = True
+                reason = "nessuna risposta" if not done else "primario fallito"
+                print(f"🏁 Hedge {key}: {reason} dopo {time.perf_counter() - start:.1f}s, invio al secondario.")
+                backup = asyncio.ensure_future(secondary())
+                roles[backup] = "secondary"
+                pending.add(backup)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    _record(key, hedged, False, failed=True)
+    raise first_error
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    """Per modello primario: richieste, hedge rate, vittorie del secondario, latenza risparmiata."""
+    with _lock:
+        items = [(key, dict(entry)) for key, entry in _stats.items()]
+    result = {}
+    for key, entry in items:
+        requests = entry["requests"] or 1
+        samples = entry.pop("saved_samples")
+        entry["hedge_rate"] = round(entry["hedged"] / requests, 3)
+        entry["avg_latency_saved_sec"] = (
+            round(entry["latency_saved_sec"] / samples, 3) if samples else 0.0
+        )
+        entry["latency_saved_sec"] = round(entry["latency_saved_sec"], 3)
+        result[key] = entry
+    return result
@@ -0,0 +1,213 @@
+"""Ridimensionamento e ricodifica delle immagini prima dell'invio ai modelli.
+
+Screenshot e foto da telefono arrivano a piena risoluzione (diversi MB):
+caricarle così com'è allunga l'upload e fa pagare più token di visione
+senza migliorare la lettura. prepare_image limita il lato lungo per
+provider/modello (MAX_SIDE, MODEL_MAX_SIDE, override AI_IMAGE_MAX_SIDE),
+applica l'orientamento EXIF, ricodifica in un formato compatto accettato
+dal backend e rimuove i metadati (EXIF, GPS, profili). Se l'immagine non va
+ridimensionata né ruotata e la ricodifica non la rende più piccola, viene
+inviato l'originale.
+
+Il risultato è tenuto in una cache LRU in memoria indicizzata da SHA-256
+dei byte e limiti applicati (AI_IMAGE_CACHE_MB, default 64). Senza Pillow
+le immagini passano invariate.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from .lazy import LazyModule, is_available
+
+PIL_AVAILABLE = is_available("PIL")
+Image = LazyModule("PIL.Image")
+ImageOps = LazyModule("PIL.ImageOps")
+
+# Lato lungo massimo (px) per provider: oltre questa soglia il backend
+# ridimensiona comunque (o divide in tile a pagamento)
+MAX_SIDE = {
+    "gemini": 1536,
+    "ollama": 1024,
+    "llamacpp": 1024,
+    "groq": 1280,
+    "puter": 1568,
+    "openrouter": 1568,
+}
+DEFAULT_MAX_SIDE = 1024
+
+# Limiti per famiglia di modello (vince la chiave più lunga contenuta nel nome)
+MODEL_MAX_SIDE = {
+    "llava": 672,
+    "moondream": 768,
+    "minicpm-v": 1344,
+    "qwen2.5vl": 1280,
+    "qwen2.5-vl": 1280,
+    "claude": 1568,
+}
+
+# Formato di uscita: WEBP dove il backend lo accetta, altrimenti JPEG
+# (llama-server decodifica con stb_image, Ollama e Groq accettano PNG/JPEG)
+OUTPUT_FORMAT = {"gemini": "WEBP", "openrouter": "WEBP", "puter": "WEBP"}
+DEFAULT_FORMAT = "JPEG"
+QUALITY = 85
+
+# Nomi di modello con input immagine (Groq, OpenRouter, Puter)
+VISION_HINTS = (
+    "vision",
+    "-vl",
+    "llava",
+    "llama-4",
+    "pixtral",
+    "gemma-3",
+    "gemini",
+    "claude",
+    "gpt-4o",
+    "gpt-4.1",
+    "gpt-5",
+)
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# Formati originali accettati da tutti i backend, oltre a quello di uscita
+_PASSTHROUGH_MIMES = ("image/jpeg", "image/png")
+_EXIF_ORIENTATION = 0x0112
+
+_cache: "OrderedDict[str, PreparedImage]" = OrderedDict()
+_cache_bytes = 0
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes_in": 0, "bytes_out": 0, "errors": 0}
+_lock = threading.Lock()
+
+
+@dataclass
+class PreparedImage:
+    """Immagine pronta per l'invio."""
+
+    data: bytes
+    mime_type: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    def data_url(self) -> str:
+        """data: URL base64 per le API OpenAI-compatibili (image_url)."""
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def sniff_mime(data: bytes, default: str = "image/jpeg") -> str:
+    """MIME dai magic bytes (PNG, JPEG, WEBP, GIF)."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return default
+
+
+def supports_vision(model: str) -> bool:
+    """True se il nome del modello indica input immagine."""
+    name = (model or "").lower()
+    return any(hint in name for hint in VISION_HINTS)
+
+
+def image_limits(provider: str, model: str = "") -> Tuple[int, str]:
+    """(lato lungo massimo, formato di uscita) per provider e modello."""
+    env = os.getenv("AI_IMAGE_MAX_SIDE")
+    if env:
+        max_side = int(env)
+    else:
+        max_side = MAX_SIDE.get(provider, DEFAULT_MAX_SIDE)
+        name = (model or "").lower()
+        for key in sorted(MODEL_MAX_SIDE, key=len, reverse=True):
+            if key in name:
+                max_side = min(max_side, MODEL_MAX_SIDE[key])
+                break
+    return max_side, OUTPUT_FORMAT.get(provider, DEFAULT_FORMAT)
+
+
+def _max_cache_bytes() -> int:
+    return int(float(os.getenv("AI_IMAGE_CACHE_MB", "64")) * 1024 * 1024)
+
+
+def _encode(data: bytes, max_side: int, fmt: str) -> Tuple[PreparedImage, bool]:
+    """(immagine ricodificata, True se è stata ridimensionata o ruotata)."""
+    with Image.open(io.BytesIO(data)) as img:
+        reshaped = img.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            reshaped = True
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        if fmt == "JPEG" and has_alpha:
+            # JPEG non ha canale alfa: trasparenza su fondo bianco
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if has_alpha else "RGB")
+        out = io.BytesIO()
+        # Nessun exif/icc_profile passato al salvataggio: i metadati vengono scartati
+        img.save(out, format=fmt, quality=QUALITY, optimize=True)
+        return PreparedImage(out.getvalue(), _MIME[fmt], img.width, img.height), reshaped
+
+
+def prepare_image(data: bytes, provider: str, model: str = "") -> PreparedImage:
+    """Immagine ridimensionata e ricodificata per provider/modello (con cache).
+
+    Se Pillow manca o l'immagine non è decodificabile restituisce i byte originali.
+    """
+    global _cache_bytes  # pylint: disable=global-statement
+    if not PIL_AVAILABLE:
+        return PreparedImage(data, sniff_mime(data))
+
+    max_side, fmt = image_limits(provider, model)
+    key = f"{hashlib.sha256(data).hexdigest()}:{max_side}:{fmt}"
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return cached
+        _stats["misses"] += 1
+
+    try:
+        prepared, reshaped = _encode(data, max_side, fmt)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        with _lock:
+            _stats["errors"] += 1
+        print(f"      ⚠️ Immagine non ricodificata ({e}), invio l'originale.")
+        return PreparedImage(data, sniff_mime(data))
+
+    mime = sniff_mime(data, default="")
+    if not reshaped and len(prepared.data) >= len(data) and mime in (prepared.mime_type, *_PASSTHROUGH_MIMES):
+        # Già compatta (es. PNG piccolo o JPEG ottimizzato): la ricodifica non conviene
+        prepared = PreparedImage(data, mime, prepared.width, prepared.height)
+    else:
+        print(
+            f"      -> Immagine {prepared.width}x{prepared.height} {fmt}: "
+            f"{len(data) / 1024:.0f} KB -> {len(prepared.data) / 1024:.0f} KB"
+        )
+    with _lock:
+        _stats["bytes_in"] += len(data)
+        _stats["bytes_out"] += len(prepared.data)
+        if key not in _cache:
+            _cache[key] = prepared
+            _cache_bytes += len(prepared.data)
+        limit = _max_cache_bytes()
+        while _cache_bytes > limit and _cache:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted.data)
+            _stats["evictions"] += 1
+    return prepared
+
+
+def image_cache_stats() -> dict:
+    """Hit/miss della cache e byte prima/dopo la ricodifica."""
+    with _lock:
+        return {**_stats, "entries": len(_cache), "cached_bytes": _cache_bytes}
@@ -0,0 +1,155 @@
+"""Parsing JSON incrementale per gli stream in json_mode.
+
+I consumer JSON (BankImporter, TraderAgent) aspettano la risposta completa
+prima di json.loads. JsonStreamParser riceve i chunk man mano che arrivano
+e restituisce ogni elemento dell'array indicato da `path` appena la sua
+parentesi si chiude (es. path=("mappings",) -> ogni mapping, path=("strategies",)
+-> ogni strategia), così il lavoro a valle parte mentre il modello genera.
+
+Con path=() vengono restituiti gli elementi dell'array radice, oppure
+l'oggetto radice intero quando si chiude. Il testo prima della prima
+parentesi (es. ```json) e dopo la chiusura della radice viene ignorato.
+"""
+
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+_LITERAL_START = set("-0123456789tfn")
+_LITERAL_END = set(",]}") | set(" \t\r\n")
+
+
+class _Frame:
+    """Un oggetto o array aperto: percorso, chiave/indice corrente, inizio del valore."""
+
+    __slots__ = ("kind", "path", "key", "index", "expect_key", "value_start")
+
+    def __init__(self, kind: str, path: Tuple):
+        self.kind = kind
+        self.path = path
+        self.key: Any = None
+        self.index = 0
+        self.expect_key = kind == "{"
+        self.value_start: Optional[int] = None
+
+    def child_path(self) -> Tuple:
+        return self.path + ((self.key,) if self.kind == "{" else (self.index,))
+
+
+class JsonStreamParser:
+    """Parser incrementale: feed(chunk) restituisce i valori completati sotto `path`."""
+
+    def __init__(self, path: Sequence = ()):
+        self.path = tuple(path)
+        self.buffer = ""
+        self.items = 0
+        self.done = False
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._root_start: Optional[int] = None
+        self._string_start: Optional[int] = None
+        self._escape = False
+        self._literal = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Aggiunge testo e restituisce gli elementi chiusi in questo chunk."""
+        if self.done or not chunk:
+            return []
+        self.buffer += chunk
+        out: List[Any] = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf) and not self.done:
+            c = buf[i]
+            if self._string_start is not None:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._end_string(i, out)
+            elif self._literal:
+                if c in _LITERAL_END:
+                    self._literal = False
+                    self._value_end(i, out)
+                    continue  # il delimitatore va rielaborato
+            elif self._root_start is None:
+                if c in "{[":
+                    self._root_start = i
+                    self._stack.append(_Frame(c, ()))
+            else:
+                self._structural(c, i, out)
+            i += 1
+        self._pos = i
+        return out
+
+    def _structural(self, c: str, i: int, out: List[Any]) -> None:
+        frame = self._stack[-1]
+        if c in "{[":
+            frame.value_start = i
+            self._stack.append(_Frame(c, frame.child_path()))
+        elif c in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self.done = True
+                if self.path == () and c == "}":
+                    self._emit(self.buffer[self._root_start : i + 1], out)
+            else:
+                self._value_end(i + 1, out)
+        elif c == '"':
+            self._string_start = i
+            if not frame.expect_key:
+                frame.value_start = i
+        elif c == ":":
+            frame.expect_key = False
+        elif c == ",":
+            if frame.kind == "{":
+                frame.expect_key = True
+            else:
+                frame.index += 1
+        elif c in _LITERAL_START:
+            frame.value_start = i
+            self._literal = True
+
+    def _end_string(self, i: int, out: List[Any]) -> None:
+        start, self._string_start = self._string_start, None
+        frame = self._stack[-1]
+        if frame.kind == "{" and frame.expect_key:
+            frame.key = json.loads(self.buffer[start : i + 1])
+        else:
+            self._value_end(i + 1, out)
+
+    def _value_end(self, end: int, out: List[Any]) -> None:
+        """Un valore dentro il frame corrente è terminato in buffer[value_start:end]."""
+        frame = self._stack[-1]
+        if frame.kind == "[" and frame.path == self.path and frame.value_start is not None:
+            self._emit(self.buffer[frame.value_start : end], out)
+        frame.value_start = None
+
+    def _emit(self, text: str, out: List[Any]) -> None:
+        try:
+            out.append(json.loads(text))
+            self.items += 1
+        except ValueError as e:
+            print(f"⚠️ JSON stream: elemento non valido ignorato ({e}): {text[:80]}")
+
+    def result(self) -> Any:
+        """Documento completo (json.loads della radice); ValueError se non è chiuso."""
+        if not self.done:
+            raise ValueError(f"JSON incompleto ({len(self.buffer)} caratteri ricevuti)")
+        end = self._pos
+        return json.loads(self.buffer[self._root_start : end])
+
+
+def iter_json_items(chunks: Iterable[str], path: Sequence = ()) -> Iterator[Any]:
+    """Elementi dell'array a `path` man mano che i chunk li completano."""
+    parser = JsonStreamParser(path)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+async def aiter_json_items(chunks: AsyncIterable[str], path: Sequence = ()) -> AsyncIterator[Any]:
+    """Versione asincrona di iter_json_items."""
+    parser = JsonStreamParser(path)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
@@ -0,0 +1,44 @@
+"""Import differito degli SDK pesanti (google-genai, openai, groq, ollama, PyMuPDF).
+
+LazyModule si comporta come il modulo ma lo importa solo al primo accesso a
+un attributo, così `import agents` e gli script che usano un solo provider
+non pagano il caricamento di tutti gli SDK. is_available controlla che il
+pacchetto sia installato senza importarlo.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+def is_available(name: str) -> bool:
+    """True se il modulo è installato (non lo importa)."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Proxy che importa il modulo `name` al primo accesso a un attributo."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "caricato" if self._module is not None else "non caricato"
+        return f"<LazyModule {self._name} ({state})>"
@@ -0,0 +1,176 @@
+"""Pool di istanze llama-server con bilanciamento e failover.
+
+Su host con molti core conviene lanciare più llama-server (es. uno per nodo
+NUMA) e distribuire le richieste. I backend si configurano con
+AI_LLAMACPP_BACKENDS="host:port,host:port,...". Ogni richiesta va al backend
+sano con meno richieste in corso; se la connessione fallisce (o il server
+risponde 502/503/504) il backend viene escluso e la richiesta riprova sul
+successivo. Un thread in background interroga /health e riammette i backend
+tornati disponibili.
+
+Per backend vengono contate richieste, errori, token generati, latenza
+media e throughput (pool_stats / AIProvider.llamacpp_pool_stats). Il
+throughput divide i token per il tempo reale in cui il backend ha avuto
+almeno una richiesta in corso, non per la somma delle durate (che con
+richieste concorrenti si sovrappongono).
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .client_pool import get_http_session
+
+HEALTH_INTERVAL_SEC = 5.0
+
+
+def parse_backends(value: Optional[str]) -> List[str]:
+    """"host:port,host:port" -> ["host:port", ...] (vuoto se non configurato)."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+class Backend:
+    """Un llama-server del pool e i suoi contatori."""
+
+    def __init__(self, server: str):
+        self.server = server
+        self.base_url = f"http://{server}/v1"
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0
+        self.output_tokens = 0
+        # Tempo reale con almeno una richiesta in corso (intervalli uniti)
+        self.busy_sec = 0.0
+        self.busy_since = 0.0
+        # Somma delle durate delle singole richieste
+        self.request_sec = 0.0
+        self.last_error = ""
+
+    def snapshot(self) -> dict:
+        busy = self.busy_sec + (time.time() - self.busy_since if self.outstanding else 0.0)
+        completed = self.requests - self.outstanding
+        return {
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "failovers": self.failovers,
+            "output_tokens": self.output_tokens,
+            "busy_sec": round(busy, 3),
+            "tokens_per_sec": round(self.output_tokens / busy, 1) if busy else 0.0,
+            "avg_request_sec": round(self.request_sec / completed, 3) if completed else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+class LlamaCppPool:
+    """Backend llama-server intercambiabili (stesso modello) per host:port."""
+
+    def __init__(self, servers: Iterable[str], interval: Optional[float] = None):
+        self.backends = [Backend(server) for server in servers]
+        self.interval = interval or float(os.getenv("AI_LLAMACPP_HEALTH_SEC", str(HEALTH_INTERVAL_SEC)))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Primo controllo nel thread: chi crea il pool (il costruttore del wrapper) non aspetta /health
+        threading.Thread(target=self._run, name="llamacpp-pool-health", daemon=True).start()
+
+    @staticmethod
+    def _is_healthy(server: str) -> Tuple[bool, str]:
+        try:
+            r = get_http_session().get(f"http://{server}/health", timeout=2)
+            return r.status_code == 200, "" if r.status_code == 200 else f"/health {r.status_code}"
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return False, str(e)
+
+    def check_health(self) -> None:
+        """Aggiorna lo stato di tutti i backend (GET /health)."""
+        for backend in self.backends:
+            healthy, error = self._is_healthy(backend.server)
+            with self._lock:
+                if healthy and not backend.healthy:
+                    print(f"✅ LlamaCpp pool: {backend.server} di nuovo disponibile.")
+                backend.healthy = healthy
+                if error:
+                    backend.last_error = error
+
+    def _run(self) -> None:
+        while True:
+            self.check_health()
+            if self._stop.wait(self.interval):
+                break
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def acquire(self, exclude: Iterable[str] = ()) -> Backend:
+        """Sceglie il backend con meno richieste in corso e lo occupa.
+
+        Se nessun backend risulta sano si prova comunque tra quelli non
+        ancora tentati (lo stato di /health può essere vecchio di qualche secondo).
+        """
+        exclude = set(exclude)
+        with self._lock:
+            candidates = [b for b in self.backends if b.server not in exclude]
+            if not candidates:
+                raise RuntimeError(f"nessun llama-server disponibile ({len(self.backends)} backend provati)")
+            healthy = [b for b in candidates if b.healthy] or candidates
+            backend = min(healthy, key=lambda b: (b.outstanding, b.requests))
+            if not backend.outstanding:
+                backend.busy_since = time.time()
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(
+        self,
+        backend: Backend,
+        duration: float,
+        output_tokens: Optional[int] = None,
+        error: Optional[Exception] = None,
+        failover: bool = False,
+    ) -> None:
+        """Libera il backend; failover=True lo esclude finché /health non torna 200."""
+        with self._lock:
+            backend.outstanding -= 1
+            if not backend.outstanding:
+                backend.busy_sec += time.time() - backend.busy_since
+            backend.request_sec += duration
+            backend.output_tokens += output_tokens or 0
+            if error is not None:
+                backend.errors += 1
+                backend.last_error = str(error)[:200]
+            if failover:
+                backend.failovers += 1
+                backend.healthy = False
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {b.server: b.snapshot() for b in self.backends}
+
+
+_pools: Dict[Tuple[str, ...], LlamaCppPool] = {}
+_lock = threading.Lock()
+
+
+def get_pool(servers: Iterable[str]) -> LlamaCppPool:
+    """Pool condiviso dal processo per la lista di backend."""
+    key = tuple(servers)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = LlamaCppPool(key)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats() -> Dict[str, dict]:
+    """Contatori per backend di tutti i pool attivi."""
+    with _lock:
+        pools = list(_pools.values())
+    stats = {}
+    for pool in pools:
+        stats.update(pool.snapshot())
+    return stats
@@ -0,0 +1,290 @@
+"""Ciclo di vita di un llama-server avviato da Python.
+
+LlamaCppServer tiene traccia del processo lanciato, interroga /health con
+backoff finché il modello non è caricato (503 "Loading model" -> 200),
+espone stato e avanzamento stimato del caricamento, riavvia il server se
+il processo muore e lo ferma in modo pulito (SIGTERM al gruppo, poi
+SIGKILL). Le richieste di LlamaCppWrapper verso un server in avvio
+aspettano che sia pronto (wait_ready) invece di fallire.
+
+L'avanzamento è stimato dal tempo dell'ultimo caricamento dello stesso
+modello: llama-server non espone una percentuale.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .client_pool import get_http_session
+
+STOPPED = "stopped"
+STARTING = "starting"
+LOADING = "loading"
+READY = "ready"
+CRASHED = "crashed"
+STOPPING = "stopping"
+
+POLL_MIN_SEC = 0.25
+POLL_MAX_SEC = 2.0
+MONITOR_INTERVAL_SEC = 5.0
+MAX_RESTARTS = 3
+RESTART_WINDOW_SEC = 600
+READY_TIMEOUT_SEC = 300.0
+# Lo script può lanciare llama-server in background e uscire con 0: prima di dichiarare
+# un crash si attende che /health risponda per questo tempo dall'avvio
+STARTUP_GRACE_SEC = 60.0
+# Dopo il primo READY, controlli /health falliti consecutivi (con script già uscito) = crash
+MAX_HEALTH_MISSES = 3
+
+# Callback(server "host:port") a ogni avvio o riavvio del processo
+_spawn_listeners: List[Callable[[str], None]] = []
+
+
+class LlamaCppServer:
+    """Un llama-server su host:port, avviato con un comando esterno (es. lo script fish)."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.state = STOPPED
+        self.proc: Optional[subprocess.Popen] = None
+        self.model = ""
+        self.command: List[str] = []
+        self.env: Optional[Dict[str, str]] = None
+        self.started_at = 0.0
+        self.ready_at = 0.0
+        self.last_error = ""
+        self.restarts: List[float] = []
+        self._misses = 0
+        self._load_times: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # Impostato quando il server non è più in avvio (pronto, crash o fermo): sveglia wait_ready
+        self._settled = threading.Event()
+        self._settled.set()
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    @property
+    def server(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def _health(self) -> tuple:
+        """(stato HTTP o None se irraggiungibile, messaggio) di GET /health."""
+        try:
+            r = get_http_session().get(f"http://{self.server}/health", timeout=2)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return None, str(e)
+        try:
+            body = r.json()
+            message = body.get("status") or (body.get("error") or {}).get("message", "")
+        except ValueError:
+            message = r.text[:200]
+        return r.status_code, message
+
+    def _spawn(self) -> None:
+        self.proc = subprocess.Popen(
+            self.command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            env=self.env,
+        )
+        self.started_at = time.time()
+        self.ready_at = 0.0
+        self.state = STARTING
+        self._misses = 0
+        self._ready.clear()
+        self._settled.clear()
+        # Il nuovo processo può avere un altro modello, n_ctx o numero di slot
+        for listener in list(_spawn_listeners):
+            try:
+                listener(self.server)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"⚠️ LlamaCpp: listener di avvio fallito: {e}")
+
+    def start(self, command: List[str], env: Optional[Dict[str, str]] = None, model: str = "") -> int:
+        """Lancia il server (se non già attivo) e ne segue il caricamento in background."""
+        with self._lock:
+            if self.state in (STARTING, LOADING, READY) and self._process_alive():
+                return self.proc.pid
+            self.command = list(command)
+            self.env = env
+            self.model = model
+            self.restarts = []
+            self.last_error = ""
+            self._stop.clear()
+            self._spawn()
+            if self._monitor is None or not self._monitor.is_alive():
+                self._monitor = threading.Thread(
+                    target=self._run, name=f"llamacpp-server-{self.server}", daemon=True
+                )
+                self._monitor.start()
+            return self.proc.pid
+
+    def _process_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _crash_confirmed_locked(self) -> bool:
+        """True se il server è davvero morto, non solo avviato in background da uno script già uscito."""
+        self._misses += 1
+        if self.ready_at:
+            # Era pronto: un solo /health mancato (timeout sotto carico) non basta
+            return self._misses >= MAX_HEALTH_MISSES
+        returncode = self.proc.returncode if self.proc else None
+        if returncode != 0:
+            return True
+        grace = float(os.getenv("AI_LLAMACPP_STARTUP_GRACE", str(STARTUP_GRACE_SEC)))
+        return time.time() - self.started_at >= grace
+
+    def _run(self) -> None:
+        delay = POLL_MIN_SEC
+        while not self._stop.is_set():
+            code, message = self._health()
+            with self._lock:
+                if self._stop.is_set():
+                    break
+                if code == 200:
+                    if self.state != READY:
+                        self.state = READY
+                        self.ready_at = time.time()
+                        self._load_times[self.model] = self.ready_at - self.started_at
+                        self._ready.set()
+                        self._settled.set()
+                        print(
+                            f"✅ LlamaCpp: server {self.server} pronto in "
+                            f"{self.ready_at - self.started_at:.1f}s."
+                        )
+                    self._misses = 0
+                    delay = MONITOR_INTERVAL_SEC
+                elif code is not None or self._process_alive():
+                    # 503 durante il caricamento del modello, None finché la porta non è aperta
+                    # (lo script può anche lanciare llama-server in background e terminare)
+                    self.state = LOADING if code == 503 else STARTING
+                    self._ready.clear()
+                    self._settled.clear()
+                    self.last_error = "" if code == 503 else message
+                    self._misses = 0
+                    delay = min(POLL_MAX_SEC, delay * 2)
+                elif not self._crash_confirmed_locked():
+                    # Processo terminato e server irraggiungibile, ma ancora in avvio o miss isolato
+                    self.last_error = message
+                    delay = POLL_MAX_SEC
+                else:
+                    # Processo terminato e server irraggiungibile: crash
+                    self.last_error = f"processo terminato (exit {self.proc.returncode if self.proc else '?'})"
+                    self._ready.clear()
+                    delay = self._restart_locked()
+                    if delay is None:
+                        break
+            self._stop.wait(delay)
+
+    def _restart_locked(self) -> Optional[float]:
+        now = time.time()
+        self.restarts = [t for t in self.restarts if now - t < RESTART_WINDOW_SEC]
+        if not self.command or len(self.restarts) >= MAX_RESTARTS:
+            self.state = CRASHED
+            self._settled.set()
+            print(f"❌ LlamaCpp: server {self.server} terminato ({self.last_error}), nessun riavvio.")
+            return None
+        self.restarts.append(now)
+        print(
+            f"⚠️ LlamaCpp: server {self.server} terminato ({self.last_error}), "
+            f"riavvio {len(self.restarts)}/{MAX_RESTARTS}..."
+        )
+        self._spawn()
+        return POLL_MIN_SEC
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Attende che il server sia pronto; True se lo è entro timeout, False subito se va in crash o si ferma."""
+        if timeout is None:
+            timeout = float(os.getenv("AI_LLAMACPP_READY_TIMEOUT", str(READY_TIMEOUT_SEC)))
+        self._settled.wait(timeout)
+        return self._ready.is_set()
+
+    def is_starting(self) -> bool:
+        return self.state in (STARTING, LOADING)
+
+    def is_running(self) -> bool:
+        return self.state in (STARTING, LOADING, READY)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Ferma il server: SIGTERM al gruppo di processi, SIGKILL dopo timeout."""
+        with self._lock:
+            self._stop.set()
+            self._ready.clear()
+            self._settled.set()
+            self.state = STOPPING
+            proc = self.proc
+        if proc is not None:
+            # Anche se lo script è già uscito, il gruppo può contenere llama-server
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                try:
+                    proc.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    print(f"⚠️ LlamaCpp: il processo {proc.pid} di {self.server} non termina dopo SIGKILL.")
+        with self._lock:
+            self.state = STOPPED
+            self.proc = None
+
+    def status(self) -> dict:
+        """Stato per la UI: state, pid, modello, secondi di caricamento, avanzamento stimato."""
+        with self._lock:
+            elapsed = (self.ready_at or time.time()) - self.started_at if self.started_at else 0.0
+            expected = self._load_times.get(self.model)
+            if self.state == READY:
+                progress = 1.0
+            elif self.state in (STARTING, LOADING) and expected:
+                progress = min(0.99, elapsed / expected)
+            else:
+                progress = None
+            return {
+                "server": self.server,
+                "state": self.state,
+                "pid": self.proc.pid if self.proc else None,
+                "model": self.model,
+                "elapsed_sec": round(elapsed, 1),
+                "progress": progress,
+                "restarts": len(self.restarts),
+                "last_error": self.last_error,
+            }
+
+
+_servers: Dict[str, LlamaCppServer] = {}
+_lock = threading.Lock()
+
+
+def add_spawn_listener(listener: Callable[[str], None]) -> None:
+    """Registra una callback chiamata con "host:port" a ogni avvio o riavvio di un server."""
+    if listener not in _spawn_listeners:
+        _spawn_listeners.append(listener)
+
+
+def get_server(host: str, port: int) -> LlamaCppServer:
+    """Manager condiviso per host:port."""
+    key = f"{host}:{port}"
+    with _lock:
+        server = _servers.get(key)
+        if server is None:
+            server = LlamaCppServer(host, port)
+            _servers[key] = server
+        return server
+
+
+def managed_server(server: str) -> Optional[LlamaCppServer]:
+    """Il manager di "host:port" se il server è stato avviato da questo processo."""
+    with _lock:
+        return _servers.get(server)
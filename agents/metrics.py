@@ -0,0 +1,221 @@
+"""Registro delle metriche delle chiamate AI, condiviso dal processo.
+
+Per ogni (provider, modello): richieste, errori per tipo, istogrammi di
+latenza e time-to-first-token (stream), token in/out e retry. L'unità è il
+tentativo, per tutti i wrapper: una chiamata ritentata due volte conta tre
+richieste, ognuna con la propria latenza. Esportabile
+come snapshot JSON (snapshot / to_json) o in formato testo Prometheus
+(to_prometheus), es. da esporre su un endpoint /metrics.
+"""
+
+import json
+import math
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .rate_limiter import is_rate_limit_error
+
+# Limiti superiori (secondi) dei bucket degli istogrammi, l'ultimo è +Inf
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+def error_type(error: BaseException) -> str:
+    """Etichetta compatta per l'errore: rate_limit, timeout, http_<codice> o nome classe."""
+    if is_rate_limit_error(error):
+        return "rate_limit"
+    name = type(error).__name__
+    if "Timeout" in name:
+        return "timeout"
+    for attr in ("status_code", "code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int) and 400 <= code < 600:
+            return f"http_{code}"
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    return name
+
+
+class Histogram:
+    """Istogramma cumulativo in stile Prometheus."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for upper, count in zip(self.buckets, self.counts):
+            total += count
+            yield upper, total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {
+                ("+Inf" if math.isinf(upper) else str(upper)): total
+                for upper, total in self.cumulative()
+            },
+        }
+
+
+class ModelMetrics:
+    """Contatori di una singola coppia provider/modello."""
+
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors: Dict[str, int] = {}
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.ttft = Histogram(TTFT_BUCKETS)
+
+
+class MetricsRegistry:
+    """Raccoglie le metriche di tutti i wrapper; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[str, str], ModelMetrics] = {}
+
+    def _get(self, provider: str, model: str) -> ModelMetrics:
+        key = (provider, model or "")
+        metrics = self._models.get(key)
+        if metrics is None:
+            metrics = ModelMetrics()
+            self._models[key] = metrics
+        return metrics
+
+    def observe_request(
+        self,
+        provider: str,
+        model: str,
+        latency_sec: float,
+        error: Optional[BaseException] = None,
+        input_tokens: Optional[int] = None,
+        output_tokens: Optional[int] = None,
+        ttft_sec: Optional[float] = None,
+        stream: bool = False,
+    ) -> None:
+        """Registra l'esito di una singola chiamata al modello (un tentativo)."""
+        with self._lock:
+            metrics = self._get(provider, model)
+            metrics.requests += 1
+            metrics.streams += int(stream)
+            metrics.latency.observe(latency_sec)
+            if ttft_sec is not None:
+                metrics.ttft.observe(ttft_sec)
+            if error is not None:
+                kind = error_type(error)
+                metrics.errors[kind] = metrics.errors.get(kind, 0) + 1
+            metrics.input_tokens += input_tokens or 0
+            metrics.output_tokens += output_tokens or 0
+
+    def record_retry(self, provider: str, model: str) -> None:
+        """Conta un nuovo tentativo dopo un errore."""
+        with self._lock:
+            self._get(provider, model).retries += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Tutte le metriche come dict serializzabile, chiave "provider/modello"."""
+        with self._lock:
+            return {
+                f"{provider}/{model}": {
+                    "requests": m.requests,
+                    "streams": m.streams,
+                    "errors": dict(m.errors),
+                    "retries": m.retries,
+                    "input_tokens": m.input_tokens,
+                    "output_tokens": m.output_tokens,
+                    "latency_sec": m.latency.to_dict(),
+                    "ttft_sec": m.ttft.to_dict(),
+                }
+                for (provider, model), m in self._models.items()
+            }
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """Snapshot in JSON."""
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "ai") -> str:
+        """Esposizione in formato testo Prometheus (0.0.4)."""
+        with self._lock:
+            items = sorted(self._models.items())
+            lines = []
+
+            def header(name: str, kind: str, help_text: str) -> None:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+            def labels(provider: str, model: str, **extra: str) -> str:
+                pairs = {"provider": provider, "model": model, **extra}
+                return ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items())
+
+            header("requests_total", "counter", "Tentativi di chiamata ai modelli (ogni retry conta come richiesta).")
+            for (provider, model), m in items:
+                lines.append(f"{prefix}_requests_total{{{labels(provider, model)}}} {m.requests}")
+
+            header("errors_total", "counter", "Tentativi falliti per tipo di errore.")
+            for (provider, model), m in items:
+                for kind, count in sorted(m.errors.items()):
+                    lines.append(
+                        f"{prefix}_errors_total{{{labels(provider, model, type=kind)}}} {count}"
+                    )
+
+            header("retries_total", "counter", "Nuovi tentativi dopo un errore.")
+            for (provider, model), m in items:
+                lines.append(f"{prefix}_retries_total{{{labels(provider, model)}}} {m.retries}")
+
+            header("tokens_total", "counter", "Token consumati per direzione.")
+            for (provider, model), m in items:
+                for direction, value in (("input", m.input_tokens), ("output", m.output_tokens)):
+                    lines.append(
+                        f"{prefix}_tokens_total{{{labels(provider, model, direction=direction)}}} {value}"
+                    )
+
+            for name, attr, help_text in (
+                ("request_latency_seconds", "latency", "Latenza delle chiamate."),
+                ("time_to_first_token_seconds", "ttft", "Tempo al primo token degli stream."),
+            ):
+                header(name, "histogram", help_text)
+                for (provider, model), m in items:
+                    hist = getattr(m, attr)
+                    for upper, total in hist.cumulative():
+                        le = "+Inf" if math.isinf(upper) else repr(upper)
+                        lines.append(
+                            f"{prefix}_{name}_bucket{{{labels(provider, model, le=le)}}} {total}"
+                        )
+                    lines.append(f"{prefix}_{name}_sum{{{labels(provider, model)}}} {hist.sum}")
+                    lines.append(f"{prefix}_{name}_count{{{labels(provider, model)}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Azzera tutte le metriche."""
+        with self._lock:
+            self._models.clear()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Registro condiviso da tutti i wrapper."""
+    return _registry
@@ -0,0 +1,184 @@
+"""Catalogo dei modelli persistito su disco, con refresh stale-while-revalidate.
+
+Le liste dei modelli (Groq, OpenRouter, Ollama, llama.cpp, scraping della
+documentazione Gemini) richiedono chiamate di rete e vengono lette a ogni
+rerun della sidebar Streamlit. Qui vengono servite subito dal file
+AI_CACHE_DIR/model_catalog.json (o dalla memoria) e, se più vecchie del TTL,
+ricaricate in un thread in background: il chiamante non aspetta mai la rete.
+Al primissimo uso get restituisce il default e la lista arriva al rerun
+successivo, salvo chi chiede esplicitamente di attendere (`wait`).
+
+Un fetch fallito non sovrascrive l'ultima lista valida.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .response_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_TTL_SEC = 3600
+LOCAL_TTL_SEC = 30
+# Attesa del primo fetch per chi non può usare il default (es. il costruttore di AIProvider)
+FIRST_FETCH_WAIT_SEC = 2.0
+# Dopo un fetch fallito non si riprova prima di questo intervallo
+RETRY_AFTER_FAILURE_SEC = 30
+
+
+class ModelCatalog:
+    """Liste di modelli per chiave ("groq", "ollama", "llamacpp:host:port", ...)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(
+            os.getenv("AI_CACHE_DIR", DEFAULT_CACHE_DIR), "model_catalog.json"
+        )
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._read()
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self._failed_at: Dict[str, float] = {}
+        # Istante dell'ultimo invalidate per chiave ("" = tutte): le voci su disco
+        # scaricate prima non devono tornare in memoria con _write
+        self._invalidated_at: Dict[str, float] = {}
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "failures": 0}
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self) -> None:
+        """Scrittura atomica, unita alle voci più recenti scritte da altri processi."""
+        try:
+            on_disk = self._read()
+            with self._lock:
+                for key, entry in on_disk.items():
+                    fetched_at = entry.get("fetched_at", 0)
+                    if fetched_at <= max(self._invalidated_at.get(key, 0), self._invalidated_at.get("", 0)):
+                        continue
+                    mine = self._entries.get(key)
+                    if mine is None or fetched_at > mine.get("fetched_at", 0):
+                        self._entries[key] = entry
+                payload = json.dumps(self._entries, indent=1)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ Catalogo modelli non salvato: {e}")
+
+    def _refresh(self, key: str, fetch: Callable[[], List[str]]) -> None:
+        try:
+            models = fetch()
+            if not models:
+                raise ValueError("lista vuota")
+            with self._lock:
+                self._entries[key] = {"models": list(models), "fetched_at": time.time()}
+                self.stats["refreshes"] += 1
+                self._failed_at.pop(key, None)
+            self._write()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            with self._lock:
+                self.stats["failures"] += 1
+                self._failed_at[key] = time.time()
+            print(f"⚠️ Catalogo modelli: refresh di '{key}' fallito: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def refresh(self, key: str, fetch: Callable[[], List[str]]) -> Optional[threading.Thread]:
+        """Avvia (una sola volta per chiave) il refresh in background.
+
+        None se l'ultimo tentativo è fallito da meno di RETRY_AFTER_FAILURE_SEC.
+        """
+        with self._lock:
+            thread = self._refreshing.get(key)
+            if thread is None:
+                if time.time() - self._failed_at.get(key, 0) < RETRY_AFTER_FAILURE_SEC:
+                    return None
+                thread = threading.Thread(
+                    target=self._refresh, args=(key, fetch), name=f"model-catalog-{key}", daemon=True
+                )
+                self._refreshing[key] = thread
+                thread.start()
+        return thread
+
+    def get(
+        self,
+        key: str,
+        fetch: Callable[[], List[str]],
+        default: Optional[List[str]] = None,
+        ttl: float = DEFAULT_TTL_SEC,
+        wait: float = 0.0,
+    ) -> List[str]:
+        """Lista in catalogo; se scaduta la ricarica in background.
+
+        Senza alcuna voce salvata avvia il primo fetch e restituisce subito
+        `default` (o attende al massimo `wait` secondi, se indicato).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            stale = time.time() - entry.get("fetched_at", 0) > ttl
+            with self._lock:
+                self.stats["stale" if stale else "hits"] += 1
+            if stale:
+                self.refresh(key, fetch)
+            return list(entry["models"])
+
+        with self._lock:
+            self.stats["misses"] += 1
+        thread = self.refresh(key, fetch)
+        if thread is not None and wait > 0:
+            thread.join(wait)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return list(entry["models"])
+        return list(default or [])
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Segna come scaduta una voce (o tutte): il prossimo get la ricarica."""
+        with self._lock:
+            self._invalidated_at[key or ""] = time.time()
+            if key:
+                self._failed_at.pop(key, None)
+            else:
+                self._failed_at.clear()
+            for name in [key] if key else list(self._entries):
+                if name in self._entries:
+                    self._entries[name]["fetched_at"] = 0
+
+    def is_refreshing(self, key: str) -> bool:
+        """True se un refresh della chiave è in corso (es. primo caricamento)."""
+        with self._lock:
+            return key in self._refreshing
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "path": self.path,
+                "entries": {
+                    key: {"models": len(entry["models"]), "age_sec": round(time.time() - entry["fetched_at"])}
+                    for key, entry in self._entries.items()
+                },
+            }
+
+
+_catalog: Optional[ModelCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> ModelCatalog:
+    """Catalogo condiviso dal processo."""
+    global _catalog  # pylint: disable=global-statement
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+        return _catalog
@@ -0,0 +1,272 @@
+"""Router adattivo dei modelli con circuit breaker condiviso dal processo.
+
+Per ogni (provider, modello) mantiene una finestra mobile di latenze ed esiti
+(errori, 429). Un modello che fallisce ripetutamente, o che riceve un 429,
+viene messo in cooldown (circuito "open"); scaduto il cooldown passa a
+"half_open" e riceve una sola richiesta di prova: se va a buon fine torna
+disponibile ("closed"), altrimenti il cooldown raddoppia.
+
+choose() restituisce il miglior modello sano di una catena: l'ordine della
+catena esprime la preferenza (qualità), il tasso d'errore recente la corregge
+e un p90 di latenza oltre AI_ROUTER_SLOW_P90_SEC pesa come errori in più.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from .rate_limiter import is_rate_limit_error, retry_after_seconds
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+LATENCY_WINDOW = 100
+OUTCOME_WINDOW = 20
+OUTCOME_MAX_AGE_SEC = 600
+FAILURE_THRESHOLD = 3
+BASE_COOLDOWN_SEC = 30.0
+MAX_COOLDOWN_SEC = 600.0
+# Modello inesistente / argomenti non validi: inutile riprovare a breve
+FATAL_COOLDOWN_SEC = 3600.0
+PROBE_TIMEOUT_SEC = 120.0
+# Un modello con p90 oltre la soglia è trattato come se avesse LATENCY_PENALTY di errori in più
+SLOW_P90_SEC = 30.0
+LATENCY_PENALTY = 0.3
+LATENCY_MIN_SAMPLES = 5
+
+
+def _slow_threshold() -> float:
+    return float(os.getenv("AI_ROUTER_SLOW_P90_SEC", str(SLOW_P90_SEC)))
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class ModelHealth:
+    """Statistiche mobili e stato del circuito di un singolo modello."""
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=OUTCOME_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.cooldown = BASE_COOLDOWN_SEC
+        self.probe_started: Optional[float] = None
+
+    def score(self, now: float, slow_p90: float) -> float:
+        """Punteggio di routing (più basso = migliore): tasso d'errore più la penalità di latenza."""
+        # Arrotondiamo il tasso d'errore: piccole differenze non scavalcano la preferenza
+        score = round(self.error_rate(now), 1)
+        if len(self.latencies) >= LATENCY_MIN_SAMPLES and slow_p90 > 0:
+            p90 = _percentile(list(self.latencies), 0.9)
+            if p90 is not None and p90 > slow_p90:
+                score += LATENCY_PENALTY
+        return round(score, 2)
+
+    def error_rate(self, now: float) -> float:
+        recent = [ok for ts, ok in self.outcomes if now - ts <= OUTCOME_MAX_AGE_SEC]
+        if not recent:
+            return 0.0
+        return 1.0 - (sum(recent) / len(recent))
+
+    def refresh(self, now: float) -> None:
+        """Porta il circuito da open a half_open allo scadere del cooldown."""
+        if self.state == OPEN and now >= self.open_until:
+            self.state = HALF_OPEN
+            self.probe_started = None
+        if (
+            self.state == HALF_OPEN
+            and self.probe_started is not None
+            and now - self.probe_started > PROBE_TIMEOUT_SEC
+        ):
+            # La prova non ha mai riportato un esito: ne consentiamo un'altra
+            self.probe_started = None
+
+    def available(self, now: float) -> bool:
+        self.refresh(now)
+        if self.state == CLOSED:
+            return True
+        return self.state == HALF_OPEN and self.probe_started is None
+
+    def trip(self, now: float, cooldown: float) -> None:
+        self.state = OPEN
+        self.open_until = now + cooldown
+        self.probe_started = None
+
+
+class ModelRouter:
+    """Registro condiviso della salute dei modelli e politica di routing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health: Dict[Tuple[str, str], ModelHealth] = {}
+
+    def _get(self, provider: str, model: str) -> ModelHealth:
+        key = (provider, model)
+        health = self._health.get(key)
+        if health is None:
+            health = ModelHealth()
+            self._health[key] = health
+        return health
+
+    def choose(
+        self,
+        provider: str,
+        chain: Iterable[str],
+        exclude: Optional[Set[str]] = None,
+        claim: bool = True,
+    ) -> Optional[str]:
+        """Miglior modello sano della catena (None se la catena, esclusi, è vuota).
+
+        Se nessun modello è disponibile restituisce quello che uscirà prima
+        dal cooldown, così la richiesta non fallisce a priori; con `exclude`
+        restituisce invece None. claim=False consulta senza prenotare la
+        richiesta di prova di un modello half_open.
+        """
+        exclude = exclude or set()
+        candidates = [m for m in dict.fromkeys(chain) if m not in exclude]
+        if not candidates:
+            return None
+
+        slow_p90 = _slow_threshold()
+        with self._lock:
+            now = time.monotonic()
+            healthy = []
+            for position, model in enumerate(candidates):
+                health = self._get(provider, model)
+                if health.available(now):
+                    healthy.append((health.score(now, slow_p90), position, model))
+
+            if healthy:
+                healthy.sort()
+                chosen = healthy[0][2]
+                health = self._get(provider, chosen)
+                if claim and health.state == HALF_OPEN:
+                    health.probe_started = now
+                return chosen
+
+            if exclude:
+                return None
+            return min(candidates, key=lambda m: self._get(provider, m).open_until)
+
+    def record_success(self, provider: str, model: str, latency_sec: float) -> None:
+        """Registra una risposta valida; un modello in prova torna disponibile."""
+        with self._lock:
+            now = time.monotonic()
+            health = self._get(provider, model)
+            health.requests += 1
+            health.latencies.append(latency_sec)
+            health.outcomes.append((now, True))
+            health.consecutive_failures = 0
+            if health.state != CLOSED:
+                print(f"✅ Router: {provider}/{model} di nuovo disponibile.")
+            health.state = CLOSED
+            health.cooldown = BASE_COOLDOWN_SEC
+            health.probe_started = None
+
+    def record_failure(
+        self,
+        provider: str,
+        model: str,
+        error: Exception,
+        cooldown: Optional[float] = None,
+    ) -> None:
+        """Registra un errore e apre il circuito se necessario.
+
+        Un 429 apre subito il circuito (per il Retry-After se noto); gli altri
+        errori dopo FAILURE_THRESHOLD fallimenti consecutivi o se il modello
+        era in prova. Un `cooldown` esplicito apre subito il circuito per quella
+        durata (es. FATAL_COOLDOWN_SEC per un modello inesistente).
+        """
+        with self._lock:
+            now = time.monotonic()
+            health = self._get(provider, model)
+            health.requests += 1
+            health.errors += 1
+            health.outcomes.append((now, False))
+            health.consecutive_failures += 1
+
+            rate_limited = is_rate_limit_error(error)
+            if rate_limited:
+                health.rate_limited += 1
+
+            if cooldown is not None:
+                pass
+            elif rate_limited:
+                retry_after = retry_after_seconds(error)
+                cooldown = retry_after if retry_after is not None else health.cooldown
+            elif health.state == HALF_OPEN or health.consecutive_failures >= FAILURE_THRESHOLD:
+                cooldown = health.cooldown
+            else:
+                return
+
+            health.trip(now, cooldown)
+            health.cooldown = min(MAX_COOLDOWN_SEC, health.cooldown * 2)
+            print(f"🔌 Router: {provider}/{model} in cooldown per {cooldown:.0f}s.")
+
+    def is_available(self, provider: str, model: str) -> bool:
+        """True se il circuito del modello non è aperto."""
+        with self._lock:
+            health = self._health.get((provider, model))
+            if health is None:
+                return True
+            health.refresh(time.monotonic())
+            return health.state != OPEN
+
+    def latency_percentile(
+        self, provider: str, model: str, pct: float, min_samples: int = 1
+    ) -> Optional[float]:
+        """Percentile (0-1) delle latenze recenti, None con meno di min_samples campioni."""
+        with self._lock:
+            health = self._health.get((provider, model))
+            if health is None or len(health.latencies) < max(1, min_samples):
+                return None
+            return _percentile(list(health.latencies), pct)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Stato e statistiche di tutti i modelli osservati."""
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for (provider, model), health in self._health.items():
+                health.refresh(now)
+                latencies = list(health.latencies)
+                result[f"{provider}/{model}"] = {
+                    "state": health.state,
+                    "requests": health.requests,
+                    "errors": health.errors,
+                    "rate_limited": health.rate_limited,
+                    "error_rate": round(health.error_rate(now), 3),
+                    "p50_sec": _percentile(latencies, 0.5),
+                    "p90_sec": _percentile(latencies, 0.9),
+                    "p99_sec": _percentile(latencies, 0.99),
+                    "cooldown_remaining_sec": max(0.0, health.open_until - now)
+                    if health.state == OPEN
+                    else 0.0,
+                }
+            return result
+
+    def reset(self) -> None:
+        """Dimentica tutte le statistiche (utile nei test/benchmark)."""
+        with self._lock:
+            self._health.clear()
+
+
+_router = ModelRouter()
+
+
+def get_router() -> ModelRouter:
+    """Router condiviso da tutte le istanze di AIProvider."""
+    return _router
@@ -0,0 +1,208 @@
+"""Warm-up e keep-alive dei modelli Ollama.
+
+Dopo un periodo di inattività Ollama scarica il modello e la prima chiamata
+paga l'intero caricamento (10-30 s). Qui il modello viene precaricato fuori
+dal percorso critico (warmup / warmup_async), ogni richiesta invia un
+keep_alive configurabile (AI_OLLAMA_KEEP_ALIVE, default "30m") e un
+heartbeat opzionale in background lo tiene residente.
+
+Ollama ricarica il modello anche quando cambia num_ctx: il num_ctx con cui
+il modello è residente viene ricordato e riusato dalle richieste che ci
+stanno dentro (resident_num_ctx), e il warm-up usa lo stesso num_ctx che
+sceglierà il budget del contesto.
+
+warmup_async non ripete il warm-up di un modello già in corso o fatto da
+meno di metà keep_alive, e lo salta se ollama.ps() mostra il modello già
+residente con un contesto utilizzabile.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Set, Union
+
+from .lazy import LazyModule
+
+ollama = LazyModule("ollama")
+
+# num_ctx usato dal warm-up, così le richieste tipiche non forzano un reload
+DEFAULT_WARM_CTX = 8192
+
+_lock = threading.Lock()
+_resident_ctx: Dict[str, int] = {}
+_warm_stats: Dict[str, dict] = {}
+_heartbeats: Dict[str, threading.Event] = {}
+_warming: Set[str] = set()
+_last_warm: Dict[str, float] = {}
+
+
+def keep_alive() -> Union[str, float]:
+    """Valore keep_alive per Ollama: durata ("30m", "2h"), secondi o -1 (sempre residente)."""
+    value = os.getenv("AI_OLLAMA_KEEP_ALIVE", "30m")
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def warm_ctx() -> int:
+    return int(os.getenv("AI_OLLAMA_WARM_CTX", str(DEFAULT_WARM_CTX)))
+
+
+def _keep_alive_seconds(value: Union[str, float]) -> Optional[float]:
+    """Durata del keep_alive in secondi (None se infinita o non interpretabile)."""
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else None
+    units = {"s": 1, "m": 60, "h": 3600}
+    try:
+        return float(value[:-1]) * units[value[-1]]
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+def resident_num_ctx(model: str) -> Optional[int]:
+    """num_ctx con cui il modello è stato caricato l'ultima volta da questo processo."""
+    with _lock:
+        return _resident_ctx.get(model)
+
+
+def note_loaded(model: str, num_ctx: int) -> None:
+    """Registra il num_ctx dell'ultima richiesta inviata al modello."""
+    with _lock:
+        _resident_ctx[model] = num_ctx
+
+
+def _resident_entry(model: str):
+    """Voce di ollama.ps() per il modello, None se non è caricato."""
+    for entry in ollama.ps().models:
+        if model in (entry.model, entry.name):
+            return entry
+    return None
+
+
+def warmup(model: str, num_ctx: Optional[int] = None) -> float:
+    """Carica il modello in memoria (prompt vuoto) e restituisce i secondi impiegati."""
+    num_ctx = num_ctx or resident_num_ctx(model) or warm_ctx()
+    start = time.time()
+    ollama.generate(
+        model=model, prompt="", keep_alive=keep_alive(), options={"num_gpu": 999, "num_ctx": num_ctx}
+    )
+    elapsed = time.time() - start
+    note_loaded(model, num_ctx)
+    with _lock:
+        _last_warm[model] = time.time()
+        stats = _warm_stats.setdefault(model, {"warmups": 0})
+        stats["warmups"] += 1
+        stats["last_warmup"] = start
+        stats["last_load_sec"] = round(elapsed, 3)
+    return elapsed
+
+
+def _recently_warmed(model: str) -> bool:
+    """Warm-up in corso o più recente di metà keep_alive (chiamare con _lock)."""
+    if model in _warming:
+        return True
+    last = _last_warm.get(model)
+    if last is None:
+        return False
+    ttl = _keep_alive_seconds(keep_alive())
+    return ttl is None or time.time() - last < ttl / 2
+
+
+def warmup_async(
+    model: str, num_ctx: Optional[int] = None, max_ctx: Optional[Callable[[], int]] = None
+) -> Optional[threading.Thread]:
+    """warmup in un thread daemon: l'avvio del provider non aspetta il caricamento.
+
+    max_ctx restituisce la finestra massima del budget (chiamata nel thread):
+    il warm-up usa min(AI_OLLAMA_WARM_CTX, max_ctx) come farà la prima
+    richiesta. Restituisce None se il warm-up non serve.
+    """
+    with _lock:
+        if _recently_warmed(model):
+            return None
+        _warming.add(model)
+
+    def run():
+        try:
+            limit = max_ctx() if max_ctx else None
+            ctx = num_ctx or (min(warm_ctx(), limit) if limit else None)
+            entry = _resident_entry(model)
+            resident_ctx = getattr(entry, "context_length", None) if entry is not None else None
+            if entry is not None and (not resident_ctx or not limit or resident_ctx <= limit):
+                # Già caricato con un contesto che le richieste possono riusare
+                if resident_ctx:
+                    note_loaded(model, resident_ctx)
+                with _lock:
+                    _last_warm[model] = time.time()
+                return
+            elapsed = warmup(model, ctx)
+            print(f"🔥 Ollama: {model} precaricato in {elapsed:.1f}s.")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"⚠️ Ollama: warm-up di {model} fallito: {e}")
+        finally:
+            with _lock:
+                _warming.discard(model)
+
+    thread = threading.Thread(target=run, name=f"ollama-warmup-{model}", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_heartbeat(model: str, interval: Optional[float] = None) -> None:
+    """Rinnova periodicamente il keep_alive del modello finché non si chiama stop_heartbeat.
+
+    interval di default: metà del keep_alive (almeno 30 s), oppure
+    AI_OLLAMA_HEARTBEAT_SEC se impostata.
+    """
+    if interval is None:
+        env = os.getenv("AI_OLLAMA_HEARTBEAT_SEC")
+        ttl = _keep_alive_seconds(keep_alive())
+        interval = float(env) if env else max(30.0, (ttl or 600.0) / 2)
+
+    with _lock:
+        if model in _heartbeats:
+            return
+        stop = threading.Event()
+        _heartbeats[model] = stop
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                warmup(model)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"⚠️ Ollama heartbeat {model}: {e}")
+
+    threading.Thread(target=run, name=f"ollama-heartbeat-{model}", daemon=True).start()
+
+
+def stop_heartbeat(model: Optional[str] = None) -> None:
+    """Ferma l'heartbeat di un modello (o di tutti)."""
+    with _lock:
+        models = [model] if model else list(_heartbeats)
+        for name in models:
+            stop = _heartbeats.pop(name, None)
+            if stop is not None:
+                stop.set()
+
+
+def model_status(model: str) -> dict:
+    """Stato del modello per la UI: residente, scadenza, VRAM, contesto e ultimo warm-up."""
+    status = {"model": model, "resident": False, "heartbeat": False}
+    try:
+        entry = _resident_entry(model)
+        if entry is not None:
+            status.update(
+                resident=True,
+                expires_at=entry.expires_at.isoformat() if entry.expires_at else None,
+                size_vram=entry.size_vram,
+                context_length=entry.context_length,
+            )
+            if entry.context_length:
+                note_loaded(model, entry.context_length)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        status["error"] = str(e)
+    with _lock:
+        status["heartbeat"] = model in _heartbeats
+        status.update(_warm_stats.get(model, {}))
+    return status
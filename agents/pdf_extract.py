@@ -0,0 +1,224 @@
+"""Estrazione del testo dai PDF con cache per contenuto ed estrazione parallela.
+
+Lo stesso PDF (es. un estratto conto) arriva spesso più volte: retry, più
+provider, re-import. Il testo per pagina viene quindi tenuto in una cache
+LRU in memoria, indicizzata dallo SHA-256 dei byte e limitata in caratteri
+(AI_PDF_CACHE_MB, default 64).
+
+I documenti con almeno PARALLEL_MIN_PAGES pagine vengono estratti a blocchi
+di pagine in un process pool (PyMuPDF non rilascia il GIL), se la macchina
+ha più di un core e il pool ha finito di avviarsi.
+
+iter_pdf_pages / iter_pdf_chunks estraggono invece una pagina alla volta,
+con intervallo di pagine, budget di caratteri e stop anticipato, senza mai
+tenere in memoria il testo dell'intero documento.
+"""
+
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .lazy import LazyModule, is_available
+
+# PyMuPDF viene importato alla prima estrazione
+PYMUPDF_AVAILABLE = is_available("fitz")
+fitz = LazyModule("fitz")
+
+PARALLEL_MIN_PAGES = 48
+MAX_WORKERS = 8
+
+_cache: "OrderedDict[str, List[str]]" = OrderedDict()
+_cache_chars = 0
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_warmup: list = []
+
+
+def _max_cache_chars() -> int:
+    # ~1 byte per carattere per il testo tipico degli estratti conto
+    return int(float(os.getenv("AI_PDF_CACHE_MB", "64")) * 1024 * 1024)
+
+
+def pdf_digest(data: bytes) -> str:
+    """Chiave di cache: SHA-256 dei byte del PDF."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extract_range(data: bytes, start: int, stop: int) -> List[str]:
+    """Testo delle pagine [start, stop) (eseguito anche nei processi worker)."""
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _noop() -> None:
+    return None
+
+
+def _ready_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Pool pronto all'uso, oppure None mentre i worker stanno ancora partendo.
+
+    L'avvio (spawn + import) costa più di un'estrazione sequenziale: il primo
+    documento grande lo avvia in background e viene estratto in sequenza.
+    """
+    global _pool, _pool_warmup  # pylint: disable=global-statement
+    with _lock:
+        if _pool is None:
+            # spawn: il processo chiamante è multi-thread (Streamlit, generate_many)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_warmup = [_pool.submit(_noop) for _ in range(workers)]
+        if all(f.done() for f in _pool_warmup):
+            return _pool
+        return None
+
+
+def _chunks(page_count: int, parts: int) -> List[Tuple[int, int]]:
+    size = -(-page_count // parts)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _extract_pages(data: bytes, workers: Optional[int] = None) -> List[str]:
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if workers is None:
+            workers = min(MAX_WORKERS, os.cpu_count() or 1)
+        pool = None
+        if page_count >= PARALLEL_MIN_PAGES and workers >= 2:
+            pool = _ready_pool(workers)
+        if pool is None:
+            return [page.get_text() for page in doc]
+
+    # Più blocchi che worker per bilanciare pagine di peso diverso
+    futures = [
+        pool.submit(_extract_range, data, start, stop)
+        for start, stop in _chunks(page_count, workers * 2)
+    ]
+    pages: List[str] = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def extract_pdf_pages(data: bytes, workers: Optional[int] = None) -> Tuple[List[str], bool]:
+    """Testo di ogni pagina del PDF e flag cache_hit.
+
+    workers forza il numero di processi (default: core disponibili, max
+    MAX_WORKERS). La lista restituita è condivisa con la cache: non va modificata.
+    """
+    global _cache_chars  # pylint: disable=global-statement
+    key = pdf_digest(data)
+    with _lock:
+        pages = _cache.get(key)
+        if pages is not None:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            return pages, True
+        _cache_stats["misses"] += 1
+
+    pages = _extract_pages(data, workers)
+    size = sum(len(p) for p in pages)
+    limit = _max_cache_chars()
+    if size > limit:
+        return pages, False
+
+    with _lock:
+        if key not in _cache:
+            _cache[key] = pages
+            _cache_chars += size
+        while _cache_chars > limit and _cache:
+            _, evicted = _cache.popitem(last=False)
+            _cache_chars -= sum(len(p) for p in evicted)
+            _cache_stats["evictions"] += 1
+    return pages, False
+
+
+def pdf_cache_stats() -> dict:
+    """Hit/miss/evictions e occupazione della cache dei PDF."""
+    with _lock:
+        return {
+            **_cache_stats,
+            "entries": len(_cache),
+            "chars": _cache_chars,
+            "max_chars": _max_cache_chars(),
+        }
+
+
+def clear_pdf_cache() -> None:
+    """Svuota la cache dei PDF estratti."""
+    global _cache_chars  # pylint: disable=global-statement
+    with _lock:
+        _cache.clear()
+        _cache_chars = 0
+
+
+def iter_pdf_pages(
+    data: bytes,
+    pages: Optional[Iterable[int]] = None,
+    max_chars: Optional[int] = None,
+    stop_when: Optional[Callable[[int, str], bool]] = None,
+) -> Iterator[Tuple[int, str]]:
+    """Genera (indice pagina 0-based, testo) pagina per pagina, saltando quelle vuote.
+
+    pages: indici da estrarre (es. range(0, 10)), in quell'ordine; quelli
+    fuori dal documento vengono ignorati. max_chars: budget totale, l'ultima
+    pagina viene troncata per rispettarlo. stop_when(indice, testo): True
+    interrompe dopo aver restituito la pagina. Anche il consumatore può
+    smettere di iterare: il documento viene chiuso alla chiusura del generatore.
+    """
+    with _lock:
+        cached = _cache.get(pdf_digest(data))
+    remaining = max_chars
+
+    with contextlib.ExitStack() as stack:
+        doc = None
+        if cached is not None:
+            page_count = len(cached)
+        else:
+            doc = stack.enter_context(fitz.open(stream=data, filetype="pdf"))
+            page_count = doc.page_count
+
+        for index in range(page_count) if pages is None else pages:
+            if remaining is not None and remaining <= 0:
+                return
+            if not 0 <= index < page_count:
+                continue
+            text = cached[index] if doc is None else doc[index].get_text()
+            if not text.strip():
+                continue
+            if remaining is not None:
+                text = text[:remaining]
+                remaining -= len(text)
+            yield index, text
+            if stop_when is not None and stop_when(index, text):
+                return
+
+
+def iter_pdf_chunks(
+    data: bytes,
+    pages_per_chunk: int = 10,
+    pages: Optional[Iterable[int]] = None,
+    max_chars: Optional[int] = None,
+    stop_when: Optional[Callable[[int, str], bool]] = None,
+) -> Iterator[Tuple[List[int], str]]:
+    """Raggruppa iter_pdf_pages in blocchi di pagine pronti da inviare al modello.
+
+    Restituisce (indici delle pagine, testo unito): il primo blocco è
+    disponibile appena lette le sue pagine.
+    """
+    indices: List[int] = []
+    texts: List[str] = []
+    for index, text in iter_pdf_pages(data, pages, max_chars, stop_when):
+        indices.append(index)
+        texts.append(text)
+        if len(indices) >= pages_per_chunk:
+            yield indices, "\n".join(texts)
+            indices, texts = [], []
+    if indices:
+        yield indices, "\n".join(texts)
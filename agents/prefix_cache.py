@@ -0,0 +1,170 @@
+"""Riuso della KV cache di llama-server per i prompt con lo stesso prefisso.
+
+I prompt degli agenti iniziano con blocchi lunghi e identici (knowledge base
+di TraderAgent, wiki VPA) seguiti dai dati variabili. llama-server con
+cache_prompt riusa il KV del prefisso già elaborato, ma solo se la
+richiesta finisce sullo slot che lo contiene: qui ogni prefisso stabile
+viene associato (pinned) agli slot che lo hanno già elaborato. Un prefisso
+può avere più slot: se i suoi sono tutti occupati prende uno slot libero
+(prima quelli mai assegnati, poi quello del prefisso usato meno di
+recente), così le richieste concorrenti non si accodano su uno slot solo.
+Se nessuno slot è libero lo sceglie il server. Ogni pin() va chiuso con
+release() a fine richiesta.
+
+Il prefisso stabile è la parte iniziale in comune con l'ultimo prompt
+inviato allo stesso slot; lo slot si sceglie dall'hash dei primi
+PREFIX_KEY_CHARS caratteri. I prompt più corti di MIN_PREFIX_CHARS non
+vengono pinnati (lo slot lo sceglie il server).
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+MIN_PREFIX_CHARS = 2048
+PREFIX_KEY_CHARS = 512
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    """Lunghezza del prefisso comune (ricerca binaria sui confronti di slice)."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class SlotPinner:
+    """Associa i prefissi agli slot di un server llama.cpp; thread-safe."""
+
+    def __init__(self, total_slots: int):
+        self.total_slots = max(1, total_slots)
+        self._lock = threading.Lock()
+        # prefisso -> slot che lo contengono, dal meno al più recente
+        self._slots: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._in_flight = [0] * self.total_slots
+        self._last_prompt: Dict[int, str] = {}
+        self.stats = {
+            "requests": 0,
+            "pinned": 0,
+            "prefix_hits": 0,
+            "evictions": 0,
+            "all_busy": 0,
+            "reused_chars": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "prompt_ms": 0.0,
+        }
+
+    def _free_slot(self, key: str) -> Optional[int]:
+        """Slot libero per il prefisso: uno dei suoi, uno mai assegnato o uno tolto al prefisso LRU."""
+        owned = self._slots.get(key)
+        if owned is not None:
+            self._slots.move_to_end(key)
+            slot = next((s for s in owned if not self._in_flight[s]), None)
+            if slot is not None:
+                return slot
+        assigned = {s for slots in self._slots.values() for s in slots}
+        slot = next((i for i in range(self.total_slots) if i not in assigned), None)
+        if slot is None:
+            victim = next(
+                (
+                    (other, s)
+                    for other, slots in self._slots.items()
+                    if other != key
+                    for s in slots
+                    if not self._in_flight[s]
+                ),
+                None,
+            )
+            if victim is None:
+                return None
+            other, slot = victim
+            self._slots[other].remove(slot)
+            if not self._slots[other]:
+                del self._slots[other]
+            self.stats["evictions"] += 1
+        self._slots.setdefault(key, []).append(slot)
+        return slot
+
+    def pin(self, prompt: str) -> Optional[int]:
+        """Slot per il prompt (None: lo sceglie il server) e aggiorna le statistiche di riuso."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if len(prompt) < MIN_PREFIX_CHARS:
+                return None
+            key = hashlib.sha1(prompt[:PREFIX_KEY_CHARS].encode("utf-8")).hexdigest()
+            slot = self._free_slot(key)
+            if slot is None:
+                # Tutti gli slot occupati: meglio la coda del server che uno slot preciso
+                self.stats["all_busy"] += 1
+                return None
+            self._in_flight[slot] += 1
+
+            previous = self._last_prompt.get(slot)
+            if previous is not None:
+                shared = common_prefix_len(previous, prompt)
+                if shared >= MIN_PREFIX_CHARS:
+                    self.stats["prefix_hits"] += 1
+                    self.stats["reused_chars"] += shared
+            self._last_prompt[slot] = prompt
+            self.stats["pinned"] += 1
+            return slot
+
+    def release(self, slot: Optional[int]) -> None:
+        """Fine della richiesta inviata allo slot restituito da pin()."""
+        if slot is None:
+            return
+        with self._lock:
+            if 0 <= slot < self.total_slots and self._in_flight[slot]:
+                self._in_flight[slot] -= 1
+
+    def record_timings(self, timings: Optional[dict]) -> None:
+        """Registra i tempi di prefill restituiti dal server (campo "timings")."""
+        if not timings:
+            return
+        with self._lock:
+            self.stats["prompt_tokens"] += int(timings.get("prompt_n") or 0)
+            self.stats["cached_tokens"] += int(timings.get("cache_n") or 0)
+            self.stats["prompt_ms"] += float(timings.get("prompt_ms") or 0.0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["slots"] = self.total_slots
+            stats["prefixes"] = len(self._slots)
+            stats["in_flight"] = sum(self._in_flight)
+        stats["prompt_ms"] = round(stats["prompt_ms"], 1)
+        stats["hit_rate"] = round(stats["prefix_hits"] / stats["pinned"], 3) if stats["pinned"] else 0.0
+        return stats
+
+
+_pinners: Dict[str, SlotPinner] = {}
+_lock = threading.Lock()
+
+
+def get_pinner(server: str, total_slots: int) -> SlotPinner:
+    """Pinner condiviso per server ("host:port")."""
+    with _lock:
+        pinner = _pinners.get(server)
+        if pinner is None or pinner.total_slots != max(1, total_slots):
+            pinner = SlotPinner(total_slots)
+            _pinners[server] = pinner
+        return pinner
+
+
+def reset_pinner(server: str) -> None:
+    """Scarta le associazioni di un server riavviato: i suoi slot hanno perso il KV."""
+    with _lock:
+        _pinners.pop(server, None)
+
+
+def prefix_cache_stats() -> Dict[str, dict]:
+    """Statistiche di riuso del prefisso per server llama.cpp."""
+    with _lock:
+        pinners = dict(_pinners)
+    return {server: pinner.snapshot() for server, pinner in pinners.items()}
@@ -0,0 +1,301 @@
+"""Rate limiter token-bucket condiviso dal processo, per provider e modello.
+
+Ogni coppia (provider, modello) ha due bucket: richieste/minuto (RPM) e
+token/minuto (TPM). I wrapper consultano il limiter prima di ogni chiamata e
+attendono il tempo necessario invece di prendere un 429. Quando un 429
+arriva comunque, l'header Retry-After (o il retryDelay di Gemini) blocca il
+modello per tutti i thread fino alla scadenza indicata.
+
+Di default non c'è nessun limite preventivo (le quote dipendono dal piano
+dell'account): vale solo il blocco dopo un 429. I limiti si configurano con
+configure_rate_limit() o con la variabile d'ambiente AI_RATE_LIMITS (JSON), es.:
+    {"groq": {"*": {"rpm": 30, "tpm": 12000}}, "gemini": {"gemini-2.5-pro": {"rpm": 5}}}
+AI_RATE_LIMITS=free_tier applica i limiti dei piani gratuiti (FREE_TIER_LIMITS).
+AI_RATE_LIMIT=false disabilita completamente il throttling.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Limiti dei piani gratuiti per provider, attivi solo con AI_RATE_LIMITS=free_tier.
+# "*" vale per i modelli non elencati; None = nessun limite su quella dimensione.
+FREE_TIER_LIMITS: Dict[str, Dict[str, Dict[str, Optional[int]]]] = {
+    "gemini": {
+        "*": {"rpm": 10, "tpm": 250_000},
+        "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250_000},
+        "gemini-2.5-pro": {"rpm": 5, "tpm": 250_000},
+        "gemini-3-pro-preview": {"rpm": 5, "tpm": 250_000},
+    },
+    "groq": {
+        "*": {"rpm": 30, "tpm": 6_000},
+        "llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12_000},
+        "moonshotai/kimi-k2-instruct": {"rpm": 60, "tpm": 10_000},
+    },
+    "openrouter": {"*": {"rpm": 20, "tpm": None}},
+    "puter": {"*": {"rpm": 30, "tpm": None}},
+}
+
+# Attesa di default dopo un 429 senza indicazioni dal server
+DEFAULT_PENALTY_SEC = 5.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima grossolana dei token (~4 caratteri per token)."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Bucket con ricarica continua; le prenotazioni possono andare in debito.
+
+    Il debito rende l'attesa FIFO: chi prenota dopo aspetta anche la quota
+    già impegnata da chi è in coda prima di lui.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.refill_per_sec = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_sec)
+            self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Impegna `amount` unità e restituisce i secondi da attendere."""
+        self._refill(now)
+        # Una richiesta più grande del bucket passa comunque, a bucket pieno
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_per_sec
+
+    def adjust(self, delta: float, now: float) -> None:
+        """Corregge il saldo (es. token reali diversi dalla stima)."""
+        self._refill(now)
+        self.tokens = max(-self.capacity, min(self.capacity, self.tokens - delta))
+
+    def drain(self, now: float) -> None:
+        """Azzera il saldo positivo (il server ha segnalato quota esaurita)."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """Limiti RPM/TPM di una singola coppia provider/modello."""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None, name: str = ""):
+        self.name = name
+        self.rpm_bucket = TokenBucket(rpm) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "wait_sec": 0.0, "rate_limited": 0}
+
+    def reserve(self, tokens: int = 1) -> float:
+        """Prenota una richiesta da `tokens` token; restituisce i secondi di attesa."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.rpm_bucket:
+                wait = max(wait, self.rpm_bucket.reserve(1, now))
+            if self.tpm_bucket:
+                wait = max(wait, self.tpm_bucket.reserve(tokens, now))
+            self.stats["requests"] += 1
+            first_block = wait > 0 and self.stats["throttled"] == 0
+            if wait > 0:
+                self.stats["throttled"] += 1
+                self.stats["wait_sec"] += wait
+        if first_block:
+            # Solo la prima volta: un limite troppo basso si nota senza riempire il log
+            label = self.name or "anonimo"
+            print(f"🐢 Rate limiter {label}: prima attesa di {wait:.1f}s ({self._limits_label()})")
+        return wait
+
+    def _limits_label(self) -> str:
+        rpm = f"{self.rpm_bucket.capacity:.0f} rpm" if self.rpm_bucket else "rpm illimitati"
+        tpm = f"{self.tpm_bucket.capacity:.0f} tpm" if self.tpm_bucket else "tpm illimitati"
+        return f"{rpm}, {tpm}"
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Come reserve, ma attende (bloccando il thread) il tempo necessario."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, tokens: int = 1) -> float:
+        """Variante asyncio di acquire."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        """Allinea il bucket TPM ai token effettivamente consumati."""
+        if not self.tpm_bucket or not actual:
+            return
+        with self._lock:
+            self.tpm_bucket.adjust(actual - estimated, time.monotonic())
+
+    def penalize(self, retry_after: Optional[float]) -> None:
+        """Blocca il modello dopo un 429, per Retry-After secondi se noto."""
+        delay = retry_after if retry_after is not None else DEFAULT_PENALTY_SEC
+        with self._lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + delay)
+            if self.rpm_bucket:
+                self.rpm_bucket.drain(now)
+            self.stats["rate_limited"] += 1
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_overrides: Dict[str, Dict[str, Dict[str, Optional[int]]]] = {}
+_registry_lock = threading.Lock()
+
+
+def _enabled() -> bool:
+    return os.getenv("AI_RATE_LIMIT", "true").lower() == "true"
+
+
+def _env_limits() -> Dict[str, Any]:
+    raw = os.getenv("AI_RATE_LIMITS")
+    if not raw:
+        return {}
+    if raw.strip().lower() == "free_tier":
+        return FREE_TIER_LIMITS
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        print("⚠️ AI_RATE_LIMITS non è un JSON valido, ignorato.")
+        return {}
+
+
+def _resolve_limits(provider: str, model: str) -> Dict[str, Optional[int]]:
+    """Limiti effettivi: override runtime > env, modello > "*"; nessuno se non configurati."""
+    for source in (_overrides, _env_limits()):
+        models = source.get(provider)
+        if not models:
+            continue
+        if model in models:
+            return models[model]
+        if "*" in models:
+            return models["*"]
+    return {}
+
+
+def configure_rate_limit(
+    provider: str, model: str = "*", rpm: Optional[int] = None, tpm: Optional[int] = None
+) -> None:
+    """Imposta (o rimuove, con rpm=tpm=None) i limiti di un provider/modello."""
+    with _registry_lock:
+        _overrides.setdefault(provider, {})[model] = {"rpm": rpm, "tpm": tpm}
+        # I limiter già creati vanno ricostruiti con i nuovi valori
+        for key in [k for k in _limiters if k[0] == provider and (model == "*" or k[1] == model)]:
+            del _limiters[key]
+
+
+def get_limiter(provider: str, model: str) -> Optional[RateLimiter]:
+    """Limiter condiviso per provider/modello, None se non ci sono limiti."""
+    if not _enabled():
+        return None
+    key = (provider, model or "")
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _registry_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limits = _resolve_limits(provider, model or "")
+                limiter = RateLimiter(limits.get("rpm"), limits.get("tpm"), f"{provider}/{model}")
+                _limiters[key] = limiter
+    if (
+        limiter.rpm_bucket is None
+        and limiter.tpm_bucket is None
+        and limiter.blocked_until <= time.monotonic()
+    ):
+        return None
+    return limiter
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Estrae il ritardo suggerito dal server da un'eccezione SDK, se presente.
+
+    Controlla gli header retry-after-ms / retry-after della risposta HTTP
+    (OpenAI, Groq, genai) e il retryDelay / "retry in Xs" dei messaggi Gemini.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            value = headers.get("retry-after-ms")
+            if value is not None:
+                return max(0.0, float(value) / 1000.0)
+        except (TypeError, ValueError):
+            pass
+        value = headers.get("retry-after")
+        if value is not None:
+            parsed = _parse_retry_after(str(value))
+            if parsed is not None:
+                return parsed
+
+    text = str(error)
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", text)
+    if not match:
+        match = re.search(r"retry in (\d+(?:\.\d+)?)\s*s", text, re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True se l'eccezione rappresenta un 429 / quota esaurita."""
+    for attr in ("status_code", "code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return True
+    return "RESOURCE_EXHAUSTED" in str(error)
+
+
+def note_rate_limited(provider: str, model: str, error: Exception) -> None:
+    """Da chiamare quando un 429 arriva comunque: blocca il modello per tutti."""
+    retry_after = retry_after_seconds(error)
+    key = (provider, model or "")
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = _resolve_limits(provider, model or "")
+            limiter = RateLimiter(limits.get("rpm"), limits.get("tpm"), f"{provider}/{model}")
+            _limiters[key] = limiter
+    limiter.penalize(retry_after)
+    wait = f"{retry_after:.1f}s" if retry_after is not None else f"{DEFAULT_PENALTY_SEC:.0f}s (default)"
+    print(f"⏸️ Rate limit {provider}/{model}: pausa {wait}")
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """Statistiche per limiter: richieste, attese, 429 ricevuti."""
+    with _registry_lock:
+        items = list(_limiters.items())
+    return {f"{provider}/{model}": dict(limiter.stats) for (provider, model), limiter in items}
@@ -0,0 +1,131 @@
+"""Cassette di risposte registrate per il provider "replay".
+
+Per misurare BankImporter o TraderAgent end-to-end senza consumare quota e
+senza il jitter della rete, le risposte reali vengono registrate una volta
+(testo, latenza, TTFT e tempi dei chunk di streaming) in un file JSONL e
+poi riprodotte in modo deterministico, alla velocità registrata o istantaneamente.
+
+Configurazione (AIProvider(provider_type="replay")):
+    AI_REPLAY_CASSETTE  file JSONL (default AI_CACHE_DIR/cassette.jsonl)
+    AI_REPLAY_MODE      replay (default, errore se manca la risposta),
+                        record (chiama sempre il provider reale e registra),
+                        auto (riproduce se presente, altrimenti registra)
+    AI_REPLAY_PROVIDER  provider reale usato in registrazione (default gemini)
+    AI_REPLAY_SPEED     1 = velocità registrata, 0 = istantaneo, 2 = doppia velocità
+
+La chiave di una richiesta dipende solo da json_mode e prompt (non dal
+modello): più registrazioni dello stesso prompt vengono riprodotte in ordine,
+ricominciando dalla prima.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .response_cache import DEFAULT_CACHE_DIR, make_cache_key
+
+REPLAY = "replay"
+RECORD = "record"
+AUTO = "auto"
+
+
+def replay_mode() -> str:
+    mode = os.getenv("AI_REPLAY_MODE", REPLAY).lower()
+    if mode not in (REPLAY, RECORD, AUTO):
+        raise ValueError(f"AI_REPLAY_MODE non valido: {mode} (replay|record|auto)")
+    return mode
+
+
+def replay_speed() -> float:
+    return float(os.getenv("AI_REPLAY_SPEED", "1"))
+
+
+def replay_delay(seconds: Optional[float]) -> float:
+    """Attesa da applicare in riproduzione per un intervallo registrato."""
+    speed = replay_speed()
+    return (seconds or 0.0) / speed if speed > 0 else 0.0
+
+
+def replay_key(json_mode: bool, prompt) -> str:
+    return make_cache_key(REPLAY, "", json_mode, prompt)
+
+
+class Cassette:
+    """Risposte registrate, indicizzate per chiave; append su file JSONL."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self.stats = {"replayed": 0, "recorded": 0, "missing": 0}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
+
+    def next(self, key: str) -> Optional[dict]:
+        """Prossima registrazione per la chiave (in ordine, poi ricomincia); None se assente."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["missing"] += 1
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = (index + 1) % len(entries)
+            self.stats["replayed"] += 1
+            return entries[index]
+
+    def record(self, entry: dict) -> None:
+        """Aggiunge una registrazione (in memoria e in coda al file)."""
+        entry.setdefault("recorded_at", time.time())
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._entries.setdefault(entry["key"], []).append(entry)
+            self.stats["recorded"] += 1
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "path": self.path,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+            }
+
+
+_cassettes: Dict[str, Cassette] = {}
+_lock = threading.Lock()
+
+
+def default_cassette_path() -> str:
+    return os.getenv(
+        "AI_REPLAY_CASSETTE",
+        os.path.join(os.getenv("AI_CACHE_DIR", DEFAULT_CACHE_DIR), "cassette.jsonl"),
+    )
+
+
+def get_cassette(path: Optional[str] = None) -> Cassette:
+    """Cassette condivisa dal processo per il file `path`."""
+    path = os.path.abspath(path or default_cassette_path())
+    with _lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = Cassette(path)
+            _cassettes[path] = cassette
+        return cassette
@@ -0,0 +1,256 @@
+"""Cache persistente su disco per le risposte dei modelli AI.
+
+Le risposte sono indicizzate per contenuto: provider, modello, json_mode,
+impronta della API key e hash SHA-256 del prompt normalizzato (inclusi i
+byte degli allegati multimodali e le opzioni pages/max_chars dei PDF). Lo storage è un database SQLite in modalità WAL, quindi più
+processi (es. sessioni Streamlit diverse) possono condividere la stessa cache.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/custom_agents")
+DEFAULT_TTL_SEC = 24 * 3600
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Chiavi opzionali di una parte multimodale che cambiano il testo inviato al modello
+PART_OPTIONS = ("pages", "max_chars")
+
+
+def _normalize_text(text: str) -> str:
+    """Normalizza fine riga e spazi finali per evitare miss su prompt equivalenti."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+
+def make_cache_key(
+    provider: str, model: str, json_mode: bool, prompt: Any, api_key: Optional[str] = None
+) -> str:
+    """Calcola la chiave di cache (hex SHA-256) per una richiesta.
+
+    Ogni parte del prompt è preceduta da tipo e lunghezza, così parti
+    diverse non possono collidere per semplice concatenazione. La API key
+    entra nella chiave solo come hash: account diversi non condividono
+    risposte e la chiave in chiaro non finisce su disco.
+
+    Un "pages" non indicizzabile (es. un generatore) viene convertito in
+    tupla nella parte stessa, così l'estrazione del PDF che segue legge le
+    stesse pagine invece di un iteratore già consumato.
+    """
+    digest = hashlib.sha256()
+    account = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+    header = json.dumps([provider or "", model or "", bool(json_mode), account])
+    digest.update(header.encode("utf-8"))
+
+    parts = prompt if isinstance(prompt, list) else [prompt]
+    for part in parts:
+        if isinstance(part, str):
+            payload = _normalize_text(part).encode("utf-8")
+            digest.update(f"T{len(payload)}:".encode("ascii"))
+            digest.update(payload)
+        elif isinstance(part, dict) and "mime_type" in part and "data" in part:
+            data = part["data"]
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            mime = str(part["mime_type"]).encode("utf-8")
+            digest.update(f"B{len(mime)}:".encode("ascii") + mime)
+            digest.update(hashlib.sha256(data).digest())
+            # Opzioni di estrazione PDF: stesso file con pagine o limite diversi = prompt diverso
+            pages = part.get("pages")
+            if pages is not None and not isinstance(pages, Sequence):
+                part["pages"] = tuple(pages)
+            options = {k: part[k] for k in PART_OPTIONS if part.get(k) is not None}
+            if options:
+                payload = json.dumps(
+                    {k: list(v) if k == "pages" else v for k, v in options.items()}, sort_keys=True
+                ).encode("utf-8")
+                digest.update(f"O{len(payload)}:".encode("ascii") + payload)
+        else:
+            payload = str(part).encode("utf-8")
+            digest.update(f"S{len(payload)}:".encode("ascii"))
+            digest.update(payload)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Cache chiave/valore su SQLite con TTL ed eviction LRU limitata in byte."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_sec: float = DEFAULT_TTL_SEC,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "responses.sqlite3")
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " provider TEXT,"
+                " model TEXT,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL,"
+                " hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connessione dedicata al thread corrente (sqlite3 non è thread-safe)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _bump(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key: str) -> Optional[str]:
+        """Restituisce il valore in cache oppure None (miss o scaduto)."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._bump("misses")
+                return None
+            value, created = row
+            if self.ttl_sec and now - created > self.ttl_sec:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bump("expired")
+                self._bump("misses")
+                return None
+            conn.execute(
+                "UPDATE responses SET accessed = ?, hits = hits + 1 WHERE key = ?",
+                (now, key),
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ Response cache non disponibile: {e}")
+            self._bump("misses")
+            return None
+        self._bump("hits")
+        return value
+
+    def set(self, key: str, value: str, provider: str = "", model: str = "") -> None:
+        """Salva un valore e applica l'eviction LRU se si supera max_bytes."""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses"
+                    " (key, provider, model, value, size, created, accessed, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, provider, model, value, size, now, now),
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"⚠️ Impossibile salvare in response cache: {e}")
+            return
+        self._bump("stores")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Rimuove le voci scadute e poi le meno usate di recente oltre il limite."""
+        if self.ttl_sec:
+            cur = conn.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl_sec,)
+            )
+            if cur.rowcount > 0:
+                self._bump("expired", cur.rowcount)
+
+        if not self.max_bytes:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Scendiamo al 90% del limite per non ripetere l'eviction ad ogni scrittura
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        if evicted:
+            self._bump("evictions", evicted)
+
+    def clear(self) -> None:
+        """Svuota completamente la cache."""
+        conn = self._conn()
+        conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche hit/miss del processo corrente più dimensione su disco."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        try:
+            entries, total = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            snapshot["entries"] = entries
+            snapshot["size_bytes"] = total
+        except sqlite3.Error:
+            snapshot["entries"] = None
+            snapshot["size_bytes"] = None
+        snapshot["path"] = self.path
+        return snapshot
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> ResponseCache:
+    """Istanza di cache condivisa dal processo, configurabile via env.
+
+    AI_CACHE_DIR, AI_CACHE_TTL (secondi) e AI_CACHE_MAX_MB.
+    """
+    global _default_cache  # pylint: disable=global-statement
+    with _default_cache_lock:
+        if _default_cache is None:
+            cache_dir = os.getenv("AI_CACHE_DIR", DEFAULT_CACHE_DIR)
+            ttl = float(os.getenv("AI_CACHE_TTL", str(DEFAULT_TTL_SEC)))
+            max_mb = float(os.getenv("AI_CACHE_MAX_MB", str(DEFAULT_MAX_BYTES // (1024 * 1024))))
+            _default_cache = ResponseCache(
+                path=os.path.join(cache_dir, "responses.sqlite3"),
+                ttl_sec=ttl,
+                max_bytes=int(max_mb * 1024 * 1024),
+            )
+        return _default_cache
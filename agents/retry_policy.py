@@ -0,0 +1,407 @@
+"""Politica di retry condivisa da tutti i wrapper.
+
+Gli errori transitori (429, 5xx, timeout, connessione rifiutata o chiusa)
+vengono ritentati con backoff esponenziale "full jitter": attesa casuale in
+[0, min(max_delay, base_delay * 2^tentativo)], così i client che falliscono
+insieme non ritornano insieme. Se il server indica Retry-After si aspetta
+quello (più un piccolo jitter); oltre max_retry_after si rinuncia subito.
+Gli stream vengono ritentati solo se falliscono prima del primo chunk:
+dopo, il testo è già arrivato al chiamante.
+
+Ogni tentativo fallito che viene ritentato è registrato nelle metriche
+(richiesta + errore, con la latenza del solo tentativo); il tentativo finale
+lo registra il wrapper partendo da AttemptClock.started.
+
+Un retry budget per provider limita i tentativi ripetuti a una frazione
+delle richieste dell'ultimo minuto (più un minimo fisso): durante un
+disservizio prolungato i retry non moltiplicano il carico.
+
+Configurazione:
+    AI_RETRY               false = un solo tentativo
+    AI_RETRY_MAX_ATTEMPTS  tentativi totali per richiesta (default 4)
+    AI_RETRY_BASE_DELAY    secondi (default 0.5)
+    AI_RETRY_MAX_DELAY     tetto del backoff (default 20)
+    AI_RETRY_MAX_WAIT      Retry-After massimo accettato (default 60)
+    AI_RETRY_BUDGET        retry / richieste nell'ultimo minuto (default 0.2)
+    AI_RETRY_BUDGET_MIN    retry sempre concessi al minuto (default 10)
+
+set_retry_policy(provider, policy) sostituisce la politica di un provider,
+ad esempio con una sottoclasse di RetryPolicy che ridefinisce classify().
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from .metrics import get_metrics
+from .rate_limiter import is_rate_limit_error, retry_after_seconds
+
+# Status HTTP transitori (408 timeout, 409 conflitto di lock, 425/429 troppo presto, 5xx, 529 overloaded)
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Eccezioni transitorie per SDK, confrontate per nome sulla MRO (gli SDK non vengono importati)
+TRANSIENT_ERRORS = {
+    "openai": ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"),
+    "groq": ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"),
+    "gemini": (
+        "ServerError",
+        "ResourceExhausted",
+        "ServiceUnavailable",
+        "InternalServerError",
+        "DeadlineExceeded",
+        "TooManyRequests",
+    ),
+    # ollama e gli stream degli altri SDK espongono direttamente gli errori di httpx
+    "httpx": (
+        "ConnectError",
+        "ConnectTimeout",
+        "ReadTimeout",
+        "WriteTimeout",
+        "PoolTimeout",
+        "ReadError",
+        "RemoteProtocolError",
+    ),
+    "builtin": ("ConnectionError", "TimeoutError"),
+}
+_TRANSIENT_NAMES = frozenset(name for names in TRANSIENT_ERRORS.values() for name in names)
+
+BUDGET_WINDOW_SEC = 60.0
+
+
+def _causes(error: BaseException) -> Iterator[BaseException]:
+    """L'eccezione e quelle che l'hanno causata (i wrapper rilanciano RuntimeError from e)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status(error: BaseException) -> Optional[int]:
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    value = getattr(getattr(error, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """"rate_limit", "server" o "connection" se l'errore è transitorio, altrimenti None.
+
+    Uno status HTTP esplicito decide da solo (un 400 o 401 non si ritenta).
+    """
+    for cause in _causes(error):
+        status = _status(cause)
+        if status is not None:
+            if status == 429:
+                return "rate_limit"
+            return "server" if status in RETRYABLE_STATUS else None
+        if is_rate_limit_error(cause):
+            return "rate_limit"
+        names = {cls.__name__ for cls in type(cause).__mro__}
+        if names & _TRANSIENT_NAMES:
+            return "connection"
+    return None
+
+
+def suggested_delay(error: BaseException) -> Optional[float]:
+    """Retry-After indicato dal server, anche se l'errore è stato rilanciato da un wrapper."""
+    for cause in _causes(error):
+        delay = retry_after_seconds(cause)
+        if delay is not None:
+            return delay
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """Numero di tentativi, backoff full jitter e classificazione degli errori."""
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    max_retry_after: float = 60.0
+
+    def classify(self, error: BaseException) -> Optional[str]:
+        return classify_error(error)
+
+    def backoff(self, attempt: int) -> float:
+        """Attesa full jitter dopo il tentativo `attempt` (0 = primo)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2**attempt)))
+
+    def delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Secondi prima del prossimo tentativo, None se l'errore non va ritentato."""
+        if attempt + 1 >= self.max_attempts or self.classify(error) is None:
+            return None
+        retry_after = suggested_delay(error)
+        if retry_after is None:
+            return self.backoff(attempt)
+        if retry_after > self.max_retry_after:
+            return None
+        return retry_after + random.uniform(0, self.base_delay)
+
+
+class RetryBudget:
+    """Retry concessi: min_retries + ratio * richieste nella finestra (scorrevole)."""
+
+    def __init__(self, ratio: float, min_retries: int, window: float = BUDGET_WINDOW_SEC):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float) -> None:
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """Prenota un retry; False se il budget della finestra è esaurito."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+def retry_enabled() -> bool:
+    return os.getenv("AI_RETRY", "true").lower() == "true"
+
+
+def _default_policy() -> RetryPolicy:
+    if not retry_enabled():
+        return RetryPolicy(max_attempts=1)
+    return RetryPolicy(
+        max_attempts=int(os.getenv("AI_RETRY_MAX_ATTEMPTS", "4")),
+        base_delay=float(os.getenv("AI_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("AI_RETRY_MAX_DELAY", "20")),
+        max_retry_after=float(os.getenv("AI_RETRY_MAX_WAIT", "60")),
+    )
+
+
+_policies: Dict[str, RetryPolicy] = {}
+_budgets: Dict[str, RetryBudget] = {}
+_stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def set_retry_policy(provider: str, policy: Optional[RetryPolicy]) -> None:
+    """Politica dedicata a un provider (None torna a quella da variabili d'ambiente)."""
+    with _lock:
+        if policy is None:
+            _policies.pop(provider, None)
+        else:
+            _policies[provider] = policy
+
+
+def get_retry_policy(provider: str) -> RetryPolicy:
+    with _lock:
+        policy = _policies.get(provider)
+    return policy or _default_policy()
+
+
+def get_retry_budget(provider: str) -> RetryBudget:
+    """Budget condiviso dal processo per il provider."""
+    with _lock:
+        budget = _budgets.get(provider)
+        if budget is None:
+            budget = RetryBudget(
+                float(os.getenv("AI_RETRY_BUDGET", "0.2")),
+                int(os.getenv("AI_RETRY_BUDGET_MIN", "10")),
+            )
+            _budgets[provider] = budget
+        return budget
+
+
+def _count(provider: str, model: str, field: str, value: float = 1) -> None:
+    with _lock:
+        stats = _stats.setdefault(
+            (provider, model or ""),
+            {"retries": 0, "gave_up": 0, "budget_exhausted": 0, "wait_sec": 0.0},
+        )
+        stats[field] += value
+
+
+class AttemptClock:
+    """Inizio del tentativo in corso, riavviato dai retry: latenze e metriche sono per tentativo."""
+
+    def __init__(self):
+        self.started = time.time()
+
+    def restart(self) -> None:
+        self.started = time.time()
+
+
+def _observe_retried(
+    provider: str, model: str, clock: AttemptClock, error: BaseException, stream: bool
+) -> None:
+    """Registra il tentativo fallito che sta per essere ritentato."""
+    metrics = get_metrics()
+    metrics.observe_request(provider, model, time.time() - clock.started, error=error, stream=stream)
+    metrics.record_retry(provider, model)
+
+
+def next_delay(provider: str, model: str, attempt: int, error: BaseException) -> Optional[float]:
+    """Attesa prima di ritentare dopo il tentativo `attempt` fallito, None per arrendersi.
+
+    Applica la politica del provider e ne consuma il retry budget.
+    """
+    policy = get_retry_policy(provider)
+    wait = policy.delay(attempt, error)
+    if wait is None:
+        if policy.max_attempts > 1 and policy.classify(error) is not None:
+            _count(provider, model, "gave_up")
+        return None
+    if not get_retry_budget(provider).try_spend():
+        _count(provider, model, "budget_exhausted")
+        print(f"⛔ Retry budget {provider} esaurito: nessun nuovo tentativo ({error})")
+        return None
+    _count(provider, model, "retries")
+    _count(provider, model, "wait_sec", wait)
+    print(
+        f"🔁 {provider}/{model}: {policy.classify(error)} ({str(error)[:120]}), "
+        f"tentativo {attempt + 2}/{policy.max_attempts} tra {wait:.1f}s"
+    )
+    return wait
+
+
+def call_with_retry(
+    provider: str,
+    model: str,
+    fn: Callable[[], Any],
+    on_retry: Optional[Callable[[Exception], None]] = None,
+    clock: Optional[AttemptClock] = None,
+) -> Tuple[Any, int]:
+    """Esegue fn() ritentando gli errori transitori; restituisce (risultato, retry eseguiti).
+
+    on_retry riceve ogni errore che verrà ritentato; l'ultimo errore viene rilanciato.
+    """
+    get_retry_budget(provider).record_request()
+    clock = clock or AttemptClock()
+    attempt = 0
+    while True:
+        clock.restart()
+        try:
+            return fn(), attempt
+        except Exception as e:
+            wait = next_delay(provider, model, attempt, e)
+            if wait is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            _observe_retried(provider, model, clock, e, stream=False)
+            attempt += 1
+            time.sleep(wait)
+
+
+async def acall_with_retry(
+    provider: str,
+    model: str,
+    afn: Callable[[], Awaitable[Any]],
+    on_retry: Optional[Callable[[Exception], None]] = None,
+    clock: Optional[AttemptClock] = None,
+) -> Tuple[Any, int]:
+    """Versione asyncio di call_with_retry."""
+    get_retry_budget(provider).record_request()
+    clock = clock or AttemptClock()
+    attempt = 0
+    while True:
+        clock.restart()
+        try:
+            return await afn(), attempt
+        except Exception as e:
+            wait = next_delay(provider, model, attempt, e)
+            if wait is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            _observe_retried(provider, model, clock, e, stream=False)
+            attempt += 1
+            await asyncio.sleep(wait)
+
+
+def retry_stream(
+    provider: str,
+    model: str,
+    open_stream: Callable[[], Iterable],
+    on_retry: Optional[Callable[[Exception], None]] = None,
+    clock: Optional[AttemptClock] = None,
+) -> Iterator:
+    """Itera lo stream aperto da open_stream(), riaprendolo se fallisce prima del primo chunk."""
+    get_retry_budget(provider).record_request()
+    clock = clock or AttemptClock()
+    attempt = 0
+    while True:
+        clock.restart()
+        try:
+            iterator = iter(open_stream())
+            first = next(iterator)
+            break
+        except StopIteration:
+            return
+        except Exception as e:
+            wait = next_delay(provider, model, attempt, e)
+            if wait is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            _observe_retried(provider, model, clock, e, stream=True)
+            attempt += 1
+            time.sleep(wait)
+    yield first
+    yield from iterator
+
+
+async def aretry_stream(
+    provider: str,
+    model: str,
+    open_stream: Callable[[], Awaitable[Any]],
+    on_retry: Optional[Callable[[Exception], None]] = None,
+    clock: Optional[AttemptClock] = None,
+) -> AsyncIterator:
+    """Versione asyncio di retry_stream: open_stream() è una coroutine che restituisce lo stream."""
+    get_retry_budget(provider).record_request()
+    clock = clock or AttemptClock()
+    attempt = 0
+    while True:
+        clock.restart()
+        try:
+            iterator = (await open_stream()).__aiter__()
+            first = await iterator.__anext__()
+            break
+        except StopAsyncIteration:
+            return
+        except Exception as e:
+            wait = next_delay(provider, model, attempt, e)
+            if wait is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            _observe_retried(provider, model, clock, e, stream=True)
+            attempt += 1
+            await asyncio.sleep(wait)
+    yield first
+    async for item in iterator:
+        yield item
+
+
+def retry_stats() -> Dict[str, Dict[str, float]]:
+    """Retry eseguiti, rinunce su errori transitori, budget esaurito e secondi di attesa."""
+    with _lock:
+        return {f"{provider}/{model}": dict(stats) for (provider, model), stats in _stats.items()}
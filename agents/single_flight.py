@@ -0,0 +1,130 @@
+"""Single-flight: richieste identiche in volo condividono una sola chiamata.
+
+Più sessioni Streamlit aprono spesso la stessa analisi nello stesso
+momento; senza coordinamento ognuna paga la propria chiamata LLM. Qui la
+prima richiesta per una chiave (leader) esegue la chiamata, le richieste
+identiche che arrivano mentre è in corso aspettano e ricevono lo stesso
+risultato (o la stessa eccezione). La chiave è quella della response cache.
+
+Le chiamate sincrone (thread) e quelle asyncio sono coordinate
+separatamente: le seconde per event loop. AI_SINGLE_FLIGHT=false disattiva
+il meccanismo.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict
+
+
+def single_flight_enabled() -> bool:
+    return os.getenv("AI_SINGLE_FLIGHT", "true").lower() == "true"
+
+
+class _Call:
+    """Chiamata sincrona in corso."""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Any = None
+
+
+class SingleFlight:
+    """Gruppo di chiamate indicizzate per chiave, con contatori per etichetta."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, list]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, label: str, field: str) -> None:
+        stats = self._stats.setdefault(label, {"leaders": 0, "coalesced": 0})
+        stats[field] += 1
+
+    def do(self, key: str, fn: Callable[[], Any], label: str = "") -> Any:
+        """Esegue fn() oppure, se la stessa chiave è già in volo, ne attende il risultato."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            self._count(label, "leaders" if leader else "coalesced")
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key: str, afn: Callable[[], Awaitable[Any]], label: str = "") -> Any:
+        """Versione asyncio di do: la chiamata gira in un task condiviso dalle richieste identiche.
+
+        Il task viene cancellato solo quando tutte le richieste in attesa sono state cancellate.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            tasks = self._tasks.setdefault(loop, {})
+            entry = tasks.get(key)
+            leader = entry is None
+            if leader:
+                task = loop.create_task(afn())
+                # [task, richieste in attesa]
+                entry = [task, 0]
+                tasks[key] = entry
+                task.add_done_callback(lambda _t: self._forget(tasks, key, entry))
+            entry[1] += 1
+            self._count(label, "leaders" if leader else "coalesced")
+
+        try:
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            with self._lock:
+                entry[1] -= 1
+                orphan = entry[1] == 0
+            if orphan:
+                entry[0].cancel()
+            raise
+
+    def _forget(self, tasks: dict, key: str, entry: list) -> None:
+        with self._lock:
+            if tasks.get(key) is entry:
+                del tasks[key]
+
+    def stats(self) -> dict:
+        """Chiamate eseguite (leaders) e richieste accodate (coalesced) per provider/modello."""
+        with self._lock:
+            by_label = {label: dict(counts) for label, counts in self._stats.items()}
+            in_flight = len(self._calls) + sum(len(tasks) for tasks in self._tasks.values())
+        return {
+            "leaders": sum(c["leaders"] for c in by_label.values()),
+            "coalesced": sum(c["coalesced"] for c in by_label.values()),
+            "in_flight": in_flight,
+            "by_model": by_label,
+        }
+
+
+_group = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Gruppo condiviso dal processo (tutte le istanze di AIProvider)."""
+    return _group
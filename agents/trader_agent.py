@@ -22,8 +22,19 @@ class TraderAgent:
     - Analyzing geopolitical risk
     """
 
-    def __init__(self, provider_type: str = "gemini", model_name: Optional[str] = None):
+    def __init__(
+        self,
+        provider_type: str = "gemini",
+        model_name: Optional[str] = None,
+        hedge: bool = False,
+        hedge_provider: Optional[AIProvider] = None,
+    ):
         self.ai = AIProvider(provider_type=provider_type, model_name=model_name)
+        # Hedging opzionale per i segnali sensibili alla latenza
+        # (analyze_market, suggest_option_strategy)
+        self.hedge = hedge
+        if hedge:
+            self.ai.enable_hedging(hedge_provider, default=False)
         self.knowledge = self._load_knowledge()
         # Backward-compat alias used by suggest_option_strategy prompt
         self.knowledge_base = self.knowledge.get("options", "")
@@ -229,7 +240,7 @@ class TraderAgent:
         prompt += rules
 
         try:
-            model = self.ai.get_model(json_mode=True)
+            model = self.ai.get_model(json_mode=True, hedged=self.hedge)
             response = model.generate_content(prompt)
             text = response.text.strip()
 
@@ -538,7 +549,7 @@ class TraderAgent:
         )
 
         try:
-            model = self.ai.get_model(json_mode=True)
+            model = self.ai.get_model(json_mode=True, hedged=self.hedge)
             response = model.generate_content(prompt)
             text = response.text.strip()
 
@@ -0,0 +1,125 @@
+"""Benchmark: latenza per chiamata con client creato ad ogni richiesta vs client dal pool.
+
+Di default avvia un finto endpoint OpenAI-compatible in locale (HTTP, niente TLS),
+quindi misura solo costruzione del client e setup della connessione. Per includere
+l'handshake TLS reale puntare a un servizio vero:
+
+    python benchmarks/bench_client_pool.py --base-url https://api.groq.com/openai/v1 \
+        --api-key $GROQ_API_KEY --model llama-3.1-8b-instant --calls 10
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import openai  # noqa: E402  pylint: disable=wrong-import-position
+
+from agents.client_pool import clear_pool, get_client  # noqa: E402  pylint: disable=wrong-import-position
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    """Risponde a /v1/chat/completions con una completion fissa."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Header e body partono in due write: senza NODELAY il keep-alive paga il delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(
+            {
+                "id": "bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "bench",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def _call(client, model: str) -> float:
+    start = time.perf_counter()
+    client.chat.completions.create(
+        model=model, messages=[{"role": "user", "content": "ping"}], max_tokens=1
+    )
+    return time.perf_counter() - start
+
+
+def _summary(label: str, samples: list) -> None:
+    ms = sorted(s * 1000 for s in samples)
+    p90 = ms[int(len(ms) * 0.9) - 1] if len(ms) >= 10 else ms[-1]
+    print(
+        f"{label:<22} mean {statistics.mean(ms):8.2f} ms | "
+        f"p50 {statistics.median(ms):8.2f} ms | p90 {p90:8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--api-key", default="bench")
+    parser.add_argument("--model", default="bench")
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    def fresh_client():
+        return openai.OpenAI(base_url=base_url, api_key=args.api_key)
+
+    # Prima: un client nuovo per ogni chiamata (comportamento precedente)
+    before = [_call(fresh_client(), args.model) for _ in range(args.calls)]
+
+    # Dopo: client condiviso dal pool, connessione in keep-alive
+    clear_pool()
+    pooled = get_client("bench", args.api_key, base_url, fresh_client)
+    _call(pooled, args.model)  # warm-up della connessione
+    after = [
+        _call(get_client("bench", args.api_key, base_url, fresh_client), args.model)
+        for _ in range(args.calls)
+    ]
+
+    print(f"Endpoint: {base_url} | {args.calls} chiamate per modalità")
+    _summary("client per chiamata", before)
+    _summary("client dal pool", after)
+    speedup = statistics.mean(before) / statistics.mean(after)
+    print(f"Speed-up medio: {speedup:.1f}x")
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark e guardia di regressione: tempo di import del package agents.
+
+Ogni misura gira in un interprete nuovo e riporta il tempo dell'import e
+quali SDK pesanti sono finiti in sys.modules. Con --check termina con
+codice 1 se `import agents` supera il budget o se un import leggero
+(package, knowledge_loader) carica uno degli SDK dei provider:
+
+    python benchmarks/bench_import_time.py --repeat 5 --check --budget 1.0
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Moduli che devono essere caricati solo quando servono
+HEAVY_MODULES = (
+    "google.genai",
+    "google.api_core",
+    "groq",
+    "openai",
+    "ollama",
+    "bs4",
+    "fitz",
+    "pandas",
+    "github",
+    "streamlit",
+    "pydantic",
+)
+
+# (etichetta, codice, deve restare leggero)
+TARGETS = (
+    ("import agents", "import agents", True),
+    ("agents.knowledge_loader", "from agents import knowledge_loader", True),
+    ("from agents import AIProvider", "from agents import AIProvider", True),
+    ("AIProvider('ollama')", "from agents import AIProvider; AIProvider(provider_type='ollama')", False),
+    (
+        "agents.ai_provider (tutti gli SDK)",
+        "import agents.ai_provider as m; m.genai.Client, m.types.Part, m.openai_lib.OpenAI, m.groq.Groq, m.ollama.chat",
+        False,
+    ),
+)
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+heavy = [m for m in sys.argv[2].split(",") if m in sys.modules]
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}))
+"""
+
+
+def measure(code: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT, AI_OLLAMA_PRELOAD="false")
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", _PROBE, code, ",".join(HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=ROOT,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="esce con 1 in caso di regressione")
+    parser.add_argument("--budget", type=float, default=1.0, help="secondi massimi per `import agents`")
+    args = parser.parse_args()
+
+    failures = []
+    for label, code, light in TARGETS:
+        runs = [measure(code) for _ in range(args.repeat)]
+        median = statistics.median(r["elapsed"] for r in runs)
+        heavy = sorted(set().union(*(r["heavy"] for r in runs)))
+        print(f"{label:<36} mediana {median * 1000:8.1f} ms   SDK caricati: {', '.join(heavy) or '-'}")
+        if light and heavy:
+            failures.append(f"{label} carica {', '.join(heavy)}")
+        if code == "import agents" and median > args.budget:
+            failures.append(f"import agents: {median:.2f}s > budget {args.budget:.2f}s")
+
+    if args.check:
+        for failure in failures:
+            print(f"❌ {failure}")
+        if failures:
+            sys.exit(1)
+        print("✅ Nessuna regressione")
+
+
+if __name__ == "__main__":
+    main()
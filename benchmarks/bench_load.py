@@ -0,0 +1,188 @@
+"""Load test dei wrapper OpenAI-compatible contro il finto endpoint locale.
+
+Per ogni wrapper (Groq, Puter, OpenRouter, LlamaCpp) invia --requests
+prompt distinti con --concurrency richieste in volo, attraverso
+AIProvider.get_model (stessa catena usata dall'app, senza response cache),
+e riporta throughput, latenza p50/p99 (e TTFT con --stream), errori e
+tentativi ripetuti visti dal server:
+
+    python benchmarks/bench_load.py --requests 200 --concurrency 16 \
+        --ttft lognormal:0.2,0.4 --tokens-per-sec 120 --output-tokens 32,128 \
+        --rate-429 0.05 --rate-5xx 0.02 --stream
+
+Il mock gira nel processo (vedi mock_openai_server.py per le opzioni); con
+--base-url si usa un mock già avviato. Il rate limiter client-side è spento
+salvo --rate-limit, per misurare il comportamento dei retry sui 429.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mock_openai_server import MockServer, add_mock_arguments, config_from_args  # noqa: E402  pylint: disable=wrong-import-position
+
+from agents.ai_provider import AIProvider, OpenRouterWrapper, PuterWrapper  # noqa: E402  pylint: disable=wrong-import-position
+from agents.batch import run_batch  # noqa: E402  pylint: disable=wrong-import-position
+
+WRAPPERS = ("groq", "puter", "openrouter", "llamacpp")
+
+
+def _point_at(provider_type: str, base_url: str) -> None:
+    """Reindirizza il provider sul mock (base_url = http://host:port)."""
+    if provider_type == "groq":
+        # L'SDK Groq aggiunge /openai/v1 al base URL
+        os.environ["GROQ_BASE_URL"] = base_url
+    elif provider_type == "puter":
+        PuterWrapper.PUTER_BASE_URL = f"{base_url}/v1/"
+    elif provider_type == "openrouter":
+        OpenRouterWrapper.OPENROUTER_BASE_URL = f"{base_url}/v1"
+    elif provider_type == "llamacpp":
+        parsed = urlparse(base_url)
+        AIProvider.LLAMACPP_HOST = parsed.hostname
+        AIProvider.LLAMACPP_PORT = parsed.port
+
+
+def _server_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/mock/stats", timeout=5) as r:
+        return json.loads(r.read())
+
+
+def _wrapper_retries(provider_type: str) -> int:
+    """Retry registrati dai wrapper nelle metriche (chiave "provider/modello")."""
+    return sum(
+        m["retries"] for key, m in AIProvider.metrics_snapshot().items() if key.startswith(f"{provider_type}/")
+    )
+
+
+def _percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _run(provider_type: str, base_url: str, args: argparse.Namespace) -> dict:
+    _point_at(provider_type, base_url)
+    provider = AIProvider(api_key="mock", provider_type=provider_type, model_name="mock", use_cache=False)
+    model = provider.get_model()
+    ttfts = []
+
+    def call(prompt: str):
+        if not args.stream:
+            return model.generate_content(prompt)
+        start = time.perf_counter()
+        first = None
+        parts = []
+        summaries = []
+        for chunk in model.generate_stream(prompt, on_complete=summaries.append):
+            if first is None:
+                first = time.perf_counter() - start
+            parts.append(chunk)
+        if summaries and summaries[-1].error:
+            raise RuntimeError(summaries[-1].error)
+        ttfts.append(first or 0.0)
+        return "".join(parts)
+
+    # Prompt distinti: il single-flight non deve unire le richieste
+    prompts = [f"[{provider_type} #{i}] Rispondi con un testo qualsiasi." for i in range(args.requests)]
+    before = _server_stats(base_url)
+    retries_before = _wrapper_retries(provider_type)
+    # I log per richiesta dei wrapper coprirebbero il riepilogo
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with quiet:
+        results = run_batch(call, prompts, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - start
+    after = _server_stats(base_url)
+
+    delta = {k: after[k] - before.get(k, 0) for k in after}
+    ok = [r for r in results if r.ok]
+    latencies = [r.latency_sec * 1000 for r in ok]
+    return {
+        "wrapper": provider_type,
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "elapsed": elapsed,
+        "rps": len(ok) / elapsed if elapsed else 0.0,
+        "tok_s": delta.get("output_tokens", 0) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p99": _percentile(latencies, 0.99) if latencies else 0.0,
+        "ttft_p50": statistics.median(ttfts) * 1000 if ttfts else None,
+        "attempts": delta.get("requests", 0),
+        "retried": delta.get("retried", 0),
+        "client_retries": _wrapper_retries(provider_type) - retries_before,
+        "injected": delta.get("injected_429", 0) + delta.get("injected_5xx", 0) + delta.get("dropped_streams", 0),
+        "sample_error": next((str(r.error)[:120] for r in results if not r.ok), None),
+    }
+
+
+def _report(row: dict, requests: int) -> None:
+    ttft = f" | TTFT p50 {row['ttft_p50']:7.1f} ms" if row["ttft_p50"] is not None else ""
+    print(
+        f"{row['wrapper']:<11} {row['ok']:>4}/{requests} ok | {row['rps']:6.1f} req/s | "
+        f"{row['tok_s']:7.0f} tok/s | p50 {row['p50']:7.1f} ms | p99 {row['p99']:7.1f} ms{ttft}"
+    )
+    print(
+        f"{'':<11} tentativi {row['attempts']} (ripetuti: {row['retried']} SDK, "
+        f"{row['client_retries']} wrapper) | guasti iniettati {row['injected']} | errori {row['errors']}"
+    )
+    if row["sample_error"]:
+        print(f"{'':<11} es. errore: {row['sample_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--wrappers", default=",".join(WRAPPERS), help="elenco separato da virgole")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="usa generate_stream e misura il TTFT")
+    parser.add_argument("--base-url", default=None, help="mock già avviato (http://host:port)")
+    parser.add_argument("--rate-limit", action="store_true", help="lascia attivo il rate limiter client-side")
+    parser.add_argument("--json", action="store_true", help="stampa i risultati anche in JSON")
+    parser.add_argument("--verbose", action="store_true", help="mostra i log dei wrapper")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AI_DEBUG", "false")
+    if not args.rate_limit:
+        os.environ["AI_RATE_LIMIT"] = "false"
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = MockServer(config_from_args(args))
+        base_url = server.start()
+    base_url = base_url.rstrip("/")
+
+    profile = (
+        f" | ttft {args.ttft}, {args.tokens_per_sec:g} tok/s, 429 {args.rate_429:.0%}, 5xx {args.rate_5xx:.0%}"
+        if server is not None
+        else ""
+    )
+    print(
+        f"Mock: {base_url} | {args.requests} richieste, concorrenza {args.concurrency}"
+        f"{', stream' if args.stream else ''}{profile}"
+    )
+    rows = []
+    for provider_type in [w.strip() for w in args.wrappers.split(",") if w.strip()]:
+        if provider_type not in WRAPPERS:
+            parser.error(f"wrapper sconosciuto: {provider_type} ({', '.join(WRAPPERS)})")
+        row = _run(provider_type, base_url, args)
+        rows.append(row)
+        _report(row, args.requests)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    if server is not None:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Benchmark: tempo di prefill di prompt di trading ripetuti con e senza riuso del prefisso.
+
+Tre prefissi di knowledge (opzioni, VPA, wheel) da ~16 KB ciascuno, seguiti
+da dati di mercato variabili, inviati in ordine casuale tramite
+LlamaCppWrapper in tre modalità:
+
+    cold     nessun cache_prompt (ogni richiesta rielabora tutto il prompt)
+    cache    cache_prompt, slot scelto dal server
+    pinned   cache_prompt + id_slot associato al prefisso (default del wrapper)
+
+Di default avvia un finto llama-server che simula gli slot e un costo di
+prefill proporzionale ai token non in cache (--ms-per-token); i tempi
+riportati sono quelli del campo "timings" della risposta. Con un server
+vero (avviato con --parallel N) la modalità cold non è disattivabile lato
+server nelle versioni recenti e va confrontata con cautela:
+
+    python benchmarks/bench_prefix_cache.py --port 8080 --requests 30
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from agents import prefix_cache  # noqa: E402  pylint: disable=wrong-import-position
+from agents.ai_provider import LlamaCppWrapper  # noqa: E402  pylint: disable=wrong-import-position
+
+CHARS_PER_TOKEN = 3.5
+
+
+class _SimulatedServer:
+    """Slot con il testo dell'ultimo prompt elaborato, come la KV cache di llama-server."""
+
+    def __init__(self, slots: int, ms_per_token: float):
+        self.slots = [""] * slots
+        self.last_used = [0.0] * slots
+        self.ms_per_token = ms_per_token
+        self.lock = threading.Lock()
+
+    def prefill(self, prompt: str, cache_prompt: bool, id_slot: int) -> dict:
+        with self.lock:
+            if 0 <= id_slot < len(self.slots):
+                slot = id_slot
+            else:
+                # Server senza scelta per similarità: lo slot usato meno di recente
+                slot = min(range(len(self.slots)), key=lambda i: self.last_used[i])
+            cached = prefix_cache.common_prefix_len(self.slots[slot], prompt) if cache_prompt else 0
+            self.slots[slot] = prompt
+            self.last_used[slot] = time.monotonic()
+        prompt_n = int((len(prompt) - cached) / CHARS_PER_TOKEN)
+        prompt_ms = prompt_n * self.ms_per_token
+        time.sleep(prompt_ms / 1000)
+        return {"prompt_n": prompt_n, "cache_n": int(cached / CHARS_PER_TOKEN), "prompt_ms": prompt_ms}
+
+
+def _handler(server: _SimulatedServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, payload: dict) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self._send(
+                {"total_slots": len(server.slots), "default_generation_settings": {"n_ctx": 131072}}
+            )
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            timings = server.prefill(
+                request["messages"][-1]["content"],
+                bool(request.get("cache_prompt")),
+                int(request.get("id_slot", -1)),
+            )
+            self._send(
+                {
+                    "id": "bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "bench",
+                    "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": "{}"}, "finish_reason": "stop"}
+                    ],
+                    "usage": {"prompt_tokens": timings["prompt_n"], "completion_tokens": 1, "total_tokens": 1},
+                    "timings": timings,
+                }
+            )
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+
+def build_prompts(count: int, seed: int) -> list:
+    """Prompt nello stile di TraderAgent: knowledge fissa + dati variabili."""
+    rng = random.Random(seed)
+    knowledge = {
+        name: "\n".join(f"{name.upper()} regola {i}: " + "principio operativo " * 8 for i in range(100))
+        for name in ("opzioni", "vpa", "wheel")
+    }
+    prompts = []
+    for _ in range(count):
+        name = rng.choice(list(knowledge))
+        ticker = rng.choice(["AAPL", "MSFT", "SPY", "QQQ", "NVDA", "TSLA"])
+        prompts.append(
+            f"Sei un trader esperto.\nI tuoi principi chiave sono basati su questa knowledge base:\n"
+            f"{knowledge[name]}\n\nDATI DI MERCATO:\n- Ticker: {ticker}\n"
+            f"- Prezzo: {rng.uniform(50, 500):.2f}\n- RSI: {rng.uniform(20, 80):.1f}\n"
+            f"Rispondi in JSON."
+        )
+    return prompts
+
+
+def run(mode: str, prompts: list, host: str, port: int) -> list:
+    os.environ["AI_LLAMACPP_PREFIX_CACHE"] = "false" if mode == "cold" else "true"
+    LlamaCppWrapper._props.clear()  # pylint: disable=protected-access
+    prefix_cache._pinners.clear()  # pylint: disable=protected-access
+    wrapper = LlamaCppWrapper("bench", host=host, port=port, json_mode=True)
+    if mode == "cache":
+        # Senza total_slots il wrapper non pinna: lo slot lo sceglie il server
+        props = dict(wrapper._server_props() or {})  # pylint: disable=protected-access
+        props.pop("total_slots", None)
+        LlamaCppWrapper._props[wrapper.server] = props  # pylint: disable=protected-access
+    samples = []
+    for prompt in prompts:
+        result = wrapper.generate_content(prompt)
+        timings = (result.raw.model_extra or {}).get("timings") or {}
+        samples.append(float(timings.get("prompt_ms", result.latency_sec * 1000)))
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="llama-server reale (0: server simulato)")
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--ms-per-token", type=float, default=0.2)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    port = args.port
+    if not port:
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), _handler(_SimulatedServer(args.slots, args.ms_per_token)))
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        port = httpd.server_port
+        print(f"llama-server simulato: {args.slots} slot, {args.ms_per_token} ms/token di prefill")
+
+    prompts = build_prompts(args.requests, args.seed)
+    print(f"{len(prompts)} prompt, ~{statistics.mean(len(p) for p in prompts) / 1024:.1f} KB ciascuno\n")
+
+    for mode in ("cold", "cache", "pinned"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = run(mode, prompts, args.host, port)
+        print(
+            f"{mode:<8} prefill totale {sum(samples):9.1f} ms | "
+            f"mediana {statistics.median(samples):7.1f} ms | max {max(samples):7.1f} ms"
+        )
+    print(f"\n{prefix_cache.prefix_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
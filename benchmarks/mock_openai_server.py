@@ -0,0 +1,309 @@
+"""Finto endpoint OpenAI-compatible per load test e fault injection.
+
+Serve POST .../chat/completions (anche /openai/v1/... come Groq), in
+streaming SSE o come risposta singola, più /v1/models, /health e /props
+(llama-server). Tempi e guasti sono configurabili:
+
+    python benchmarks/mock_openai_server.py --port 8099 \
+        --ttft lognormal:0.25,0.5 --tokens-per-sec 80 --output-tokens 64,256 \
+        --rate-429 0.05 --retry-after 1 --rate-5xx 0.02 --chunk-tokens 4
+
+Distribuzioni di --ttft: fixed:S, uniform:A,B, normal:MU,SIGMA,
+lognormal:MEDIANA,SIGMA, exp:MEDIA (secondi). La durata di una risposta è
+ttft + token_generati / tokens-per-sec; in streaming i chunk da
+--chunk-tokens token arrivano a quel ritmo. GET /mock/stats restituisce i
+contatori (richieste, tentativi ripetuti secondo l'header
+x-stainless-retry-count degli SDK, 429 e 5xx iniettati, stream interrotti).
+"""
+
+import argparse
+import json
+import math
+import random
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Tuple
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """"lognormal:0.25,0.5" -> funzione che campiona secondi (>= 0)."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    samplers = {
+        "fixed": lambda rng: values[0],
+        "uniform": lambda rng: rng.uniform(values[0], values[1]),
+        "normal": lambda rng: rng.gauss(values[0], values[1]),
+        "lognormal": lambda rng: values[0] * math.exp(rng.gauss(0.0, values[1])),
+        "exp": lambda rng: rng.expovariate(1.0 / values[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"distribuzione sconosciuta: {spec} ({', '.join(samplers)})")
+    sampler = samplers[kind]
+    return lambda rng: max(0.0, sampler(rng))
+
+
+def parse_range(spec: str) -> Tuple[int, int]:
+    """"64" -> (64, 64), "32,256" -> (32, 256)."""
+    parts = [int(v) for v in spec.split(",")]
+    return parts[0], parts[-1]
+
+
+@dataclass
+class MockConfig:
+    ttft: str = "fixed:0.05"
+    tokens_per_sec: float = 200.0
+    output_tokens: str = "32"
+    chunk_tokens: int = 1
+    rate_429: float = 0.0
+    retry_after: Optional[float] = 1.0
+    rate_5xx: float = 0.0
+    stream_drop: float = 0.0
+    seed: Optional[int] = None
+    vision: bool = False
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    retried: int = 0
+    streams: int = 0
+    completed: int = 0
+    injected_429: int = 0
+    injected_5xx: int = 0
+    dropped_streams: int = 0
+    output_tokens: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts) -> None:
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {k: v for k, v in self.__dict__.items() if k != "lock"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, payload: bytes) -> None:
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path == "/health":
+            self._json(200, {"status": "ok"})
+        elif self.path == "/props":
+            self._json(
+                200,
+                {
+                    "total_slots": 4,
+                    "default_generation_settings": {"n_ctx": 32768},
+                    "modalities": {"vision": self.server.config.vision},
+                },
+            )
+        elif self.path == "/mock/stats":
+            self._json(200, self.server.stats.snapshot())
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        server = self.server
+        config = server.config
+        retried = int(self.headers.get("x-stainless-retry-count", "0") or 0) > 0
+        server.stats.add(requests=1, retried=int(retried))
+
+        fault, ttft, tokens, drop = server.sample()
+        if fault == 429:
+            server.stats.add(injected_429=1)
+            headers = {"Retry-After": f"{config.retry_after:g}"} if config.retry_after is not None else {}
+            self._json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit"}}, headers)
+            return
+        if fault:
+            server.stats.add(injected_5xx=1)
+            self._json(fault, {"error": {"message": f"Mock server error {fault}", "type": "server_error"}})
+            return
+
+        model = request.get("model", "mock")
+        per_token = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+        time.sleep(ttft)
+        if request.get("stream"):
+            self._stream(model, tokens, per_token, drop)
+            return
+        time.sleep(tokens * per_token)
+        server.stats.add(completed=1, output_tokens=tokens)
+        self._json(
+            200,
+            {
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "tok " * tokens},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 16, "completion_tokens": tokens, "total_tokens": 16 + tokens},
+            },
+        )
+
+    def _stream(self, model: str, tokens: int, per_token: float, drop: bool) -> None:
+        server = self.server
+        server.stats.add(streams=1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, server.config.chunk_tokens)
+        sent = 0
+        while sent < tokens:
+            n = min(step, tokens - sent)
+            if sent:
+                time.sleep(n * per_token)
+            delta = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": "tok " * n}, "finish_reason": None}]}
+            self._chunk(f"data: {json.dumps(delta)}\n\n".encode("utf-8"))
+            sent += n
+            if drop:
+                # Connessione chiusa dopo il primo chunk, senza [DONE]
+                server.stats.add(dropped_streams=1)
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+        final = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "usage": {"prompt_tokens": 16, "completion_tokens": tokens, "total_tokens": 16 + tokens}}
+        self._chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+        server.stats.add(completed=1, output_tokens=tokens)
+
+
+class MockServer(ThreadingHTTPServer):
+    """Server in un thread daemon: start() restituisce l'URL base (http://host:port)."""
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self._ttft = parse_distribution(self.config.ttft)
+        self._tokens = parse_range(self.config.output_tokens)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def sample(self) -> Tuple[int, float, int, bool]:
+        """(errore iniettato o 0, ttft, token da generare, stream da interrompere)."""
+        config = self.config
+        with self._rng_lock:
+            roll = self._rng.random()
+            if roll < config.rate_429:
+                fault = 429
+            elif roll < config.rate_429 + config.rate_5xx:
+                fault = self._rng.choice((500, 502, 503))
+            else:
+                fault = 0
+            return (
+                fault,
+                self._ttft(self._rng),
+                self._rng.randint(*self._tokens),
+                self._rng.random() < config.stream_drop,
+            )
+
+    def handle_error(self, request, client_address):
+        # Client che chiudono la connessione (timeout, stream interrotti) non sono errori del mock
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> str:
+        threading.Thread(target=self.serve_forever, name="mock-openai", daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """Opzioni del mock condivise con bench_load.py."""
+    defaults = MockConfig()
+    parser.add_argument("--ttft", default=defaults.ttft, help="distribuzione del time-to-first-token")
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec)
+    parser.add_argument("--output-tokens", default=defaults.output_tokens, help="N oppure MIN,MAX")
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens, help="token per chunk SSE")
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="header Retry-After dei 429")
+    parser.add_argument("--rate-5xx", type=float, default=defaults.rate_5xx)
+    parser.add_argument("--stream-drop", type=float, default=defaults.stream_drop)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--vision", action="store_true", help="/props dichiara il supporto immagini")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens,
+        chunk_tokens=args.chunk_tokens,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after if args.retry_after >= 0 else None,
+        rate_5xx=args.rate_5xx,
+        stream_drop=args.stream_drop,
+        seed=args.seed,
+        vision=args.vision,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server = MockServer(config_from_args(args), args.host, args.port)
+    print(f"Mock OpenAI-compatible in ascolto su {server.url}/v1 (Ctrl+C per uscire)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -17,5 +17,6 @@ setup(
         "google-api-core",
         "groq",
         "openai",
+        "Pillow",
     ],
 )
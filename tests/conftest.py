@@ -0,0 +1,43 @@
+"""Fixture condivise dai test del pacchetto agents."""
+
+import os
+import sys
+import types
+
+import pytest
+
+# I test importano `agents` dalla radice del repository anche senza installazione
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class FakeClock:
+    """Orologio monotono controllato dal test."""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """Restituisce patch(modulo): sostituisce il `time` del modulo con un FakeClock.
+
+    Si sostituisce l'attributo del modulo, non il modulo time globale, così
+    thread e librerie continuano a usare l'orologio reale.
+    """
+    clock = FakeClock()
+
+    def patch(module):
+        fake = types.SimpleNamespace(monotonic=clock.monotonic, time=clock.time, sleep=lambda _s: None)
+        monkeypatch.setattr(module, "time", fake)
+        return clock
+
+    return patch
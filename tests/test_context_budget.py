@@ -0,0 +1,103 @@
+"""Stima dei token, num_ctx e overflow del prompt (context_budget)."""
+
+import pytest
+
+from agents.context_budget import (
+    DEFAULT_CONTEXT,
+    MIN_NUM_CTX,
+    NUM_CTX_STEP,
+    ContextOverflowError,
+    cached_context,
+    chars_per_token,
+    estimate_prompt_tokens,
+    family_context,
+    fit_prompt,
+    invalidate_context,
+    max_num_ctx,
+)
+
+
+@pytest.fixture(autouse=True)
+def _env(monkeypatch):
+    monkeypatch.delenv("AI_CONTEXT_OVERFLOW", raising=False)
+    monkeypatch.delenv("AI_MAX_NUM_CTX", raising=False)
+
+
+def test_specific_family_wins_over_generic():
+    assert family_context("llama3.1:8b") == 131072
+    assert family_context("llama3:8b") == 8192
+    assert family_context("sconosciuto") == DEFAULT_CONTEXT
+    assert chars_per_token("llama3.2") == 3.8
+    assert chars_per_token("llama2") == 3.3
+
+
+def test_estimate_grows_with_text_and_overestimates():
+    short = estimate_prompt_tokens("a" * 100, "qwen2.5")
+    long = estimate_prompt_tokens("a" * 1000, "qwen2.5")
+    assert short < long
+    assert long > 1000 / chars_per_token("qwen2.5")
+
+
+def test_num_ctx_sized_on_prompt():
+    budget = fit_prompt("ciao " * 2000, "qwen2.5", 32768)
+    assert budget.dropped_tokens == 0
+    assert budget.num_ctx % NUM_CTX_STEP == 0
+    assert MIN_NUM_CTX <= budget.num_ctx < 32768
+    assert budget.num_ctx >= budget.prompt_tokens
+
+
+def test_small_prompt_uses_min_num_ctx():
+    budget = fit_prompt("ciao", "qwen2.5", 32768)
+    assert budget.num_ctx == MIN_NUM_CTX
+    assert budget.text == "ciao"
+
+
+def test_num_ctx_never_exceeds_max_ctx():
+    budget = fit_prompt("ciao", "qwen2.5", 1024)
+    assert budget.num_ctx == 1024
+
+
+def test_overflow_trims_the_middle():
+    text = "ISTRUZIONI " + "knowledge " * 20000 + " FORMATO"
+    budget = fit_prompt(text, "qwen2.5", 4096, label="qwen2.5")
+    assert budget.dropped_tokens > 0
+    assert budget.num_ctx == 4096
+    assert budget.text.startswith("ISTRUZIONI")
+    assert budget.text.endswith("FORMATO")
+    assert "token omessi" in budget.text
+    assert budget.prompt_tokens <= 4096
+
+
+def test_refuse_policy_raises(monkeypatch):
+    monkeypatch.setenv("AI_CONTEXT_OVERFLOW", "refuse")
+    with pytest.raises(ContextOverflowError, match="4096"):
+        fit_prompt("x" * 100000, "qwen2.5", 4096)
+
+
+def test_max_num_ctx_from_env(monkeypatch):
+    assert max_num_ctx() == 32768
+    monkeypatch.setenv("AI_MAX_NUM_CTX", "8192")
+    assert max_num_ctx() == 8192
+
+
+def test_cached_context_looks_up_once():
+    calls = []
+
+    def lookup():
+        calls.append(1)
+        return 16384
+
+    assert cached_context("test", "once", lookup, 2048) == 16384
+    assert cached_context("test", "once", lookup, 2048) == 16384
+    assert len(calls) == 1
+
+
+def test_failed_lookup_is_not_cached():
+    assert cached_context("test", "retry", lambda: None, 2048) == 2048
+    assert cached_context("test", "retry", lambda: 8192, 2048) == 8192
+
+
+def test_invalidate_forces_new_lookup():
+    cached_context("test", "swap", lambda: 8192, 2048)
+    invalidate_context("test", "swap")
+    assert cached_context("test", "swap", lambda: 4096, 2048) == 4096
@@ -0,0 +1,171 @@
+"""Richieste hedged: ritardo dal p90, vincitore, errori e statistiche (hedging)."""
+
+import asyncio
+import threading
+import types
+
+import pytest
+
+from agents import hedging
+from agents.hedging import (
+    DEFAULT_HEDGE_DELAY_SEC,
+    MIN_SAMPLES,
+    arun_hedged,
+    hedge_delay,
+    hedge_stats,
+    is_valid_response,
+    run_hedged,
+)
+from agents.model_router import ModelRouter
+
+
+def _resp(text):
+    return types.SimpleNamespace(text=text)
+
+
+def _valid(response):
+    return is_valid_response(response, json_mode=False)
+
+
+@pytest.fixture
+def router(monkeypatch):
+    r = ModelRouter()
+    monkeypatch.setattr(hedging, "get_router", lambda: r)
+    return r
+
+
+def test_delay_defaults_without_samples(router):
+    router.record_success("gemini", "pro", 1.0)
+    assert hedge_delay("gemini", "pro") == DEFAULT_HEDGE_DELAY_SEC
+
+
+def test_delay_is_primary_p90(router):
+    for latency in range(1, 11):
+        router.record_success("gemini", "pro", float(latency))
+    assert MIN_SAMPLES <= 10
+    assert hedge_delay("gemini", "pro") == pytest.approx(9.0, abs=1.0)
+
+
+@pytest.mark.parametrize(
+    "text, json_mode, expected",
+    [
+        ("ciao", False, True),
+        ("   ", False, False),
+        ("❌ Errore", False, False),
+        ('{"a": 1}', True, True),
+        ('```json\n{"a": 1}\n```', True, True),
+        ("non json", True, False),
+    ],
+)
+def test_is_valid_response(text, json_mode, expected):
+    assert is_valid_response(_resp(text), json_mode) is expected
+
+
+def test_is_valid_response_without_text():
+    assert not is_valid_response(None, json_mode=False)
+
+
+def test_fast_primary_does_not_hedge():
+    calls = []
+
+    def secondary():
+        calls.append("secondary")
+        return _resp("riserva")
+
+    result = run_hedged(lambda: _resp("primario"), secondary, 5.0, _valid, "t/fast")
+    assert result.text == "primario"
+    assert calls == []
+    stats = hedge_stats()["t/fast"]
+    assert stats["requests"] == 1 and stats["hedged"] == 0 and stats["hedge_wins"] == 0
+
+
+def test_slow_primary_is_hedged_and_secondary_wins():
+    release = threading.Event()
+
+    def primary():
+        release.wait(5)
+        return _resp("primario")
+
+    try:
+        result = run_hedged(primary, lambda: _resp("riserva"), 0.01, _valid, "t/slow")
+    finally:
+        release.set()
+    assert result.text == "riserva"
+    stats = hedge_stats()["t/slow"]
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    assert stats["hedge_rate"] == 1.0
+
+
+def test_failing_primary_hedges_immediately():
+    def primary():
+        raise RuntimeError("500 boom")
+
+    # Il ritardo è lungo: la riserva parte perché il primario è fallito, non per timeout
+    result = run_hedged(primary, lambda: _resp("riserva"), 60.0, _valid, "t/fail")
+    assert result.text == "riserva"
+    assert hedge_stats()["t/fail"]["hedge_wins"] == 1
+
+
+def test_invalid_primary_response_hedges():
+    result = run_hedged(lambda: _resp("❌ Errore"), lambda: _resp("riserva"), 60.0, _valid, "t/invalid")
+    assert result.text == "riserva"
+
+
+def test_both_failing_raises_first_error():
+    def primary():
+        raise RuntimeError("primo")
+
+    def secondary():
+        raise RuntimeError("secondo")
+
+    with pytest.raises(RuntimeError, match="primo"):
+        run_hedged(primary, secondary, 60.0, _valid, "t/both")
+    assert hedge_stats()["t/both"]["failures"] == 1
+
+
+def test_without_secondary_error_propagates():
+    def primary():
+        raise RuntimeError("solo")
+
+    with pytest.raises(RuntimeError, match="solo"):
+        run_hedged(primary, None, 0.0, _valid, "t/none")
+    assert hedge_stats()["t/none"]["hedged"] == 0
+
+
+def test_async_secondary_wins_and_primary_is_cancelled():
+    cancelled = []
+
+    async def primary():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return _resp("primario")
+
+    async def secondary():
+        return _resp("riserva")
+
+    async def main():
+        result = await arun_hedged(primary, secondary, 0.01, _valid, "t/async", primary_estimate=2.0)
+        await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(main())
+    assert result.text == "riserva"
+    assert cancelled == [True]
+    stats = hedge_stats()["t/async"]
+    assert stats["hedge_wins"] == 1
+    assert 1.5 < stats["avg_latency_saved_sec"] <= 2.0
+
+
+def test_async_fast_primary_does_not_hedge():
+    async def primary():
+        return _resp("primario")
+
+    async def secondary():
+        raise AssertionError("la riserva non deve partire")
+
+    result = asyncio.run(arun_hedged(primary, secondary, 5.0, _valid, "t/async-fast"))
+    assert result.text == "primario"
+    assert hedge_stats()["t/async-fast"]["hedged"] == 0
@@ -0,0 +1,96 @@
+"""Ridimensionamento, ricodifica e cache delle immagini (image_prep)."""
+
+import io
+
+import pytest
+
+from agents import image_prep
+from agents.image_prep import image_limits, prepare_image, sniff_mime, supports_vision
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache(monkeypatch):
+    monkeypatch.delenv("AI_IMAGE_MAX_SIDE", raising=False)
+    monkeypatch.setattr(image_prep, "_cache", image_prep.OrderedDict())
+    monkeypatch.setattr(image_prep, "_cache_bytes", 0)
+    monkeypatch.setattr(image_prep, "_stats", dict.fromkeys(image_prep._stats, 0))  # pylint: disable=protected-access
+
+
+def _image(size, fmt="PNG", noisy=True, exif=None) -> bytes:
+    img = Image.new("RGB", size, (200, 30, 30))
+    if noisy:
+        img = Image.effect_noise(size, 80).convert("RGB")
+    out = io.BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    img.save(out, format=fmt, **kwargs)
+    return out.getvalue()
+
+
+def test_large_image_is_downscaled_to_the_provider_limit():
+    data = _image((1600, 800))
+    prepared = prepare_image(data, "gemini")
+    assert prepared.mime_type == "image/webp"
+    assert (prepared.width, prepared.height) == (1536, 768)
+    assert len(prepared.data) < len(data)
+
+
+def test_model_family_limit_wins_over_provider():
+    assert image_limits("ollama", "llava:13b") == (672, "JPEG")
+    assert image_limits("ollama", "llama3") == (1024, "JPEG")
+
+
+def test_env_override(monkeypatch):
+    monkeypatch.setenv("AI_IMAGE_MAX_SIDE", "256")
+    assert image_limits("gemini", "")[0] == 256
+
+
+def test_small_compact_image_is_sent_unchanged():
+    # Tinta unita: il PNG originale è già più piccolo di qualsiasi ricodifica
+    data = _image((200, 100), noisy=False)
+    prepared = prepare_image(data, "llamacpp")
+    assert prepared.data == data
+    assert prepared.mime_type == "image/png"
+    assert (prepared.width, prepared.height) == (200, 100)
+
+
+def test_rotated_image_is_reencoded_even_if_larger():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # ruotata di 90°
+    data = _image((200, 100), fmt="JPEG", noisy=False, exif=exif.tobytes())
+    prepared = prepare_image(data, "llamacpp")
+    assert (prepared.width, prepared.height) == (100, 200)
+    assert prepared.data != data
+
+
+def test_undecodable_bytes_pass_through():
+    prepared = prepare_image(b"not an image", "gemini")
+    assert prepared.data == b"not an image"
+    assert image_prep.image_cache_stats()["errors"] == 1
+
+
+def test_results_are_cached_by_content_and_limits():
+    data = _image((1100, 600))
+    first = prepare_image(data, "gemini")
+    assert prepare_image(data, "gemini") is first
+    prepare_image(data, "ollama")
+    stats = image_prep.image_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setenv("AI_IMAGE_CACHE_MB", "0.000001")
+    prepare_image(_image((600, 600)), "gemini")
+    stats = image_prep.image_cache_stats()
+    assert stats["entries"] == 0
+    assert stats["evictions"] == 1
+
+
+def test_sniff_mime_and_vision_hints():
+    assert sniff_mime(b"\x89PNG\r\n\x1a\n....") == "image/png"
+    assert sniff_mime(b"RIFF1234WEBPVP8 ") == "image/webp"
+    assert sniff_mime(b"??", default="x") == "x"
+    assert supports_vision("meta-llama/llama-4-scout")
+    assert not supports_vision("llama-3.3-70b-versatile")
@@ -0,0 +1,118 @@
+"""Parser JSON incrementale (json_stream)."""
+
+import asyncio
+import types
+
+import pytest
+
+from agents.ai_provider import AIProvider
+from agents.json_stream import JsonStreamParser, iter_json_items
+
+DOCUMENT = '```json\n{"mappings": [{"a": 1, "s": "x]}\\"y"}, {"b": [1, 2]}, {"c": null}], "n": 3}\n```'
+
+
+def _feed_chars(parser: JsonStreamParser, text: str) -> list:
+    items = []
+    for c in text:
+        items.extend(parser.feed(c))
+    return items
+
+
+def test_items_under_path_are_emitted_as_they_close():
+    parser = JsonStreamParser(("mappings",))
+    first = parser.feed('{"mappings": [{"a": 1}, {"b"')
+    assert first == [{"a": 1}]
+    assert parser.feed(': 2}]') == [{"b": 2}]
+    assert parser.feed("}") == []
+    assert parser.done
+    assert parser.items == 2
+
+
+def test_chunk_boundaries_and_strings_with_brackets():
+    parser = JsonStreamParser(("mappings",))
+    items = _feed_chars(parser, DOCUMENT)
+    assert items == [{"a": 1, "s": 'x]}"y'}, {"b": [1, 2]}, {"c": None}]
+    assert parser.result() == {"mappings": items, "n": 3}
+
+
+def test_root_array_literals_and_nested_values():
+    items = list(iter_json_items(["[1, tr", "ue, null, -2.5", ', "x", {"k": [1]}]'], ()))
+    assert items == [1, True, None, -2.5, "x", {"k": [1]}]
+
+
+def test_root_object_is_emitted_once_when_closed():
+    parser = JsonStreamParser()
+    assert parser.feed('{"a": {"b": 1}') == []
+    assert parser.feed("}") == [{"a": {"b": 1}}]
+    # Testo dopo la radice ignorato
+    assert parser.feed('{"c": 2}') == []
+
+
+def test_nested_path_only_emits_matching_array():
+    parser = JsonStreamParser(("outer", "inner"))
+    items = parser.feed('{"other": [1, 2], "outer": {"inner": [3, {"d": 4}]}}')
+    assert items == [3, {"d": 4}]
+
+
+def test_result_of_incomplete_stream_raises():
+    parser = JsonStreamParser(("mappings",))
+    parser.feed('{"mappings": [{"a": 1}')
+    with pytest.raises(ValueError, match="incompleto"):
+        parser.result()
+
+
+class _FakeStreamModel:
+    """Modello che emette chunk fissi e, come i wrapper, il messaggio d'errore come ultimo chunk."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def generate_stream(self, prompt, on_complete=None):
+        yield from self.chunks
+        if self.error:
+            yield f"❌ Errore Fake Stream: {self.error}"
+        if on_complete:
+            on_complete(types.SimpleNamespace(error=self.error))
+
+    async def agenerate_stream(self, prompt, on_complete=None):
+        for chunk in self.generate_stream(prompt, on_complete):
+            yield chunk
+
+
+def _provider(model):
+    provider = AIProvider.__new__(AIProvider)
+    provider.get_model = lambda json_mode=False: model
+
+    async def aget_model(json_mode=False):
+        return model
+
+    provider.aget_model = aget_model
+    return provider
+
+
+def test_stream_json_yields_items_and_the_document():
+    documents = []
+    model = _FakeStreamModel(['{"mappings": [{"a": 1}, ', '{"b": 2}', "]}"])
+    items = list(_provider(model).stream_json("p", path=("mappings",), on_complete=documents.append))
+    assert items == [{"a": 1}, {"b": 2}]
+    assert documents == [{"mappings": [{"a": 1}, {"b": 2}]}]
+
+
+def test_stream_json_reports_the_stream_error_not_a_parse_error():
+    model = _FakeStreamModel(['{"mappings": [{"a": 1}, '], error="503 overloaded")
+    items = []
+    with pytest.raises(RuntimeError, match="503 overloaded"):
+        for item in _provider(model).stream_json("p", path=("mappings",)):
+            items.append(item)
+    assert items == [{"a": 1}]
+
+
+def test_astream_json_reports_the_stream_error():
+    model = _FakeStreamModel(['{"mappings": [{"a": 1}'], error="timeout")
+
+    async def consume():
+        return [item async for item in _provider(model).astream_json("p", path=("mappings",))]
+
+    with pytest.raises(RuntimeError, match="timeout"):
+        asyncio.run(consume())
@@ -0,0 +1,120 @@
+"""Ciclo di vita del llama-server gestito (llamacpp_server), con processi finti."""
+
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from agents import llamacpp_server
+from agents.llamacpp_server import CRASHED, STOPPED, LlamaCppServer
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(60)"]
+CRASHER = [sys.executable, "-c", "import sys; sys.exit(3)"]
+# Come uno script che lancia llama-server in background ed esce con 0
+LAUNCHER = [sys.executable, "-c", "pass"]
+# Ignora SIGTERM: stop() deve passare a SIGKILL
+STUBBORN = [
+    sys.executable,
+    "-c",
+    "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "POLL_MIN_SEC", 0.05)
+    srv = LlamaCppServer("127.0.0.1", _free_port())
+    yield srv
+    srv.stop(timeout=2)
+
+
+def test_wait_ready_returns_at_once_when_the_server_crashes(server, monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "MAX_RESTARTS", 0)
+    server.start(CRASHER, model="m.gguf")
+    start = time.monotonic()
+    assert server.wait_ready(timeout=30) is False
+    assert time.monotonic() - start < 10
+    assert server.status()["state"] == CRASHED
+
+
+def test_crashed_server_is_restarted(server, monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "MAX_RESTARTS", 2)
+    server.start(CRASHER)
+    assert server.wait_ready(timeout=30) is False
+    status = server.status()
+    assert status["state"] == CRASHED
+    assert status["restarts"] == 2
+
+
+def test_clean_exit_waits_for_health_before_restarting(server, monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "POLL_MAX_SEC", 0.05)
+    monkeypatch.setenv("AI_LLAMACPP_STARTUP_GRACE", "0.5")
+    spawned = []
+    monkeypatch.setattr(llamacpp_server, "_spawn_listeners", [spawned.append])
+    server.start(LAUNCHER)
+    time.sleep(0.3)
+    assert server.is_starting()
+    assert len(spawned) == 1
+    time.sleep(1.0)
+    # Trascorso il periodo di grazia senza /health è un crash: riavvio
+    assert len(spawned) >= 2
+
+
+def test_ready_server_survives_isolated_health_misses(server, monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "_spawn_listeners", [])
+    monkeypatch.setattr(llamacpp_server, "MAX_RESTARTS", 0)
+    server.command = LAUNCHER
+    server.proc = subprocess.Popen(LAUNCHER)
+    server.proc.wait()
+    server.ready_at = time.time()
+    assert server._crash_confirmed_locked() is False  # pylint: disable=protected-access
+    assert server._crash_confirmed_locked() is False  # pylint: disable=protected-access
+    assert server._crash_confirmed_locked() is True  # pylint: disable=protected-access
+
+
+def test_spawn_listeners_run_on_every_start(server, monkeypatch):
+    monkeypatch.setattr(llamacpp_server, "_spawn_listeners", [])
+    seen = []
+    llamacpp_server.add_spawn_listener(seen.append)
+    llamacpp_server.add_spawn_listener(seen.append)
+    server.start(SLEEPER)
+    assert seen == [server.server]
+
+
+def test_stop_kills_the_process_group(server):
+    pid = server.start(SLEEPER)
+    assert server.is_starting()
+    server.stop(timeout=5)
+    assert server.status()["state"] == STOPPED
+    assert server.wait_ready(timeout=1) is False
+    with pytest.raises(ProcessLookupError):
+        llamacpp_server.os.killpg(pid, 0)
+
+
+def test_stop_escalates_to_sigkill(server):
+    server.start(STUBBORN)
+    time.sleep(0.3)  # il processo deve aver installato il gestore di SIGTERM
+    start = time.monotonic()
+    server.stop(timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert server.status()["state"] == STOPPED
+
+
+def test_stop_tolerates_a_vanished_group(server):
+    class Gone:
+        pid = 2**22 + 12345  # nessun gruppo con questo id
+
+        def wait(self, timeout):
+            raise subprocess.TimeoutExpired("llama-server", timeout)
+
+    server.proc = Gone()
+    server.stop(timeout=0.01)
+    assert server.status()["state"] == STOPPED
@@ -0,0 +1,121 @@
+"""Registro delle metriche e conteggio per tentativo (metrics)."""
+
+import types
+
+import pytest
+
+from agents import retry_policy
+from agents.metrics import MetricsRegistry, error_type, get_metrics
+from agents.retry_policy import RetryBudget, RetryPolicy, call_with_retry, retry_stream, set_retry_policy
+
+
+def _status_error(status: int) -> Exception:
+    error = Exception(f"HTTP {status}")
+    error.status_code = status
+    error.response = types.SimpleNamespace(status_code=status, headers={})
+    return error
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        (_status_error(429), "rate_limit"),
+        (_status_error(503), "http_503"),
+        (type("ReadTimeout", (Exception,), {})(), "timeout"),
+        (ValueError("x"), "ValueError"),
+    ],
+)
+def test_error_type(error, kind):
+    assert error_type(error) == kind
+
+
+def test_observe_request_counts_tokens_errors_and_latency(registry):
+    registry.observe_request("groq", "m", 0.3, input_tokens=10, output_tokens=5)
+    registry.observe_request("groq", "m", 4.0, error=_status_error(503), stream=True, ttft_sec=0.2)
+    snap = registry.snapshot()["groq/m"]
+    assert snap["requests"] == 2
+    assert snap["streams"] == 1
+    assert snap["errors"] == {"http_503": 1}
+    assert (snap["input_tokens"], snap["output_tokens"]) == (10, 5)
+    assert snap["latency_sec"]["count"] == 2
+    assert snap["latency_sec"]["buckets"]["0.5"] == 1
+    assert snap["latency_sec"]["buckets"]["+Inf"] == 2
+    assert snap["ttft_sec"]["count"] == 1
+
+
+def test_prometheus_text(registry):
+    registry.observe_request("llamacpp", 'q"1', 0.1)
+    registry.record_retry("llamacpp", 'q"1')
+    text = registry.to_prometheus()
+    assert "# TYPE ai_requests_total counter" in text
+    assert 'ai_requests_total{provider="llamacpp",model="q\\"1"} 1' in text
+    assert 'ai_retries_total{provider="llamacpp",model="q\\"1"} 1' in text
+    assert 'ai_request_latency_seconds_bucket{provider="llamacpp",model="q\\"1",le="+Inf"} 1' in text
+    assert text.endswith("\n")
+
+
+@pytest.fixture
+def fast_policy(monkeypatch):
+    provider = "test-metrics"
+    set_retry_policy(provider, RetryPolicy(max_attempts=3, base_delay=0.0))
+    monkeypatch.setitem(retry_policy._budgets, provider, RetryBudget(ratio=1.0, min_retries=100))  # pylint: disable=protected-access
+    get_metrics().reset()
+    yield provider
+    set_retry_policy(provider, None)
+    get_metrics().reset()
+
+
+def test_each_retried_attempt_is_a_request(fast_policy):
+    outcomes = [_status_error(503), _status_error(502), "ok"]
+
+    def fn():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    clock = retry_policy.AttemptClock()
+    assert call_with_retry(fast_policy, "m", fn, clock=clock) == ("ok", 2)
+    # Il tentativo finale lo registra il wrapper, partendo da clock.started
+    get_metrics().observe_request(fast_policy, "m", 0.01)
+    snap = get_metrics().snapshot()[f"{fast_policy}/m"]
+    assert snap["requests"] == 3
+    assert snap["retries"] == 2
+    assert snap["errors"] == {"http_503": 1, "http_502": 1}
+
+
+def test_retried_stream_opens_are_stream_requests(fast_policy):
+    attempts = []
+
+    def open_stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _status_error(503)
+        return iter(["a", "b"])
+
+    assert list(retry_stream(fast_policy, "m", open_stream)) == ["a", "b"]
+    snap = get_metrics().snapshot()[f"{fast_policy}/m"]
+    assert (snap["requests"], snap["streams"], snap["retries"]) == (1, 1, 1)
+
+
+def test_clock_marks_the_start_of_the_last_attempt(fast_policy, fake_clock):
+    clock_source = fake_clock(retry_policy)
+    outcomes = [_status_error(503), "ok"]
+
+    def fn():
+        clock_source.advance(5)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    clock = retry_policy.AttemptClock()
+    call_with_retry(fast_policy, "m", fn, clock=clock)
+    assert clock.started == clock_source.now - 5
+    # Il tentativo fallito è registrato con la sua sola latenza
+    assert get_metrics().snapshot()[f"{fast_policy}/m"]["latency_sec"]["sum"] == pytest.approx(5.0)
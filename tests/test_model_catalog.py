@@ -0,0 +1,91 @@
+"""Catalogo modelli stale-while-revalidate su disco (model_catalog)."""
+
+import json
+import threading
+import time
+
+import pytest
+
+from agents.model_catalog import ModelCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return ModelCatalog(path=str(tmp_path / "model_catalog.json"))
+
+
+def _wait_idle(catalog, key, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while catalog.is_refreshing(key) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not catalog.is_refreshing(key)
+
+
+def test_cold_cache_returns_default_without_waiting(catalog):
+    release = threading.Event()
+
+    def slow_fetch():
+        release.wait(5)
+        return ["a", "b"]
+
+    start = time.monotonic()
+    assert catalog.get("groq", slow_fetch, default=["fallback"]) == ["fallback"]
+    assert time.monotonic() - start < 0.5
+    assert catalog.is_refreshing("groq")
+    release.set()
+    _wait_idle(catalog, "groq")
+    # Il refresh in background è disponibile al rerun successivo
+    assert catalog.get("groq", slow_fetch, default=["fallback"]) == ["a", "b"]
+
+
+def test_explicit_wait_returns_the_first_fetch(catalog):
+    assert catalog.get("llamacpp", lambda: ["m.gguf"], wait=2) == ["m.gguf"]
+
+
+def test_stale_entry_is_served_and_refreshed_in_background(catalog):
+    catalog.get("groq", lambda: ["old"], wait=2)
+    assert catalog.get("groq", lambda: ["new"], ttl=-1) == ["old"]
+    _wait_idle(catalog, "groq")
+    assert catalog.get("groq", lambda: ["newer"]) == ["new"]
+    assert catalog.stats["stale"] == 1
+
+
+def test_failed_fetch_keeps_the_last_good_list(catalog):
+    catalog.get("groq", lambda: ["good"], wait=2)
+    catalog.invalidate("groq")
+
+    def broken():
+        raise RuntimeError("offline")
+
+    assert catalog.get("groq", broken) == ["good"]
+    _wait_idle(catalog, "groq")
+    assert catalog.get("groq", broken) == ["good"]
+    assert catalog.stats["failures"] == 1
+
+
+def test_entries_persist_across_instances(catalog):
+    catalog.get("ollama", lambda: ["llama3"], wait=2)
+    other = ModelCatalog(path=catalog.path)
+    assert other.get("ollama", lambda: ["x"]) == ["llama3"]
+
+
+def test_invalidated_key_is_not_restored_from_disk(catalog):
+    catalog.get("llamacpp", lambda: ["old.gguf"], wait=2)
+    catalog.invalidate("llamacpp")
+    # Un'altra scrittura (es. un'altra chiave) rilegge il file: la voce invalidata resta scaduta
+    catalog.get("groq", lambda: ["g"], wait=2)
+    with open(catalog.path, encoding="utf-8") as f:
+        assert json.load(f)["llamacpp"]["fetched_at"] == 0
+    assert catalog.get("llamacpp", lambda: ["new.gguf"]) == ["old.gguf"]
+    _wait_idle(catalog, "llamacpp")
+    assert catalog.get("llamacpp", lambda: ["x"]) == ["new.gguf"]
+
+
+def test_newer_entries_from_other_processes_are_merged(catalog):
+    catalog.get("groq", lambda: ["mine"], wait=2)
+    other = ModelCatalog(path=catalog.path)
+    other.invalidate("groq")
+    other.get("groq", lambda: ["theirs"])
+    _wait_idle(other, "groq")
+    catalog.get("ollama", lambda: ["o"], wait=2)
+    assert catalog.get("groq", lambda: ["x"]) == ["theirs"]
@@ -0,0 +1,164 @@
+"""Circuit breaker e scelta del modello (model_router)."""
+
+import pytest
+
+from agents import model_router
+from agents.model_router import (
+    BASE_COOLDOWN_SEC,
+    CLOSED,
+    FAILURE_THRESHOLD,
+    HALF_OPEN,
+    OPEN,
+    ModelRouter,
+)
+
+CHAIN = ["pro", "flash", "lite"]
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+
+@pytest.fixture
+def router(fake_clock):
+    clock = fake_clock(model_router)
+    r = ModelRouter()
+    r.clock = clock
+    return r
+
+
+def _state(router: ModelRouter, model: str) -> str:
+    return router.snapshot()[f"gemini/{model}"]["state"]
+
+
+def _fail(router: ModelRouter, model: str, times: int = 1) -> None:
+    for _ in range(times):
+        router.record_failure("gemini", model, RuntimeError("500 boom"))
+
+
+def test_prefers_first_healthy_model(router):
+    assert router.choose("gemini", CHAIN) == "pro"
+
+
+def test_opens_after_consecutive_failures(router):
+    _fail(router, "pro", FAILURE_THRESHOLD - 1)
+    assert _state(router, "pro") == CLOSED
+    _fail(router, "pro")
+    assert _state(router, "pro") == OPEN
+    assert not router.is_available("gemini", "pro")
+    assert router.choose("gemini", CHAIN) == "flash"
+
+
+def test_success_resets_consecutive_failures(router):
+    _fail(router, "pro", FAILURE_THRESHOLD - 1)
+    router.record_success("gemini", "pro", 0.5)
+    _fail(router, "pro", FAILURE_THRESHOLD - 1)
+    assert _state(router, "pro") == CLOSED
+
+
+def _trip_all_but_pro(router: ModelRouter) -> None:
+    """pro in half_open, gli altri in cooldown lungo: la prova è l'unica scelta sana."""
+    _fail(router, "pro", FAILURE_THRESHOLD)
+    for model in CHAIN[1:]:
+        router.record_failure("gemini", model, RuntimeError("busy"), cooldown=10 * BASE_COOLDOWN_SEC)
+    router.clock.advance(BASE_COOLDOWN_SEC + 1)
+
+
+def test_half_open_allows_a_single_probe(router):
+    _trip_all_but_pro(router)
+    assert _state(router, "pro") == HALF_OPEN
+    # claim=False consulta senza prenotare la prova
+    assert router.choose("gemini", CHAIN, claim=False) == "pro"
+    assert router.choose("gemini", CHAIN) == "pro"
+    # Prova in corso: nessun altro modello sano
+    assert router.choose("gemini", CHAIN, exclude={"none"}) is None
+
+
+def test_half_open_model_ranks_below_healthy_ones(router):
+    _fail(router, "pro", FAILURE_THRESHOLD)
+    router.clock.advance(BASE_COOLDOWN_SEC + 1)
+    assert _state(router, "pro") == HALF_OPEN
+    assert router.choose("gemini", CHAIN) == "flash"
+
+
+def test_probe_success_closes_the_circuit(router):
+    _trip_all_but_pro(router)
+    router.choose("gemini", CHAIN)
+    router.record_success("gemini", "pro", 0.4)
+    assert _state(router, "pro") == CLOSED
+    assert router.choose("gemini", CHAIN) == "pro"
+
+
+def test_probe_failure_reopens_with_doubled_cooldown(router):
+    _trip_all_but_pro(router)
+    router.choose("gemini", CHAIN)
+    _fail(router, "pro")
+    assert _state(router, "pro") == OPEN
+    remaining = router.snapshot()["gemini/pro"]["cooldown_remaining_sec"]
+    assert remaining == pytest.approx(2 * BASE_COOLDOWN_SEC)
+
+
+def test_unanswered_probe_expires(router):
+    _trip_all_but_pro(router)
+    router.choose("gemini", CHAIN)
+    router.clock.advance(model_router.PROBE_TIMEOUT_SEC + 1)
+    assert router.choose("gemini", CHAIN, exclude={"none"}) == "pro"
+
+
+def test_rate_limit_opens_immediately_for_retry_after(router):
+    error = _RateLimited("429 RESOURCE_EXHAUSTED {'retryDelay': '12s'}")
+    router.record_failure("gemini", "pro", error)
+    snapshot = router.snapshot()["gemini/pro"]
+    assert snapshot["state"] == OPEN
+    assert snapshot["rate_limited"] == 1
+    assert snapshot["cooldown_remaining_sec"] == pytest.approx(12)
+
+
+def test_explicit_cooldown(router):
+    router.record_failure("gemini", "pro", RuntimeError("404"), cooldown=model_router.FATAL_COOLDOWN_SEC)
+    router.clock.advance(BASE_COOLDOWN_SEC * 10)
+    assert _state(router, "pro") == OPEN
+
+
+def test_all_open_returns_the_first_to_recover(router):
+    for model, seconds in (("pro", 50), ("flash", 5), ("lite", 20)):
+        router.record_failure("gemini", model, RuntimeError("busy"), cooldown=seconds)
+    assert router.choose("gemini", CHAIN) == "flash"
+    # Con exclude nessuna alternativa forzata
+    assert router.choose("gemini", CHAIN, exclude={"pro"}) is None
+
+
+def test_error_rate_demotes_a_flaky_model(router):
+    for _ in range(3):
+        router.record_success("gemini", "pro", 0.5)
+        _fail(router, "pro")
+    assert _state(router, "pro") == CLOSED
+    assert router.choose("gemini", CHAIN) == "flash"
+
+
+def test_slow_p90_demotes_a_model(router, monkeypatch):
+    monkeypatch.setenv("AI_ROUTER_SLOW_P90_SEC", "10")
+    for _ in range(model_router.LATENCY_MIN_SAMPLES):
+        router.record_success("gemini", "pro", 25.0)
+        router.record_success("gemini", "flash", 2.0)
+    assert router.choose("gemini", ["pro", "flash"]) == "flash"
+    # Un modello veloce ma con molti errori resta dietro a quello lento
+    for _ in range(model_router.LATENCY_MIN_SAMPLES):
+        _fail(router, "flash")
+        router.record_success("gemini", "flash", 2.0)
+    assert router.choose("gemini", ["pro", "flash"]) == "pro"
+
+
+def test_few_slow_samples_do_not_demote(router, monkeypatch):
+    monkeypatch.setenv("AI_ROUTER_SLOW_P90_SEC", "10")
+    for _ in range(model_router.LATENCY_MIN_SAMPLES - 1):
+        router.record_success("gemini", "pro", 25.0)
+    assert router.choose("gemini", CHAIN) == "pro"
+
+
+def test_latency_percentile(router):
+    assert router.latency_percentile("gemini", "pro", 0.9) is None
+    for latency in (0.1, 0.2, 0.3, 0.4, 1.0):
+        router.record_success("gemini", "pro", latency)
+    assert router.latency_percentile("gemini", "pro", 0.5) == pytest.approx(0.3)
+    assert router.latency_percentile("gemini", "pro", 0.99, min_samples=10) is None
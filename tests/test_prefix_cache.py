@@ -0,0 +1,97 @@
+"""Associazione prefisso -> slot di llama-server (prefix_cache)."""
+
+from agents.prefix_cache import MIN_PREFIX_CHARS, SlotPinner, common_prefix_len, get_pinner, reset_pinner
+
+PREFIX_A = "A" * MIN_PREFIX_CHARS
+PREFIX_B = "B" * MIN_PREFIX_CHARS
+
+
+def test_common_prefix_len():
+    assert common_prefix_len("abcdef", "abcxyz") == 3
+    assert common_prefix_len("abc", "abc") == 3
+    assert common_prefix_len("", "abc") == 0
+    assert common_prefix_len("xbc", "abc") == 0
+
+
+def test_short_prompts_are_not_pinned():
+    pinner = SlotPinner(4)
+    assert pinner.pin("breve") is None
+    assert pinner.snapshot()["requests"] == 1
+
+
+def test_same_prefix_reuses_its_free_slot():
+    pinner = SlotPinner(4)
+    slot = pinner.pin(PREFIX_A + "dati 1")
+    pinner.release(slot)
+    assert pinner.pin(PREFIX_A + "dati 2") == slot
+    stats = pinner.snapshot()
+    assert stats["prefix_hits"] == 1
+    assert stats["reused_chars"] >= MIN_PREFIX_CHARS
+
+
+def test_concurrent_requests_spread_over_free_slots():
+    pinner = SlotPinner(3)
+    slots = [pinner.pin(PREFIX_A + str(i)) for i in range(3)]
+    assert sorted(slots) == [0, 1, 2]
+    # Tutti occupati: lo slot lo sceglie il server
+    assert pinner.pin(PREFIX_A + "x") is None
+    assert pinner.snapshot()["all_busy"] == 1
+    assert pinner.snapshot()["in_flight"] == 3
+
+
+def test_prefix_keeps_all_slots_that_processed_it():
+    pinner = SlotPinner(4)
+    first, second = pinner.pin(PREFIX_A + "1"), pinner.pin(PREFIX_A + "2")
+    pinner.release(first)
+    pinner.release(second)
+    # Di nuovo due richieste insieme: tornano sugli slot che hanno già il prefisso
+    assert {pinner.pin(PREFIX_A + "3"), pinner.pin(PREFIX_A + "4")} == {first, second}
+    assert pinner.snapshot()["prefixes"] == 1
+
+
+def test_idle_slot_of_least_recently_used_prefix_is_taken():
+    pinner = SlotPinner(2)
+    slot_a = pinner.pin(PREFIX_A)
+    slot_b = pinner.pin(PREFIX_B)
+    pinner.release(slot_a)
+    # B usa di nuovo il suo slot, A resta il meno recente e libero
+    pinner.release(slot_b)
+    pinner.pin(PREFIX_B)
+    prefix_c = "C" * MIN_PREFIX_CHARS
+    assert pinner.pin(prefix_c) == slot_a
+    assert pinner.snapshot()["evictions"] == 1
+
+
+def test_busy_slots_are_never_evicted():
+    pinner = SlotPinner(2)
+    pinner.pin(PREFIX_A)
+    pinner.pin(PREFIX_B)
+    assert pinner.pin("C" * MIN_PREFIX_CHARS) is None
+    assert pinner.snapshot()["evictions"] == 0
+
+
+def test_release_is_idempotent_and_ignores_none():
+    pinner = SlotPinner(2)
+    slot = pinner.pin(PREFIX_A)
+    pinner.release(slot)
+    pinner.release(slot)
+    pinner.release(None)
+    assert pinner.snapshot()["in_flight"] == 0
+
+
+def test_record_timings():
+    pinner = SlotPinner(1)
+    pinner.record_timings({"prompt_n": 100, "cache_n": 900, "prompt_ms": 12.5})
+    pinner.record_timings(None)
+    stats = pinner.snapshot()
+    assert (stats["prompt_tokens"], stats["cached_tokens"], stats["prompt_ms"]) == (100, 900, 12.5)
+
+
+def test_registry_recreates_pinner_when_slots_change():
+    server = "test-prefix:1"
+    pinner = get_pinner(server, 2)
+    assert get_pinner(server, 2) is pinner
+    assert get_pinner(server, 4) is not pinner
+    reset_pinner(server)
+    assert get_pinner(server, 4).total_slots == 4
+    reset_pinner(server)
@@ -0,0 +1,174 @@
+"""Token bucket, limiti RPM/TPM e lettura del Retry-After (rate_limiter)."""
+
+import types
+from email.utils import formatdate
+
+import pytest
+
+from agents import rate_limiter
+from agents.rate_limiter import (
+    RateLimiter,
+    TokenBucket,
+    is_rate_limit_error,
+    retry_after_seconds,
+)
+
+
+def _http_error(message: str = "", status: int = 429, headers: dict = None) -> Exception:
+    """Eccezione con la forma di quelle degli SDK (response.headers, status_code)."""
+    error = Exception(message)
+    error.status_code = status
+    error.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+    return error
+
+
+class TestTokenBucket:
+    def test_reserve_within_capacity_does_not_wait(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+        assert all(bucket.reserve(1, now) == 0.0 for _ in range(60))
+
+    def test_debt_makes_waits_fifo(self):
+        bucket = TokenBucket(60)  # 1 unità al secondo
+        now = bucket.updated
+        bucket.reserve(60, now)
+        assert bucket.reserve(1, now) == pytest.approx(1.0)
+        # Chi prenota dopo aspetta anche la quota già impegnata
+        assert bucket.reserve(1, now) == pytest.approx(2.0)
+
+    def test_refill_is_continuous_and_capped(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+        bucket.reserve(60, now)
+        assert bucket.reserve(10, now + 10) == 0.0
+        bucket.reserve(0, now + 1000)
+        assert bucket.tokens == pytest.approx(60)
+
+    def test_request_larger_than_bucket_passes_when_full(self):
+        bucket = TokenBucket(100)
+        now = bucket.updated
+        assert bucket.reserve(500, now) == 0.0
+        assert bucket.tokens == pytest.approx(0.0)
+
+    def test_adjust_and_drain(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+        bucket.reserve(10, now)
+        bucket.adjust(20, now)  # 20 token reali in più della stima
+        assert bucket.tokens == pytest.approx(30)
+        bucket.drain(now)
+        assert bucket.reserve(1, now) == pytest.approx(1.0)
+
+
+class TestRateLimiter:
+    def test_rpm_limit(self):
+        limiter = RateLimiter(rpm=2)
+        assert limiter.reserve() == 0.0
+        assert limiter.reserve() == 0.0
+        assert limiter.reserve() == pytest.approx(30.0, abs=0.1)
+        assert limiter.stats["throttled"] == 1
+
+    def test_tpm_limit_uses_token_estimate(self):
+        limiter = RateLimiter(tpm=600)
+        assert limiter.reserve(600) == 0.0
+        assert limiter.reserve(100) == pytest.approx(10.0, abs=0.1)
+
+    def test_penalize_blocks_for_retry_after(self):
+        limiter = RateLimiter(rpm=100)
+        limiter.penalize(12.0)
+        assert limiter.reserve() == pytest.approx(12.0, abs=0.1)
+        assert limiter.stats["rate_limited"] == 1
+
+    def test_penalize_without_hint_uses_default(self):
+        limiter = RateLimiter()
+        limiter.penalize(None)
+        assert limiter.reserve() == pytest.approx(rate_limiter.DEFAULT_PENALTY_SEC, abs=0.1)
+
+
+class TestRetryAfter:
+    def test_retry_after_ms_header_wins(self):
+        error = _http_error(headers={"retry-after-ms": "1500", "retry-after": "9"})
+        assert retry_after_seconds(error) == pytest.approx(1.5)
+
+    def test_retry_after_seconds_header(self):
+        assert retry_after_seconds(_http_error(headers={"retry-after": "7"})) == 7.0
+
+    def test_retry_after_http_date(self):
+        when = formatdate(rate_limiter.time.time() + 30, usegmt=True)
+        assert retry_after_seconds(_http_error(headers={"retry-after": when})) == pytest.approx(30, abs=2)
+
+    def test_retry_after_date_in_the_past_is_zero(self):
+        assert retry_after_seconds(_http_error(headers={"retry-after": formatdate(0, usegmt=True)})) == 0.0
+
+    def test_invalid_header_falls_back_to_message(self):
+        error = _http_error("Please retry in 3.5s.", headers={"retry-after": "soon"})
+        assert retry_after_seconds(error) == pytest.approx(3.5)
+
+    def test_gemini_retry_delay_in_message(self):
+        error = Exception("429 RESOURCE_EXHAUSTED {'retryDelay': '41s'}")
+        assert retry_after_seconds(error) == 41.0
+
+    def test_no_hint(self):
+        assert retry_after_seconds(Exception("boom")) is None
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        _http_error(status=429),
+        type("RateLimitError", (Exception,), {})("slow down"),
+        Exception("429 RESOURCE_EXHAUSTED"),
+    ],
+)
+def test_is_rate_limit_error(error):
+    assert is_rate_limit_error(error)
+
+
+def test_other_errors_are_not_rate_limits():
+    assert not is_rate_limit_error(_http_error(status=503))
+    assert not is_rate_limit_error(ValueError("bad input"))
+
+
+class TestLimitResolution:
+    @pytest.fixture(autouse=True)
+    def _clean_registry(self, monkeypatch):
+        monkeypatch.delenv("AI_RATE_LIMITS", raising=False)
+        monkeypatch.delenv("AI_RATE_LIMIT", raising=False)
+        monkeypatch.setattr(rate_limiter, "_limiters", {})
+        monkeypatch.setattr(rate_limiter, "_overrides", {})
+
+    def test_no_limits_unless_configured(self):
+        assert rate_limiter.get_limiter("gemini", "gemini-2.5-pro") is None
+        assert rate_limiter.get_limiter("groq", "qualsiasi") is None
+
+    def test_env_json_limits(self, monkeypatch):
+        monkeypatch.setenv("AI_RATE_LIMITS", '{"groq": {"*": {"rpm": 30, "tpm": 12000}}}')
+        limiter = rate_limiter.get_limiter("groq", "llama")
+        assert limiter.rpm_bucket.capacity == 30
+        assert limiter.tpm_bucket.capacity == 12000
+        assert rate_limiter.get_limiter("gemini", "flash") is None
+
+    def test_free_tier_preset(self, monkeypatch):
+        monkeypatch.setenv("AI_RATE_LIMITS", "free_tier")
+        limiter = rate_limiter.get_limiter("gemini", "gemini-2.5-pro")
+        assert limiter.rpm_bucket.capacity == rate_limiter.FREE_TIER_LIMITS["gemini"]["gemini-2.5-pro"]["rpm"]
+
+    def test_configure_rate_limit_overrides_env(self, monkeypatch):
+        monkeypatch.setenv("AI_RATE_LIMITS", '{"groq": {"*": {"rpm": 30}}}')
+        rate_limiter.configure_rate_limit("groq", rpm=5)
+        assert rate_limiter.get_limiter("groq", "llama").rpm_bucket.capacity == 5
+
+    def test_unconfigured_model_is_still_paused_after_429(self):
+        rate_limiter.note_rate_limited("groq", "llama", _http_error(headers={"retry-after": "20"}))
+        limiter = rate_limiter.get_limiter("groq", "llama")
+        assert limiter is not None
+        assert limiter.reserve() == pytest.approx(20.0, abs=0.5)
+
+    def test_first_block_is_logged_once(self, capsys):
+        limiter = RateLimiter(rpm=1, name="groq/llama")
+        limiter.reserve()
+        limiter.reserve()
+        limiter.reserve()
+        out = capsys.readouterr().out
+        assert out.count("groq/llama") == 1
+        assert "1 rpm" in out
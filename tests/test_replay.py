@@ -0,0 +1,168 @@
+"""Cassette e provider "replay": registrazione e riproduzione deterministica (replay)."""
+
+import asyncio
+import types
+
+import pytest
+
+from agents.ai_provider import ReplayWrapper, TextResponse
+from agents.replay import (
+    AUTO,
+    RECORD,
+    REPLAY,
+    Cassette,
+    get_cassette,
+    replay_delay,
+    replay_key,
+    replay_mode,
+)
+
+
+@pytest.fixture(autouse=True)
+def _instant(monkeypatch):
+    monkeypatch.setenv("AI_REPLAY_SPEED", "0")
+    monkeypatch.delenv("AI_REPLAY_MODE", raising=False)
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    return Cassette(str(tmp_path / "cassette.jsonl"))
+
+
+class _Inner:
+    """Modello reale finto usato in registrazione."""
+
+    def __init__(self, text="risposta reale"):
+        self.text = text
+        self.calls = 0
+
+    def _response(self):
+        self.calls += 1
+        return TextResponse(
+            self.text, model="real-model", provider="gemini", input_tokens=3, output_tokens=2
+        )
+
+    def generate_content(self, prompt):
+        return self._response()
+
+    async def agenerate_content(self, prompt):
+        return self._response()
+
+    def generate_stream(self, prompt, on_complete=None):
+        yield "risposta "
+        yield "reale"
+        if on_complete:
+            on_complete(self._response())
+
+
+def _wrapper(cassette, mode, inner=None, json_mode=False):
+    recorder = None
+    if inner is not None:
+        recorder = types.SimpleNamespace(
+            provider_type="gemini",
+            current_model_name="real-model",
+            _create_wrapper=lambda _json_mode: inner,
+        )
+    provider = types.SimpleNamespace(
+        cassette=cassette, replay_mode=mode, replay_recorder=recorder, current_model_name="replay"
+    )
+    return ReplayWrapper(provider, json_mode)
+
+
+def _entry(key, text, **extra):
+    return {"key": key, "text": text, "model": "m", "latency_sec": 0.5, **extra}
+
+
+def test_mode_validation(monkeypatch):
+    assert replay_mode() == REPLAY
+    monkeypatch.setenv("AI_REPLAY_MODE", "AUTO")
+    assert replay_mode() == AUTO
+    monkeypatch.setenv("AI_REPLAY_MODE", "boh")
+    with pytest.raises(ValueError):
+        replay_mode()
+
+
+@pytest.mark.parametrize("speed, expected", [("1", 2.0), ("2", 1.0), ("0", 0.0)])
+def test_replay_delay_scales_with_speed(monkeypatch, speed, expected):
+    monkeypatch.setenv("AI_REPLAY_SPEED", speed)
+    assert replay_delay(2.0) == expected
+    assert replay_delay(None) == 0.0
+
+
+def test_key_ignores_model_but_not_json_mode():
+    assert replay_key(False, "ciao") == replay_key(False, "ciao")
+    assert replay_key(False, "ciao") != replay_key(True, "ciao")
+    assert replay_key(False, "ciao") != replay_key(False, "addio")
+
+
+def test_entries_replayed_in_order_and_wrap(cassette):
+    cassette.record(_entry("k", "uno"))
+    cassette.record(_entry("k", "due"))
+    assert [cassette.next("k")["text"] for _ in range(3)] == ["uno", "due", "uno"]
+    assert cassette.next("assente") is None
+    assert cassette.snapshot()["missing"] == 1
+
+
+def test_cassette_persists_to_jsonl(cassette):
+    cassette.record(_entry("k", "salvata"))
+    reloaded = Cassette(cassette.path)
+    assert len(reloaded) == 1
+    assert reloaded.next("k")["text"] == "salvata"
+
+
+def test_get_cassette_is_shared_per_path(tmp_path):
+    path = str(tmp_path / "shared.jsonl")
+    assert get_cassette(path) is get_cassette(path)
+
+
+def test_replay_mode_without_recording_raises(cassette):
+    with pytest.raises(RuntimeError, match="nessuna risposta registrata"):
+        _wrapper(cassette, REPLAY).generate_content("ciao")
+
+
+def test_replay_returns_recorded_response(cassette):
+    cassette.record(_entry(replay_key(False, "ciao"), "registrata", input_tokens=4))
+    response = _wrapper(cassette, REPLAY).generate_content("ciao")
+    assert response.text == "registrata"
+    assert response.provider == "replay"
+    assert response.input_tokens == 4
+
+
+def test_async_replay(cassette):
+    cassette.record(_entry(replay_key(False, "ciao"), "registrata"))
+    response = asyncio.run(_wrapper(cassette, REPLAY).agenerate_content("ciao"))
+    assert response.text == "registrata"
+
+
+def test_auto_records_then_replays(cassette):
+    inner = _Inner()
+    wrapper = _wrapper(cassette, AUTO, inner)
+    assert wrapper.generate_content("ciao").text == "risposta reale"
+    assert wrapper.generate_content("ciao").text == "risposta reale"
+    assert inner.calls == 1
+    assert cassette.snapshot()["recorded"] == 1
+
+
+def test_record_mode_always_calls_provider(cassette):
+    inner = _Inner()
+    wrapper = _wrapper(cassette, RECORD, inner)
+    wrapper.generate_content("ciao")
+    wrapper.generate_content("ciao")
+    assert inner.calls == 2
+    assert len(cassette) == 2
+
+
+def test_error_text_is_not_recorded_from_stream(cassette):
+    wrapper = _wrapper(cassette, RECORD, _Inner())
+    wrapper.inner.generate_stream = lambda prompt, on_complete=None: iter(["❌ Errore"])
+    assert list(wrapper.generate_stream("ciao")) == ["❌ Errore"]
+    assert len(cassette) == 0
+
+
+def test_stream_recorded_and_replayed_as_chunks(cassette):
+    assert list(_wrapper(cassette, AUTO, _Inner()).generate_stream("ciao")) == ["risposta ", "reale"]
+    summaries = []
+    chunks = list(_wrapper(cassette, REPLAY).generate_stream("ciao", on_complete=summaries.append))
+    assert chunks == ["risposta ", "reale"]
+    assert summaries[0].text == "risposta reale"
+    assert summaries[0].stream
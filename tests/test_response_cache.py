@@ -0,0 +1,122 @@
+"""Chiavi di cache, TTL, eviction LRU e statistiche (response_cache)."""
+
+import pytest
+
+from agents import response_cache
+from agents.response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path, fake_clock):
+    clock = fake_clock(response_cache)
+    store = ResponseCache(path=str(tmp_path / "responses.sqlite3"), ttl_sec=60, max_bytes=1000)
+    store.clock = clock
+    return store
+
+
+class TestMakeCacheKey:
+    def test_equivalent_text_prompts_share_a_key(self):
+        a = make_cache_key("gemini", "m", False, "ciao  \r\nmondo\n")
+        b = make_cache_key("gemini", "m", False, "ciao\nmondo")
+        assert a == b
+
+    def test_provider_model_and_json_mode_change_the_key(self):
+        base = make_cache_key("gemini", "m", False, "x")
+        assert make_cache_key("groq", "m", False, "x") != base
+        assert make_cache_key("gemini", "n", False, "x") != base
+        assert make_cache_key("gemini", "m", True, "x") != base
+
+    def test_multimodal_bytes_are_hashed(self):
+        image = {"mime_type": "image/png", "data": b"\x89PNG-1"}
+        same = {"mime_type": "image/png", "data": b"\x89PNG-1"}
+        other = {"mime_type": "image/png", "data": b"\x89PNG-2"}
+        key = make_cache_key("gemini", "m", False, ["descrivi", image])
+        assert make_cache_key("gemini", "m", False, ["descrivi", same]) == key
+        assert make_cache_key("gemini", "m", False, ["descrivi", other]) != key
+        assert make_cache_key("gemini", "m", False, ["descrivi", {**image, "mime_type": "image/jpeg"}]) != key
+
+    def test_parts_do_not_collide_by_concatenation(self):
+        assert make_cache_key("p", "m", False, ["ab", "c"]) != make_cache_key("p", "m", False, ["a", "bc"])
+
+    def test_api_key_is_part_of_the_key_only_as_hash(self):
+        key = make_cache_key("groq", "m", False, "x", api_key="sk-uno")
+        assert make_cache_key("groq", "m", False, "x", api_key="sk-uno") == key
+        assert make_cache_key("groq", "m", False, "x", api_key="sk-due") != key
+        assert make_cache_key("groq", "m", False, "x") != key
+
+    def test_pdf_pages_and_max_chars_change_the_key(self):
+        pdf = {"mime_type": "application/pdf", "data": b"%PDF-1.7"}
+        key = make_cache_key("p", "m", False, [pdf])
+        first = make_cache_key("p", "m", False, [{**pdf, "pages": [0, 1]}])
+        assert first != key
+        assert make_cache_key("p", "m", False, [{**pdf, "pages": (0, 1)}]) == first
+        assert make_cache_key("p", "m", False, [{**pdf, "pages": [0, 2]}]) != first
+        assert make_cache_key("p", "m", False, [{**pdf, "max_chars": 500}]) != key
+        # None equivale a opzione assente
+        assert make_cache_key("p", "m", False, [{**pdf, "pages": None}]) == key
+
+    def test_pages_generator_is_materialized_once(self):
+        pdf = {"mime_type": "application/pdf", "data": b"%PDF-1.7"}
+        part = {**pdf, "pages": (i for i in (0, 1))}
+        key = make_cache_key("p", "m", False, [part])
+        assert part["pages"] == (0, 1)
+        assert key == make_cache_key("p", "m", False, [{**pdf, "pages": [0, 1]}])
+        # La stessa parte produce la stessa chiave anche alla seconda chiamata
+        assert make_cache_key("p", "m", False, [part]) == key
+
+
+class TestResponseCache:
+    def test_hit_and_miss_stats(self, cache):
+        assert cache.get("k") is None
+        cache.set("k", "valore")
+        assert cache.get("k") == "valore"
+        assert cache.get("k") == "valore"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["stores"]) == (2, 1, 1)
+        assert stats["hit_rate"] == pytest.approx(2 / 3)
+        assert stats["entries"] == 1
+        assert stats["size_bytes"] == len("valore")
+
+    def test_entries_expire_after_ttl(self, cache):
+        cache.set("k", "valore")
+        cache.clock.advance(59)
+        assert cache.get("k") == "valore"
+        cache.clock.advance(2)
+        assert cache.get("k") is None
+        stats = cache.stats()
+        assert stats["expired"] == 1
+        assert stats["entries"] == 0
+
+    def test_expired_entries_are_purged_on_write(self, cache):
+        cache.set("old", "a")
+        cache.clock.advance(61)
+        cache.set("new", "b")
+        assert cache.stats()["entries"] == 1
+        assert cache.stats()["expired"] == 1
+
+    def test_lru_eviction_is_bounded_in_bytes(self, cache):
+        for name in ("a", "b", "c"):
+            cache.set(name, "x" * 300)
+            cache.clock.advance(1)
+        # "a" letta per ultima: la meno recente diventa "b"
+        assert cache.get("a") is not None
+        cache.clock.advance(1)
+        cache.set("d", "x" * 300)
+        stats = cache.stats()
+        assert stats["size_bytes"] <= 900
+        assert stats["evictions"] == 1
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("d") is not None
+
+    def test_eviction_goes_below_ninety_percent(self, cache):
+        for i in range(5):
+            cache.set(f"k{i}", "x" * 250)
+            cache.clock.advance(1)
+        assert cache.stats()["size_bytes"] <= 900
+
+    def test_overwrite_replaces_value(self, cache):
+        cache.set("k", "uno")
+        cache.set("k", "due")
+        assert cache.get("k") == "due"
+        assert cache.stats()["entries"] == 1
@@ -0,0 +1,200 @@
+"""Classificazione degli errori, backoff, retry budget e call_with_retry (retry_policy)."""
+
+import asyncio
+import types
+
+import pytest
+
+from agents import retry_policy
+from agents.retry_policy import (
+    RetryBudget,
+    RetryPolicy,
+    acall_with_retry,
+    call_with_retry,
+    classify_error,
+    retry_stream,
+    set_retry_policy,
+)
+
+
+def _status_error(status: int, message: str = "", headers: dict = None) -> Exception:
+    error = Exception(message or f"HTTP {status}")
+    error.status_code = status
+    error.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+    return error
+
+
+class APIConnectionError(Exception):
+    """Stesso nome dell'eccezione degli SDK OpenAI/Groq (confronto per nome sulla MRO)."""
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        (_status_error(429), "rate_limit"),
+        (_status_error(503), "server"),
+        (_status_error(529), "server"),
+        (_status_error(400), None),
+        (_status_error(401), None),
+        (APIConnectionError("reset"), "connection"),
+        (ConnectionRefusedError(), "connection"),
+        (TimeoutError(), "connection"),
+        (Exception("429 RESOURCE_EXHAUSTED"), "rate_limit"),
+        (ValueError("bad json"), None),
+    ],
+)
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_classify_follows_the_cause_chain():
+    try:
+        try:
+            raise ConnectionResetError("peer")
+        except ConnectionResetError as e:
+            raise RuntimeError("Errore wrapper") from e
+    except RuntimeError as wrapped:
+        assert classify_error(wrapped) == "connection"
+
+
+class TestRetryPolicy:
+    def test_gives_up_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        error = _status_error(503)
+        assert policy.delay(0, error) is not None
+        assert policy.delay(1, error) is not None
+        assert policy.delay(2, error) is None
+
+    def test_non_transient_errors_are_not_retried(self):
+        assert RetryPolicy().delay(0, _status_error(400)) is None
+
+    def test_full_jitter_backoff_is_bounded(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for attempt in range(8):
+            for _ in range(50):
+                assert 0.0 <= policy.backoff(attempt) <= min(5.0, 2.0**attempt)
+
+    def test_retry_after_is_honoured_with_small_jitter(self):
+        policy = RetryPolicy(base_delay=0.5)
+        delay = policy.delay(0, _status_error(429, headers={"retry-after": "4"}))
+        assert 4.0 <= delay <= 4.5
+
+    def test_retry_after_above_cap_gives_up(self):
+        policy = RetryPolicy(max_retry_after=10)
+        assert policy.delay(0, _status_error(429, headers={"retry-after": "30"})) is None
+
+
+class TestRetryBudget:
+    def test_min_retries_then_ratio(self, fake_clock):
+        fake_clock(retry_policy)
+        budget = RetryBudget(ratio=0.5, min_retries=2)
+        assert budget.try_spend() and budget.try_spend()
+        assert not budget.try_spend()
+        for _ in range(4):
+            budget.record_request()
+        # 2 + 0.5 * 4 = 4 retry nella finestra
+        assert budget.try_spend() and budget.try_spend()
+        assert not budget.try_spend()
+
+    def test_window_slides(self, fake_clock):
+        clock = fake_clock(retry_policy)
+        budget = RetryBudget(ratio=0.0, min_retries=1, window=60)
+        assert budget.try_spend()
+        assert not budget.try_spend()
+        clock.advance(61)
+        assert budget.try_spend()
+
+
+@pytest.fixture
+def fast_policy(monkeypatch):
+    """Politica senza attese per un provider dedicato al test, budget ampio."""
+    provider = "test-retry"
+    set_retry_policy(provider, RetryPolicy(max_attempts=3, base_delay=0.0))
+    monkeypatch.setitem(retry_policy._budgets, provider, RetryBudget(ratio=1.0, min_retries=100))
+    yield provider
+    set_retry_policy(provider, None)
+
+
+def test_call_with_retry_recovers_from_transient_errors(fast_policy):
+    outcomes = [_status_error(503), APIConnectionError("reset"), "ok"]
+    seen = []
+
+    def fn():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call_with_retry(fast_policy, "m", fn, on_retry=seen.append) == ("ok", 2)
+    assert len(seen) == 2
+    assert retry_policy.retry_stats()[f"{fast_policy}/m"]["retries"] >= 2
+
+
+def test_call_with_retry_raises_the_last_error(fast_policy):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _status_error(502)
+
+    with pytest.raises(Exception, match="HTTP 502"):
+        call_with_retry(fast_policy, "m", fn)
+    assert len(calls) == 3
+
+
+def test_call_with_retry_does_not_retry_client_errors(fast_policy):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _status_error(401)
+
+    with pytest.raises(Exception):
+        call_with_retry(fast_policy, "m", fn)
+    assert len(calls) == 1
+
+
+def test_exhausted_budget_stops_retries(fast_policy, monkeypatch):
+    monkeypatch.setitem(retry_policy._budgets, fast_policy, RetryBudget(ratio=0.0, min_retries=0))
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _status_error(503)
+
+    with pytest.raises(Exception):
+        call_with_retry(fast_policy, "m", fn)
+    assert len(calls) == 1
+
+
+def test_acall_with_retry(fast_policy):
+    outcomes = [_status_error(500), "ok"]
+
+    async def afn():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(acall_with_retry(fast_policy, "m", afn)) == ("ok", 1)
+
+
+def test_stream_is_retried_only_before_the_first_chunk(fast_policy):
+    opened = []
+
+    def open_stream():
+        opened.append(1)
+        if len(opened) == 1:
+            raise _status_error(503)
+
+        def chunks():
+            yield "a"
+            raise APIConnectionError("dropped")
+
+        return chunks()
+
+    stream = retry_stream(fast_policy, "m", open_stream)
+    assert next(stream) == "a"
+    with pytest.raises(APIConnectionError):
+        next(stream)
+    assert len(opened) == 2
@@ -0,0 +1,141 @@
+"""Richieste identiche in volo condividono una chiamata (single_flight)."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agents.single_flight import SingleFlight
+
+
+def _wait_registered(group: SingleFlight, count: int) -> None:
+    """Attende che `count` richieste siano state registrate (leader o accodate)."""
+    deadline = time.monotonic() + 5
+    while group.stats()["leaders"] + group.stats()["coalesced"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def _run_concurrently(group: SingleFlight, keys, fn):
+    """Lancia do(key, fn) per ogni chiave e attende che tutte le chiamate siano in volo."""
+    with ThreadPoolExecutor(len(keys)) as pool:
+        futures = [pool.submit(group.do, key, fn, "test/m") for key in keys]
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_identical_requests_share_one_call():
+    group = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(5) as pool:
+        futures = [pool.submit(group.do, "k", fn, "test/m") for _ in range(5)]
+        # Tutte le richieste registrate prima che il leader finisca
+        _wait_registered(group, 5)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert results == ["result"] * 5
+    assert calls == [1]
+    stats = group.stats()
+    assert stats["by_model"]["test/m"] == {"leaders": 1, "coalesced": 4}
+    assert stats["in_flight"] == 0
+
+
+def test_errors_are_shared_and_not_cached():
+    group = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(group.do, "k", failing) for _ in range(3)]
+        _wait_registered(group, 3)
+        release.set()
+        errors = [f.exception() for f in futures]
+
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    # Finita la chiamata la chiave è libera: la richiesta successiva riparte
+    assert group.do("k", lambda: "ok") == "ok"
+
+
+def test_different_keys_are_independent():
+    group = SingleFlight()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fn():
+        barrier.wait()
+        return threading.get_ident()
+
+    results = _run_concurrently(group, ["a", "b", "c"], fn)
+    assert len(set(results)) == 3
+    assert group.stats()["leaders"] == 3
+
+
+def test_async_requests_share_one_task():
+    group = SingleFlight()
+    calls = []
+
+    async def afn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(group.ado("k", afn, "test/m") for _ in range(4)))
+
+    assert asyncio.run(main()) == ["result"] * 4
+    assert calls == [1]
+    assert group.stats()["coalesced"] == 3
+
+
+def test_cancelling_one_waiter_keeps_the_shared_task():
+    group = SingleFlight()
+
+    async def afn():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(group.ado("k", afn))
+        second = asyncio.ensure_future(group.ado("k", afn))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_cancelling_every_waiter_cancels_the_task():
+    group = SingleFlight()
+    started = []
+    finished = []
+
+    async def afn():
+        started.append(1)
+        await asyncio.sleep(1)
+        finished.append(1)
+
+    async def main():
+        waiters = [asyncio.ensure_future(group.ado("k", afn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert started == [1]
+    assert finished == []
+    assert group.stats()["in_flight"] == 0